@@ -0,0 +1,301 @@
+# analytics.py - Vectorized churn, cohort, MRR movement and LTV metrics for the admin dashboard
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from itertools import islice
+import logging
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; only the analytics need it (pip install numpy)
+    np = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 50000
+
+# Month index for subscriptions that have not ended
+NEVER = 2 ** 31 - 1
+
+# Statuses of subscriptions that never started (no payment was ever taken)
+NEVER_STARTED = ('incomplete', 'incomplete_expired')
+ENDED_STATUSES = ('canceled', 'unpaid')
+
+# Largest (subscription, month) grid aggregated densely (8 bytes per cell); sparser data is sorted
+DENSE_CELLS = 16_000_000
+
+# Per billing interval: monthly equivalent of one invoice's amount, and the months it pays for.
+# Weekly and daily invoices are scaled to a month, so four and five invoice months match.
+BILLING_TERMS = {'month': (1.0, 1), 'year': (1 / 12, 12), 'week': (52 / 12, 1), 'day': (365 / 12, 1)}
+
+# Month indexes (year * 12 + month - 1) of each subscription's start and end
+SubscriptionColumns = namedtuple('SubscriptionColumns', ['start_month', 'end_month'])
+
+# Paid invoices: subscription and price as integer codes, amount as float
+InvoiceColumns = namedtuple('InvoiceColumns', ['subscription', 'paid_month', 'amount', 'price', 'price_ids'])
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured("Billing analytics need NumPy: pip install numpy")
+
+def month_index(value):
+    """Calendar month of a datetime as a single integer (UTC months)"""
+    return value.year * 12 + value.month - 1
+
+def month_label(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+def column_chunks(queryset, fields, chunk_size=CHUNK_SIZE):
+    """Yield the columns of `fields` as tuples, `chunk_size` rows at a time"""
+    rows = queryset.order_by().values_list(*fields).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield list(zip(*chunk))
+
+def concatenate(parts, dtype):
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+def load_subscriptions(chunk_size=CHUNK_SIZE):
+    """Start and end months of every subscription that ever started"""
+    from .models import UserSubscription
+
+    require_numpy()
+    starts, ends = [], []
+    queryset = UserSubscription.objects.exclude(status__in=NEVER_STARTED)
+    for created, status, canceled, updated in column_chunks(
+        queryset, ['created_at', 'status', 'canceled_at', 'updated_at'], chunk_size
+    ):
+        starts.append(np.fromiter(map(month_index, created), np.int32, len(created)))
+        ends.append(np.fromiter(
+            (
+                month_index(canceled_at or updated_at) if row_status in ENDED_STATUSES else NEVER
+                for row_status, canceled_at, updated_at in zip(status, canceled, updated)
+            ),
+            np.int32, len(status),
+        ))
+    return SubscriptionColumns(concatenate(starts, np.int32), concatenate(ends, np.int32))
+
+def load_invoices(currency, chunk_size=CHUNK_SIZE):
+    """
+    Paid subscription invoices in `currency`, with string IDs turned into integer codes.
+
+    One-off invoices (no Stripe subscription) are not recurring revenue and are left out.
+    """
+    from .models import Invoice
+
+    require_numpy()
+    subscriptions, months, amounts, prices = [], [], [], []
+    queryset = Invoice.objects.filter(
+        status='paid', paid_at__isnull=False, currency=currency
+    ).exclude(stripe_subscription_id='')
+    for subscription_ids, paid_at, amount, price_ids in column_chunks(
+        queryset, ['stripe_subscription_id', 'paid_at', 'amount', 'stripe_price_id'], chunk_size
+    ):
+        subscriptions.append(np.array(subscription_ids))
+        months.append(np.fromiter(map(month_index, paid_at), np.int32, len(paid_at)))
+        amounts.append(np.array(amount, dtype=np.float64))
+        prices.append(np.array(price_ids))
+
+    if not months:
+        empty = np.empty(0, dtype=np.int64)
+        return InvoiceColumns(empty, empty.astype(np.int32), empty.astype(np.float64), empty, ())
+
+    _, subscription_codes = np.unique(np.concatenate(subscriptions), return_inverse=True)
+    price_ids, price_codes = np.unique(np.concatenate(prices), return_inverse=True)
+    return InvoiceColumns(
+        subscription_codes, np.concatenate(months), np.concatenate(amounts), price_codes, tuple(price_ids.tolist())
+    )
+
+def price_terms(price_ids):
+    """
+    Monthly equivalent of an invoice's amount (its share), and the number of months it
+    pays for, per price code (from the plan catalog).
+
+    A yearly invoice is spread over its twelve months; weekly and daily invoices are
+    scaled by 52/12 and 365/12.
+    """
+    from .plan_catalog import get_catalog
+
+    catalog = get_catalog()
+    shares = np.ones(len(price_ids), dtype=np.float64)
+    covered = np.ones(len(price_ids), dtype=np.int64)
+    for code, price_id in enumerate(price_ids):
+        plan = catalog.for_price(price_id)
+        if plan:
+            shares[code], covered[code] = BILLING_TERMS.get(plan.billing_interval, (1.0, 1))
+    return shares, covered
+
+def churn(subscriptions, first_month, last_month):
+    """Active subscriptions at the start of each month, and how many of them ended in it"""
+    months = np.arange(first_month, last_month + 1)
+    starts = np.sort(subscriptions.start_month)
+    ends = np.sort(subscriptions.end_month)
+
+    # Started before the month and not ended before it
+    active = np.searchsorted(starts, months) - np.searchsorted(ends, months)
+
+    ended = subscriptions.end_month
+    counted = (ended >= first_month) & (ended <= last_month) & (subscriptions.start_month < ended)
+    churned = np.bincount(ended[counted] - first_month, minlength=len(months))
+
+    rate = np.divide(churned, active, out=np.zeros(len(months)), where=active > 0)
+    return active, churned, rate
+
+def cohort_retention(subscriptions, first_month, last_month):
+    """
+    Share of each monthly cohort still subscribed k months after it started.
+
+    retention[c, k] is NaN where cohort c + k lies in the future.
+    """
+    cohorts = last_month - first_month + 1
+    width = cohorts + 1  # lifetimes 0..cohorts-1, plus "still active"
+
+    in_window = (subscriptions.start_month >= first_month) & (subscriptions.start_month <= last_month)
+    cohort = subscriptions.start_month[in_window] - first_month
+    lifetime = np.minimum(
+        subscriptions.end_month[in_window].astype(np.int64) - subscriptions.start_month[in_window], width - 1
+    )
+
+    counts = np.bincount(cohort * width + lifetime, minlength=cohorts * width).reshape(cohorts, width)
+    # survivors[c, k]: subscriptions of cohort c that lasted at least k months
+    survivors = counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+    sizes = survivors[:, 0]
+
+    retained = survivors[:, 1:].astype(np.float64)
+    retention = np.divide(retained, sizes[:, None], out=np.zeros_like(retained), where=sizes[:, None] > 0)
+    future = np.arange(cohorts)[:, None] + np.arange(cohorts)[None, :] > cohorts - 1
+    retention[future] = np.nan
+    return sizes, retention
+
+def mrr_movement(invoices, shares, covered, first_month, last_month):
+    """
+    MRR per month split into new, expansion, contraction and churned MRR.
+
+    Each paid invoice contributes its monthly equivalent (see price_terms) to every month
+    it pays for. A subscription's MRR in a month is the mean of those contributions, so
+    the number of weekly invoices falling in a month does not change it, and it is
+    compared with the previous month.
+    """
+    months = last_month - first_month + 1
+    if not len(invoices.amount):
+        zeros = np.zeros(months)
+        return {name: zeros for name in ('mrr', 'new', 'expansion', 'contraction', 'churned')}
+
+    cover = covered[invoices.price]
+    monthly = np.repeat(invoices.amount * shares[invoices.price], cover)
+    subscription = np.repeat(invoices.subscription.astype(np.int64), cover)
+    offsets = np.arange(len(monthly)) - np.repeat(np.cumsum(cover) - cover, cover)
+    month = np.repeat(invoices.paid_month.astype(np.int64), cover) + offsets
+
+    # One key per (subscription, month); the span leaves a gap month between subscriptions
+    base = month.min()
+    span = month.max() - base + 2
+    cells = subscription * span + (month - base)
+    if (subscription.max() + 1) * span <= DENSE_CELLS:
+        # A bincount over the whole grid avoids sorting millions of keys
+        counts = np.bincount(cells)
+        keys = np.flatnonzero(counts)
+        mrr = np.bincount(cells, weights=monthly)[keys] / counts[keys]
+    else:
+        keys, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        mrr = np.bincount(inverse, weights=monthly) / counts
+    key_month = keys % span + base
+
+    def lookup(targets):
+        position = np.minimum(np.searchsorted(keys, targets), len(keys) - 1)
+        return position, keys[position] == targets
+
+    previous, has_previous = lookup(keys - 1)
+    _, has_next = lookup(keys + 1)
+    delta = mrr - np.where(has_previous, mrr[previous], 0.0)
+
+    def per_month(values, at_month):
+        in_window = (at_month >= first_month) & (at_month <= last_month)
+        return np.bincount(at_month[in_window] - first_month, weights=values[in_window], minlength=months)
+
+    return {
+        'mrr': per_month(mrr, key_month),
+        'new': per_month(np.where(has_previous, 0.0, mrr), key_month),
+        'expansion': per_month(np.where(has_previous & (delta > 0), delta, 0.0), key_month),
+        'contraction': per_month(np.where(has_previous & (delta < 0), -delta, 0.0), key_month),
+        # MRR that is gone the month after a subscription's last paid month
+        'churned': per_month(np.where(has_next, 0.0, mrr), key_month + 1),
+    }
+
+def lifetime_value(active, churned, mrr, invoices):
+    """LTV as ARPU / monthly churn over the window, plus realised revenue per subscription"""
+    active_months = active.sum()
+    arpu = mrr.sum() / active_months if active_months else 0.0
+    churn_rate = churned.sum() / active_months if active_months else 0.0
+    paying = np.count_nonzero(np.bincount(invoices.subscription)) if len(invoices.subscription) else 0
+    return {
+        'arpu': round(float(arpu), 2),
+        'monthly_churn_rate': round(float(churn_rate), 4),
+        'ltv': round(float(arpu / churn_rate), 2) if churn_rate else None,
+        'revenue_per_subscription': round(float(invoices.amount.sum() / paying), 2) if paying else 0.0,
+    }
+
+def compute_analytics(subscriptions, invoices, shares, covered, first_month, last_month):
+    """All metrics for the months `first_month`..`last_month` from preloaded columns"""
+    active, churned, rate = churn(subscriptions, first_month, last_month)
+    sizes, retention = cohort_retention(subscriptions, first_month, last_month)
+    movement = mrr_movement(invoices, shares, covered, first_month, last_month)
+
+    labels = [month_label(index) for index in range(first_month, last_month + 1)]
+    return {
+        'months': labels,
+        'churn': [
+            {'month': label, 'active': int(start), 'churned': int(lost), 'rate': round(float(share), 4)}
+            for label, start, lost, share in zip(labels, active, churned, rate)
+        ],
+        'cohorts': [
+            {'month': label, 'size': int(size),
+             'retention': [None if np.isnan(share) else round(float(share), 4) for share in row]}
+            for label, size, row in zip(labels, sizes, retention)
+        ],
+        'mrr_movement': [
+            {'month': label, **{name: round(float(values[index]), 2) for name, values in movement.items()},
+             'net_new': round(float(movement['new'][index] + movement['expansion'][index]
+                                    - movement['contraction'][index] - movement['churned'][index]), 2)}
+            for index, label in enumerate(labels)
+        ],
+        'ltv': lifetime_value(active, churned, movement['mrr'], invoices),
+    }
+
+def billing_analytics(months=12, currency='usd', refresh=False):
+    """
+    Churn, cohort retention, MRR movement and LTV for the last `months` calendar months.
+
+    Results are cached per day in the BILLING_ANALYTICS_CACHE_ALIAS cache.
+    """
+    require_numpy()
+    today = timezone.now().date()
+    cache = caches[getattr(settings, 'BILLING_ANALYTICS_CACHE_ALIAS', 'default')]
+    key = f"billing_analytics:{today.isoformat()}:{months}:{currency}"
+
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    started = time.perf_counter()
+    subscriptions = load_subscriptions()
+    invoices = load_invoices(currency)
+    shares, covered = price_terms(invoices.price_ids)
+    loaded = time.perf_counter()
+
+    last_month = month_index(today)
+    result = compute_analytics(subscriptions, invoices, shares, covered, last_month - months + 1, last_month)
+    result.update(currency=currency, computed_on=today.isoformat())
+
+    logger.info(
+        f"📈 Billing analytics: {len(subscriptions.start_month)} subscriptions, {len(invoices.amount)} invoices "
+        f"loaded in {loaded - started:.2f}s, computed in {time.perf_counter() - loaded:.2f}s"
+    )
+    cache.set(key, result, 24 * 60 * 60)
+    return result
@@ -0,0 +1,106 @@
+# coalescing.py - Collapse bursts of queued customer.subscription.updated events into one write
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+import logging
+
+from .idempotency import release_event
+from .payload_store import load_event
+from .subscription_history import history_source
+from .webhook_logging import event_logging
+from .webhook_payload import WebhookEnvelope
+
+logger = logging.getLogger(__name__)
+
+# Event types whose payload carries the complete subscription state
+COALESCED_EVENT_TYPES = {'customer.subscription.updated'}
+
+def coalesce_window():
+    """Seconds queued subscription updates wait for the rest of their burst (0 disables)"""
+    return getattr(settings, 'STRIPE_WEBHOOK_COALESCE_WINDOW', 0)
+
+def claimable():
+    """
+    Filter for pending rows a worker may claim now.
+
+    Coalesced types stay pending until their window has passed, so later events of the
+    same burst can still join them. They wait in WebhookEvent rather than in memory, so
+    a restart loses nothing.
+    """
+    window = coalesce_window()
+    if not window:
+        return Q()
+    cutoff = timezone.now() - timedelta(seconds=window)
+    return ~Q(event_type__in=COALESCED_EVENT_TYPES) | Q(created_at__lte=cutoff)
+
+def burst_filter(claimed):
+    """
+    Filter for the other pending rows of the subscriptions whose updates were just claimed.
+
+    `claimed` holds (event_type, subscription_id) pairs. The rest of each burst is
+    claimed with them, however recent, and applied in the same write.
+    """
+    subscription_ids = {
+        subscription_id for event_type, subscription_id in claimed
+        if event_type in COALESCED_EVENT_TYPES and subscription_id
+    }
+    if not coalesce_window() or not subscription_ids:
+        return None
+    return Q(event_type__in=COALESCED_EVENT_TYPES, subscription_id__in=subscription_ids)
+
+def split_batch(webhook_events):
+    """Split claimed WebhookEvent rows into (rows to process alone, bursts to coalesce)"""
+    bursts = {}
+    singles = []
+    for webhook_event in webhook_events:
+        if coalesce_window() and webhook_event.event_type in COALESCED_EVENT_TYPES and webhook_event.subscription_id:
+            bursts.setdefault(webhook_event.subscription_id, []).append(webhook_event)
+        else:
+            singles.append(webhook_event)
+
+    groups = []
+    for burst in bursts.values():
+        if len(burst) > 1:
+            groups.append(burst)
+        else:
+            singles.extend(burst)
+    return singles, groups
+
+def apply_burst(webhook_events):
+    """Apply the newest of one subscription's claimed updates and mark all of them, in one transaction"""
+    from .models import WebhookEvent
+    from .webhooks import handle_subscription_updated
+
+    events = [WebhookEnvelope.from_event(load_event(webhook_event)) for webhook_event in webhook_events]
+    # Rows are in arrival order, so equal timestamps resolve to the later delivery
+    newest = max(reversed(events), key=lambda event: event.created or 0)
+    row_ids = [webhook_event.id for webhook_event in webhook_events]
+    subscription_id = newest.object['id']
+
+    try:
+        with event_logging(newest.id, newest.type):
+            with transaction.atomic(), history_source(newest.id, newest.type):
+                handle_subscription_updated(newest.object, newest.id, newest.created)
+                WebhookEvent.objects.filter(id__in=row_ids).update(
+                    subscription_id=subscription_id,
+                    status='success',
+                    error_message='',
+                    processed_at=timezone.now()
+                )
+            logger.info("🧮 Coalesced %s updates for subscription %s", len(events), subscription_id)
+
+    except Exception as e:
+        logger.error("❌ Error applying coalesced updates for %s: %s", subscription_id, e, exc_info=True)
+        WebhookEvent.objects.filter(id__in=row_ids).update(
+            status='error',
+            error_message=str(e),
+            processed_at=timezone.now()
+        )
+        for event in events:
+            release_event(event.id)
+
+    finally:
+        # Each pool thread owns its own connection
+        connection.close()
@@ -0,0 +1,170 @@
+# entitlements.py - Cached "is this user subscribed and what are their limits" lookups
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, IntegerField, When
+from django.utils import timezone
+import logging
+
+from .local_cache import TTLCache
+from .plan_catalog import get_catalog
+
+logger = logging.getLogger(__name__)
+
+Entitlement = namedtuple('Entitlement', [
+    'user_id',
+    'subscription_id',
+    'stripe_subscription_id',
+    'status',
+    'plan_id',
+    'stripe_price_id',
+    'current_period_start',
+    'current_period_end',
+    'limits',
+])
+
+ACTIVE_STATUSES = ('active', 'trialing')
+
+def entitlement_is_active(entitlement):
+    """Same rule as UserSubscription.is_active, plus an unexpired billing period"""
+    if entitlement is None or entitlement.status not in ACTIVE_STATUSES:
+        return False
+    return entitlement.current_period_end is None or entitlement.current_period_end > timezone.now()
+
+def month_bounds(value):
+    """The UTC calendar month containing `value`"""
+    start = value.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+def billing_period(entitlement, at):
+    """
+    (start, end) of the period usage at `at` counts towards: the subscription's current
+    billing period when `at` falls inside it, otherwise the calendar month.
+    """
+    if entitlement is not None:
+        start, end = entitlement.current_period_start, entitlement.current_period_end
+        if start and end and start <= at < end:
+            return start, end
+    return month_bounds(at)
+
+# UserSubscription fields an Entitlement is derived from
+ENTITLEMENT_FIELDS = {'status', 'plan_id', 'stripe_price_id', 'current_period_start', 'current_period_end'}
+
+ENTITLEMENT_TTL = getattr(settings, 'ENTITLEMENT_CACHE_TTL', 300)
+
+# Other processes only see an invalidation once their local copy expires, so keep this short
+local_entitlements = TTLCache(
+    getattr(settings, 'ENTITLEMENT_LOCAL_CACHE_SIZE', 10000),
+    getattr(settings, 'ENTITLEMENT_LOCAL_CACHE_TTL', 5),
+)
+
+# Sentinel cached locally for users without a subscription; it is never shared because
+# subscriptions created outside the webhook handlers (e.g. at checkout) do not invalidate
+NO_ENTITLEMENT = 'none'
+
+def shared_cache():
+    """The optional Django cache shared by all processes (ENTITLEMENT_CACHE_ALIAS)"""
+    alias = getattr(settings, 'ENTITLEMENT_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+def user_key(user_id):
+    return f"entitlement:user:{user_id}"
+
+def load_entitlement(user_id):
+    """Read the user's current subscription and plan limits from the database"""
+    from .models import UserSubscription
+
+    # Prefer a live subscription over newer canceled/incomplete ones
+    subscription = (
+        UserSubscription.objects.filter(user_id=user_id)
+        .annotate(is_live=Case(When(status__in=ACTIVE_STATUSES, then=1), default=0, output_field=IntegerField()))
+        .order_by('-is_live', '-created_at')
+        .values(
+            'id', 'stripe_subscription_id', 'status', 'plan_id', 'stripe_price_id',
+            'current_period_start', 'current_period_end'
+        )
+        .first()
+    )
+    if subscription is None:
+        return None
+
+    plan = get_catalog().for_price(subscription['stripe_price_id'])
+    limits = dict(plan.limits) if plan else {}
+
+    return Entitlement(
+        user_id=user_id,
+        subscription_id=subscription['id'],
+        stripe_subscription_id=subscription['stripe_subscription_id'],
+        status=subscription['status'],
+        plan_id=subscription['plan_id'],
+        stripe_price_id=subscription['stripe_price_id'],
+        current_period_start=subscription['current_period_start'],
+        current_period_end=subscription['current_period_end'],
+        limits=limits,
+    )
+
+def remember(user_id, entitlement):
+    """Store an entitlement in both cache layers"""
+    key = user_key(user_id)
+    local_entitlements.set(key, entitlement or NO_ENTITLEMENT)
+
+    shared = shared_cache()
+    if shared is not None and entitlement:
+        shared.set(key, entitlement, ENTITLEMENT_TTL)
+
+def get_entitlement(user_id):
+    """Return the user's Entitlement (or None), reading through the in-process and shared caches"""
+    key = user_key(user_id)
+
+    entitlement = local_entitlements.get(key)
+    if entitlement is None:
+        shared = shared_cache()
+        entitlement = shared.get(key) if shared is not None else None
+        if entitlement is not None:
+            local_entitlements.set(key, entitlement)
+
+    if entitlement is None:
+        entitlement = load_entitlement(user_id)
+        remember(user_id, entitlement)
+
+    return None if entitlement == NO_ENTITLEMENT else entitlement
+
+def has_active_subscription(user_id):
+    """True when the user has an active or trialing subscription in its current period"""
+    return entitlement_is_active(get_entitlement(user_id))
+
+def get_plan_limits(user_id):
+    """Plan.limits for the user's active subscription, or an empty dict"""
+    entitlement = get_entitlement(user_id)
+    return entitlement.limits if entitlement_is_active(entitlement) else {}
+
+def invalidate_user(user_id):
+    """Drop a user's cached entitlement everywhere"""
+    local_entitlements.delete(user_key(user_id))
+    shared = shared_cache()
+    if shared is not None:
+        shared.delete(user_key(user_id))
+
+def invalidate_users(user_ids):
+    """
+    Drop the users' cached entitlements once the current transaction commits.
+
+    Callers pass the user_id of the subscription rows they changed (the webhook
+    compare-and-swap reads it anyway), so a newly active subscription is seen even when
+    the cached entitlement belongs to another of the user's subscriptions.
+    """
+    user_ids = set(user_ids) - {None}
+
+    def invalidate():
+        local_entitlements.delete_many(user_key(user_id) for user_id in user_ids)
+        shared = shared_cache()
+        if shared is not None:
+            shared.delete_many([user_key(user_id) for user_id in user_ids])
+
+    if user_ids:
+        transaction.on_commit(invalidate)
@@ -0,0 +1,151 @@
+# idempotency.py - Early duplicate detection for Stripe webhook deliveries
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+import logging
+import threading
+import time
+
+from .payload_store import pack_event
+
+logger = logging.getLogger(__name__)
+
+class RecentEventCache:
+    """
+    Thread-safe LRU set of recently claimed Stripe event IDs.
+
+    Entries expire after `ttl` seconds, so once a claim's lease has run out a
+    redelivery reaches the database again and can take over an abandoned claim.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, event_id):
+        with self._lock:
+            added_at = self._events.get(event_id)
+            if added_at is None:
+                return False
+            if time.monotonic() - added_at >= self.ttl:
+                del self._events[event_id]
+                return False
+            self._events.move_to_end(event_id)
+            return True
+
+    def add(self, event_id):
+        with self._lock:
+            self._events[event_id] = time.monotonic()
+            self._events.move_to_end(event_id)
+            while len(self._events) > self.maxsize:
+                self._events.popitem(last=False)
+
+    def discard(self, event_id):
+        with self._lock:
+            self._events.pop(event_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+def processing_timeout():
+    """Seconds a claim may stay in processing before it counts as abandoned"""
+    return getattr(settings, 'STRIPE_WEBHOOK_PROCESSING_TIMEOUT', 300)
+
+def stale_claim_cutoff():
+    return timezone.now() - timedelta(seconds=processing_timeout())
+
+def reclaimable(event_id):
+    """The event's row if a new delivery may take it over: it failed, or its claim's lease ran out"""
+    from .models import WebhookEvent
+
+    return WebhookEvent.objects.filter(
+        Q(status='error') | Q(status='processing', processed_at__lt=stale_claim_cutoff()),
+        stripe_event_id=event_id,
+    )
+
+recent_events = RecentEventCache(getattr(settings, 'STRIPE_WEBHOOK_IDEMPOTENCY_CACHE_SIZE', 10000), processing_timeout())
+
+CLAIM_ATTEMPTS = 3
+
+def insert_claim(event_id, event_type, status, event, subscription_id):
+    """
+    Store the payload and create the event's row in one transaction.
+
+    Returns False for a duplicate. An IntegrityError only means a duplicate when a row
+    for the event exists; otherwise delete_orphaned_payloads() removed the payload
+    before the claim referenced it, and storing it again is retried.
+    """
+    from .models import WebhookEvent
+
+    for attempt in range(1, CLAIM_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                event_data, payload_id = pack_event(event) if event is not None else ({}, None)
+                WebhookEvent.objects.create(
+                    stripe_event_id=event_id,
+                    event_type=event_type,
+                    status=status,
+                    subscription_id=subscription_id,
+                    event_data=event_data,
+                    payload_id=payload_id,
+                )
+            return True
+        except IntegrityError:
+            if WebhookEvent.objects.filter(stripe_event_id=event_id).exists():
+                return False
+            if attempt == CLAIM_ATTEMPTS:
+                raise
+            logger.warning(f"⚠️ Payload for webhook {event_id} was removed before its claim, storing it again")
+
+def claim_event(event_id, event_type, status='processing', event=None, subscription_id=None):
+    """
+    Claim a Stripe event before any handler work runs.
+
+    Returns True when this delivery owns the event and should process it, False for
+    a duplicate. The WebhookEvent unique index makes the claim atomic across processes;
+    events that previously ended in error can be claimed again so Stripe retries work, as
+    can events left in processing for STRIPE_WEBHOOK_PROCESSING_TIMEOUT seconds (claimed
+    by a process that died mid-handler; processed_at holds the claim time).
+    When the decoded `event` is given its payload is stored compactly for replays;
+    queued events also record their `subscription_id` so the worker can coalesce them.
+    """
+    if event_id in recent_events:
+        return False
+
+    if not insert_claim(event_id, event_type, status, event, subscription_id):
+        retry_fields = {'status': status, 'error_message': '', 'processed_at': timezone.now()}
+        if subscription_id:
+            retry_fields['subscription_id'] = subscription_id
+
+        with transaction.atomic():
+            if event is not None:
+                # The failed claim's payload INSERT was rolled back with it
+                event_data, payload_id = pack_event(event)
+                retry_fields.update(event_data=event_data, payload_id=payload_id)
+            reclaimed = reclaimable(event_id).update(**retry_fields)
+        if not reclaimed:
+            recent_events.add(event_id)
+            return False
+        logger.info(f"🔁 Retrying failed or abandoned webhook {event_id}")
+
+    recent_events.add(event_id)
+    return True
+
+def mark_event_processed(event_id):
+    """Mark a claimed event as successful unless its handler already recorded an outcome"""
+    from .models import WebhookEvent
+
+    WebhookEvent.objects.filter(stripe_event_id=event_id, status='processing').update(
+        status='success',
+        processed_at=timezone.now()
+    )
+
+def release_event(event_id):
+    """Forget a failed event locally so a redelivery is processed again"""
+    recent_events.discard(event_id)
@@ -0,0 +1,45 @@
+# invoice_history.py - A user's invoices, newest first, in keyset-paginated pages
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+# Every column is a key or INCLUDE column of invoice_user_history_idx
+INVOICE_HISTORY_FIELDS = (
+    'id', 'stripe_invoice_id', 'amount', 'currency', 'status', 'paid_at', 'payment_failed_at', 'created_at',
+)
+
+def encode_cursor(row):
+    """Opaque cursor for the page after `row`"""
+    return base64.urlsafe_b64encode(f"{row['created_at'].isoformat()}|{row['id']}".encode()).decode()
+
+def decode_cursor(cursor):
+    """(created_at, id) from encode_cursor(); ValueError if it was tampered with"""
+    # binascii.Error and UnicodeDecodeError are ValueErrors too
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
+
+def history_queryset(user_id, after=None):
+    """A user's invoices newest first, starting after the (created_at, id) position `after`"""
+    from .models import Invoice
+
+    invoices = Invoice.objects.filter(user_id=user_id)
+    if after:
+        created_at, pk = after
+        # The plain bound lets the index range scan start at the cursor; the OR breaks ties
+        invoices = invoices.filter(created_at__lte=created_at).filter(Q(created_at__lt=created_at) | Q(id__lt=pk))
+    return invoices.order_by('-created_at', '-id').values(*INVOICE_HISTORY_FIELDS)
+
+def invoice_page(user_id, cursor=None, limit=25):
+    """
+    One page of a user's invoices: {'invoices': [...], 'next_cursor': str or None}.
+
+    Pages continue after the (created_at, id) of the previous page's last row rather than
+    skipping an OFFSET, so the index is entered at that row and page 100 costs as much as
+    page 1.
+    """
+    rows = list(history_queryset(user_id, decode_cursor(cursor) if cursor else None)[:limit + 1])
+    page = rows[:limit]
+    return {
+        'invoices': page,
+        'next_cursor': encode_cursor(page[-1]) if len(rows) > limit else None,
+    }
@@ -0,0 +1,27 @@
+# archive_webhook_events.py - Apply the WebhookEvent retention policy
+from django.core.management.base import BaseCommand
+
+from ...retention import archive_expired_events, retention_policy
+
+
+class Command(BaseCommand):
+    help = 'Move expired WebhookEvent rows to compressed daily JSONL archives (STRIPE_WEBHOOK_RETENTION_DAYS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive-dir', help='Directory for the archives (default: STRIPE_WEBHOOK_ARCHIVE_DIR)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Rows written and deleted per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be archived')
+
+    def handle(self, *args, **options):
+        policy = retention_policy()
+        self.stdout.write("📋 Retention: " + ', '.join(f"{status} {days}d" for status, days in policy.items()))
+
+        archived = archive_expired_events(
+            archive_dir=options['archive_dir'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+        )
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        for status, count in archived.items():
+            self.stdout.write(self.style.SUCCESS(f"✅ {verb} {count} {status} events"))
@@ -0,0 +1,36 @@
+# backfill_invoice_users.py - Link existing invoices to their users in batches
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef
+
+from ...models import Invoice
+from ...webhooks import invoice_user
+
+
+class Command(BaseCommand):
+    help = 'Fill Invoice.user for rows stored before the invoice handlers set it (safe to re-run)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Invoices per UPDATE statement')
+
+    def handle(self, *args, **options):
+        user = invoice_user(OuterRef('stripe_subscription_id'), OuterRef('stripe_customer_id'))
+        last_id = scanned = linked = 0
+
+        while True:
+            # Walk the primary key so each batch is a short UPDATE that holds few locks
+            ids = list(
+                Invoice.objects.filter(user__isnull=True, id__gt=last_id)
+                .order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            Invoice.objects.filter(id__in=ids).update(user_id=user)
+            linked += Invoice.objects.filter(id__in=ids, user__isnull=False).count()
+            scanned += len(ids)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Linked {linked} of {scanned} unlinked invoices to users"))
+        if scanned > linked:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ {scanned - linked} invoices match no UserSubscription by subscription or customer id"
+            ))
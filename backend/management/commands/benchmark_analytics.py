@@ -0,0 +1,122 @@
+# benchmark_analytics.py - Time the vectorized billing analytics on a synthetic dataset
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+import time
+
+from ...analytics import (
+    NEVER,
+    InvoiceColumns,
+    SubscriptionColumns,
+    compute_analytics,
+    month_index,
+    np,
+    require_numpy,
+)
+
+# (monthly share, months covered, amount) per synthetic price, as price_terms() returns them
+SYNTHETIC_PRICES = [(1.0, 1, 19.0), (1.0, 1, 49.0), (1.0, 1, 199.0), (1 / 12, 12, 490.0), (52 / 12, 1, 12.0)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark churn/cohort/MRR/LTV analytics on synthetic NumPy columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=3_000_000)
+        parser.add_argument('--subscriptions', type=int, default=250_000)
+        parser.add_argument('--months', type=int, default=24, help='Months reported')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--loop-sample', type=int, default=200_000,
+                            help='Invoices for the per-row Python MRR baseline (0 to skip)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        require_numpy()
+
+        rng = np.random.default_rng(options['seed'])
+        last_month = month_index(timezone.now())
+        first_month = last_month - options['months'] + 1
+
+        subscriptions, invoices, shares, covered = self.synthetic(
+            rng, options['subscriptions'], options['invoices'], last_month
+        )
+        self.stdout.write(
+            f"📦 {len(invoices.amount):,} invoices, {len(subscriptions.start_month):,} subscriptions, "
+            f"{options['months']} months"
+        )
+
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            result = compute_analytics(subscriptions, invoices, shares, covered, first_month, last_month)
+            timings.append(time.perf_counter() - started)
+
+        best = min(timings)
+        self.stdout.write(
+            f"  vectorized       {best * 1000:9.1f} ms  {len(invoices.amount) / best:12,.0f} invoices/s"
+        )
+        self.stdout.write(f"  LTV: {result['ltv']}")
+
+        sample = min(options['loop_sample'], len(invoices.amount))
+        if sample:
+            elapsed = self.python_mrr(invoices, shares, covered, sample)
+            projected = elapsed * len(invoices.amount) / sample
+            self.stdout.write(
+                f"  per-row MRR only {elapsed * 1000:9.1f} ms for {sample:,} invoices "
+                f"(~{projected:.1f} s projected for all)"
+            )
+            self.stdout.write(self.style.SUCCESS(f"✅ Vectorized analytics are ~{projected / best:.0f}x faster"))
+
+    def synthetic(self, rng, subscription_count, invoice_count, last_month):
+        """Subscriptions started over three years, ~30% ended, invoices spread over their lifetimes"""
+        start = rng.integers(last_month - 36, last_month + 1, size=subscription_count).astype(np.int32)
+        lifetime = rng.geometric(1 / 14, size=subscription_count)
+        ended = rng.random(subscription_count) < 0.3
+        end = np.where(ended, np.minimum(start + lifetime, last_month), NEVER).astype(np.int32)
+
+        subscription = rng.integers(0, subscription_count, size=invoice_count)
+        paid_until = np.minimum(end[subscription], last_month)
+        paid_month = start[subscription] + (
+            rng.random(invoice_count) * (paid_until - start[subscription] + 1)
+        ).astype(np.int32)
+        price = rng.integers(0, len(SYNTHETIC_PRICES), size=invoice_count)
+        amounts = np.array([amount for _, _, amount in SYNTHETIC_PRICES])[price]
+        # Some invoices carry extra seats or proration
+        amounts *= rng.choice([1.0, 1.0, 1.0, 1.5, 2.0], size=invoice_count)
+
+        invoices = InvoiceColumns(
+            subscription, paid_month, amounts, price, tuple(f'price_{i}' for i in range(len(SYNTHETIC_PRICES)))
+        )
+        shares = np.array([share for share, _, _ in SYNTHETIC_PRICES])
+        covered = np.array([months for _, months, _ in SYNTHETIC_PRICES])
+        return SubscriptionColumns(start, end), invoices, shares, covered
+
+    def python_mrr(self, invoices, shares, covered, sample):
+        """Baseline: MRR per (subscription, month) and its movement with plain Python loops"""
+        rows = list(zip(
+            invoices.subscription[:sample].tolist(), invoices.paid_month[:sample].tolist(),
+            invoices.amount[:sample].tolist(), invoices.price[:sample].tolist(),
+        ))
+        shares, covered = shares.tolist(), covered.tolist()
+
+        started = time.perf_counter()
+        totals = defaultdict(lambda: [0.0, 0])
+        for subscription, month, amount, price in rows:
+            for offset in range(covered[price]):
+                cell = totals[(subscription, month + offset)]
+                cell[0] += amount * shares[price]
+                cell[1] += 1
+        mrr = {key: total / count for key, (total, count) in totals.items()}
+
+        movement = defaultdict(lambda: defaultdict(float))
+        for (subscription, month), value in mrr.items():
+            previous = mrr.get((subscription, month - 1), 0.0)
+            if not previous:
+                movement[month]['new'] += value
+            elif value > previous:
+                movement[month]['expansion'] += value - previous
+            elif value < previous:
+                movement[month]['contraction'] += previous - value
+            if (subscription, month + 1) not in mrr:
+                movement[month + 1]['churned'] += value
+        return time.perf_counter() - started
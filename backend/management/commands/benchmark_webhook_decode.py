@@ -0,0 +1,44 @@
+# benchmark_webhook_decode.py - Compare stripe.Webhook.construct_event with the fast decode path
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import time
+
+import stripe
+
+from ...synthetic_events import encode_event, invoice_object, make_event
+from ...webhook_payload import WebhookEnvelope, decode_event, loads
+
+
+class Command(BaseCommand):
+    help = 'Benchmark webhook signature verification + payload decoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000)
+        parser.add_argument('--lines', type=int, default=50, help='Invoice line items per payload')
+
+    def handle(self, *args, **options):
+        secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', None) or 'whsec_benchmark'
+        event = make_event('invoice.payment_succeeded', invoice_object('in_bench', 'sub_bench', line_count=options['lines']))
+        payload, header = encode_event(event, secret)
+        iterations = options['iterations']
+
+        self.stdout.write(f"📦 Payload: {len(payload) / 1024:.1f} KiB, {iterations} iterations, parser: {loads.__module__}")
+
+        def construct():
+            return WebhookEnvelope.from_event(stripe.Webhook.construct_event(payload, header, secret))
+
+        def fast():
+            return decode_event(payload, header, secret)
+
+        results = {}
+        for name, decode in (('construct_event', construct), ('fast decode', fast)):
+            decode()  # warm up
+            started = time.perf_counter()
+            for _ in range(iterations):
+                decode()
+            elapsed = time.perf_counter() - started
+            results[name] = elapsed
+            self.stdout.write(f"  {name:<16} {elapsed / iterations * 1e6:9.1f} µs/event  {iterations / elapsed:10.0f} events/s")
+
+        speedup = results['construct_event'] / results['fast decode']
+        self.stdout.write(self.style.SUCCESS(f"✅ Fast decode is {speedup:.1f}x faster"))
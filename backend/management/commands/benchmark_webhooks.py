@@ -0,0 +1,396 @@
+# benchmark_webhooks.py - Load-test stripe_webhook with signed synthetic events
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.base.creation import TEST_DATABASE_PREFIX
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from ...synthetic_events import sign_payload, synthetic_event
+from ...webhooks import EVENT_HANDLERS
+
+# Fixture rows created for the run; everything with these prefixes is removed afterwards
+BENCH_SUBSCRIPTION_PREFIX = 'sub_bench_'
+BENCH_USER_PREFIX = 'webhook-bench-'
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+def summarize(results, elapsed):
+    """Throughput plus latency percentiles (ms) and mean queries per event type"""
+    by_type = defaultdict(list)
+    for result in results:
+        by_type[result['type']].append(result)
+
+    types = {}
+    for event_type, rows in sorted(by_type.items()):
+        latencies = sorted(row['latency'] * 1000 for row in rows)
+        queries = [row['queries'] for row in rows if row['queries'] is not None]
+        types[event_type] = {
+            'count': len(rows),
+            'errors': sum(1 for row in rows if row['status'] != 200),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'queries': sum(queries) / len(queries) if queries else None,
+        }
+
+    latencies = sorted(result['latency'] * 1000 for result in results)
+    return {
+        'events': len(results),
+        'errors': sum(1 for result in results if result['status'] != 200),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'types': types,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Drive stripe_webhook with signed synthetic events and report throughput, latency and queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=2000)
+        parser.add_argument('--rate', type=float, default=0, help='Target events/s (0 = as fast as possible)')
+        parser.add_argument('--concurrency', type=int, default=1, help='Requests in flight')
+        parser.add_argument('--subscriptions', type=int, default=200, help='Fixture subscriptions the events refer to')
+        parser.add_argument('--types', nargs='*', help='Event types to send (default: every routed type)')
+        parser.add_argument('--url', help='Webhook URL of a running WSGI/ASGI server instead of the test client')
+        parser.add_argument('--path', help='Webhook path for the test client (default: reverse("stripe_webhook"))')
+        parser.add_argument('--compare-async', action='store_true',
+                            help='Also run the async view (webhooks_async) with as many handler threads')
+        parser.add_argument('--async-url', help='Webhook URL of the async view on an ASGI server (with --url)')
+        parser.add_argument('--async-concurrency', type=int, default=100, help='Async deliveries in flight')
+        parser.add_argument('--save-baseline', metavar='NAME', help='Save the results as a named baseline')
+        parser.add_argument('--compare', metavar='NAME', help='Compare the results with a saved baseline')
+        parser.add_argument('--baseline-dir', default='benchmarks/webhooks')
+        parser.add_argument('--keep-data', action='store_true', help='Keep fixture and event rows afterwards')
+        parser.add_argument('--confirm-database', metavar='NAME',
+                            help='Name of the configured database, to run against one that is not a test database')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        event_types = options['types'] or list(EVENT_HANDLERS)
+        unknown = set(event_types) - set(EVENT_HANDLERS)
+        if unknown:
+            raise CommandError(f"Not routed by stripe_webhook: {', '.join(sorted(unknown))}")
+
+        self.secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', None)
+        if not self.secret:
+            raise CommandError('STRIPE_WEBHOOK_SECRET must be set to sign the events')
+
+        # Fixture users and subscriptions are created, and rows with their prefixes deleted
+        database = str(connection.settings_dict['NAME'])
+        if not database.startswith(TEST_DATABASE_PREFIX) and options['confirm_database'] != database:
+            raise CommandError(
+                f"This writes and deletes rows in database {database!r}; use a test or staging "
+                f"database and pass --confirm-database {database}"
+            )
+
+        if options['compare_async'] and options['url'] and not options['async_url']:
+            raise CommandError('--compare-async with --url needs --async-url')
+
+        baseline = self.load_baseline(options) if options['compare'] else None
+        rng = random.Random(options['seed'])
+        subscriptions = self.create_fixtures(options['subscriptions'])
+
+        def make_events():
+            return [
+                synthetic_event(rng.choice(event_types), *rng.choice(subscriptions))
+                for _ in range(options['events'])
+            ]
+
+        concurrency = options['concurrency']
+        if options['compare_async'] and concurrency <= 1:
+            # Equal workers: one sync thread per async handler thread
+            concurrency = getattr(settings, 'STRIPE_WEBHOOK_ASYNC_HANDLER_THREADS', 8)
+
+        summaries = []
+        try:
+            mode = options['url'] or 'test client'
+            self.stdout.write(
+                f"📦 {options['events']} events over {len(event_types)} types, {len(subscriptions)} subscriptions, "
+                f"{options['rate'] or 'max'} events/s, concurrency {concurrency} ({mode})"
+            )
+            if getattr(settings, 'STRIPE_WEBHOOK_ASYNC_PROCESSING', False):
+                self.stdout.write(self.style.WARNING('⚠️ Async processing is on: this measures enqueueing only'))
+
+            send = self.url_sender(options['url']) if options['url'] else self.client_sender(options['path'])
+            with override_settings(ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+                events = make_events()
+                results, elapsed = self.drive(send, events, options['rate'], concurrency)
+                summaries.append(('sync view', self.summarize(results, elapsed, events)))
+
+                if options['compare_async']:
+                    events = make_events()
+                    if options['url']:
+                        results, elapsed = self.drive(
+                            self.url_sender(options['async_url']), events, options['rate'],
+                            options['async_concurrency'],
+                        )
+                    else:
+                        results, elapsed = asyncio.run(self.drive_async(
+                            events, options['rate'], options['async_concurrency']
+                        ))
+                    summaries.append(('async view', self.summarize(results, elapsed, events)))
+        finally:
+            if not options['keep_data']:
+                self.cleanup()
+
+        for name, summary in summaries:
+            summary.update(mode=mode, rate=options['rate'], concurrency=concurrency)
+            if options['compare_async']:
+                self.stdout.write(f"\n🔹 {name}")
+            self.report(summary)
+
+        if options['compare_async']:
+            (_, sync), (_, async_) = summaries
+            self.stdout.write(self.style.SUCCESS(
+                f"\n✅ async/sync with {concurrency} handler threads: throughput {sync['throughput']:.0f} -> "
+                f"{async_['throughput']:.0f} events/s, p95 {sync['p95']:.2f} -> {async_['p95']:.2f} ms"
+            ))
+
+        summary = summaries[0][1]
+        if baseline:
+            self.compare(summary, baseline, options['compare'])
+        if options['save_baseline']:
+            self.save_baseline(summary, options)
+
+    def summarize(self, results, elapsed, events, chunk_size=500):
+        """summarize() plus events whose handler did not succeed (the view still answers 200)"""
+        from ...models import WebhookEvent
+
+        summary = summarize(results, elapsed)
+        event_ids = [event['id'] for event in events]
+        summary['handler_errors'] = sum(
+            WebhookEvent.objects.filter(stripe_event_id__in=event_ids[start:start + chunk_size])
+            .exclude(status='success').count()
+            for start in range(0, len(event_ids), chunk_size)
+        )
+        return summary
+
+    def create_fixtures(self, count):
+        """Users with active subscriptions for the synthetic events to update"""
+        from ...models import UserSubscription
+
+        User = get_user_model()
+        self.cleanup()
+        User.objects.bulk_create([User(username=f"{BENCH_USER_PREFIX}{index}") for index in range(count)])
+        users = User.objects.filter(username__startswith=BENCH_USER_PREFIX)
+        now = timezone.now()
+        for user in users:
+            # Saved one by one so the rollup signals see them
+            UserSubscription.objects.create(
+                user=user,
+                plan_id='bench',
+                status='active',
+                stripe_subscription_id=f"{BENCH_SUBSCRIPTION_PREFIX}{user.pk}",
+                stripe_price_id='price_synthetic',
+                current_period_start=now,
+                current_period_end=now + timedelta(days=30),
+            )
+        return list(
+            UserSubscription.objects.filter(stripe_subscription_id__startswith=BENCH_SUBSCRIPTION_PREFIX)
+            .values_list('stripe_subscription_id', 'id')
+        )
+
+    def cleanup(self):
+        """Remove fixture users, their subscriptions, invoices and webhook events"""
+        from ...models import Invoice, WebhookEvent
+        from ...payload_store import delete_orphaned_payloads
+        from ...rollups import rebuild_rollups
+
+        User = get_user_model()
+        invoices = Invoice.objects.filter(stripe_subscription_id__startswith=BENCH_SUBSCRIPTION_PREFIX).delete()[0]
+        WebhookEvent.objects.filter(stripe_event_id__startswith='evt_synthetic_').delete()
+        delete_orphaned_payloads()
+        users = User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()[0]
+        if invoices:
+            # Invoice deletes have no rollup signal
+            rebuild_rollups()
+        return users
+
+    def client_sender(self, path):
+        """POST through the Django test client, counting the queries each event costs"""
+        if not path:
+            try:
+                path = reverse('stripe_webhook')
+            except NoReverseMatch:
+                raise CommandError('stripe_webhook is not routed; pass --path')
+        local = threading.local()
+
+        def send(event):
+            client = getattr(local, 'client', None)
+            if client is None:
+                client = local.client = Client()
+            payload = json.dumps(event).encode('utf-8')
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.post(
+                    path, payload, content_type='application/json',
+                    HTTP_STRIPE_SIGNATURE=sign_payload(payload, self.secret),
+                )
+                latency = time.perf_counter() - started
+            return {'type': event['type'], 'status': response.status_code, 'latency': latency,
+                    'queries': len(queries.captured_queries)}
+
+        return send
+
+    def url_sender(self, url):
+        """POST to a real server over keep-alive connections (queries are not visible)"""
+        import requests
+
+        local = threading.local()
+
+        def send(event):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            payload = json.dumps(event).encode('utf-8')
+            started = time.perf_counter()
+            try:
+                status = session.post(url, data=payload, timeout=30, headers={
+                    'Content-Type': 'application/json',
+                    'Stripe-Signature': sign_payload(payload, self.secret),
+                }).status_code
+            except requests.RequestException:
+                status = 0
+            return {'type': event['type'], 'status': status, 'latency': time.perf_counter() - started,
+                    'queries': None}
+
+        return send
+
+    def drive(self, send, events, rate, concurrency):
+        """Send events on an open-loop schedule of `rate` events/s; returns (results, seconds)"""
+        started = time.perf_counter()
+        if concurrency <= 1 and not rate:
+            results = [send(event) for event in events]
+            return results, time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = []
+            for index, event in enumerate(events):
+                if rate:
+                    delay = started + index / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(executor.submit(send, event))
+            results = [future.result() for future in futures]
+
+        if concurrency > 1 and connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING('⚠️ SQLite serializes writers; use PostgreSQL for concurrent runs'))
+        return results, time.perf_counter() - started
+
+    async def drive_async(self, events, rate, concurrency):
+        """drive() for webhooks_async through AsyncClient; handler queries run on other threads"""
+        try:
+            path = reverse('stripe_webhook_async')
+        except NoReverseMatch:
+            raise CommandError('stripe_webhook_async is not routed')
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def send(event):
+            async with slots:
+                payload = json.dumps(event).encode('utf-8')
+                started = time.perf_counter()
+                response = await client.post(
+                    path, payload, content_type='application/json',
+                    headers={'Stripe-Signature': sign_payload(payload, self.secret)},
+                )
+                return {'type': event['type'], 'status': response.status_code,
+                        'latency': time.perf_counter() - started, 'queries': None}
+
+        started = time.perf_counter()
+        tasks = []
+        for index, event in enumerate(events):
+            if rate:
+                delay = started + index / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(event)))
+        results = await asyncio.gather(*tasks)
+        return list(results), time.perf_counter() - started
+
+    def report(self, summary):
+        self.stdout.write(
+            f"\n  {'event type':<40} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+        )
+        for event_type, stats in summary['types'].items():
+            queries = f"{stats['queries']:8.1f}" if stats['queries'] is not None else f"{'-':>8}"
+            self.stdout.write(
+                f"  {event_type:<40} {stats['count']:>6} {stats['errors']:>6} "
+                f"{stats['p50']:8.2f} {stats['p95']:8.2f} {stats['p99']:8.2f} {queries}"
+            )
+        self.stdout.write(
+            f"\n  {summary['events']} events in {summary['elapsed']:.2f}s: {summary['throughput']:.0f} events/s, "
+            f"p50 {summary['p50']:.2f} ms, p95 {summary['p95']:.2f} ms, p99 {summary['p99']:.2f} ms"
+        )
+        if summary['errors']:
+            self.stdout.write(self.style.ERROR(f"❌ {summary['errors']} requests did not return 200"))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Every request returned 200'))
+        if summary.get('handler_errors'):
+            self.stdout.write(self.style.ERROR(
+                f"❌ {summary['handler_errors']} events were not processed successfully (see WebhookEvent)"
+            ))
+
+    def baseline_path(self, options, name):
+        return os.path.join(options['baseline_dir'], f"{name}.json")
+
+    def save_baseline(self, summary, options):
+        path = self.baseline_path(options, options['save_baseline'])
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as baseline:
+            json.dump(dict(summary, saved_at=timezone.now().isoformat()), baseline, indent=2)
+        self.stdout.write(f"💾 Saved baseline {path}")
+
+    def load_baseline(self, options):
+        path = self.baseline_path(options, options['compare'])
+        try:
+            with open(path) as baseline:
+                return json.load(baseline)
+        except OSError as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+    def compare(self, summary, baseline, name):
+        """Print the change against a saved baseline per event type"""
+        def change(current, previous):
+            if not previous:
+                return '     n/a'
+            return f"{(current - previous) / previous * 100:+7.1f}%"
+
+        self.stdout.write(f"\n📊 Compared with baseline '{name}' ({baseline.get('saved_at', '?')}, {baseline.get('mode')})")
+        self.stdout.write(
+            f"  {'throughput':<40} {baseline['throughput']:8.0f} -> {summary['throughput']:8.0f} "
+            f"{change(summary['throughput'], baseline['throughput'])}"
+        )
+        for event_type, stats in summary['types'].items():
+            previous = baseline['types'].get(event_type)
+            if not previous:
+                continue
+            line = (
+                f"  {event_type:<40} p95 {previous['p95']:7.2f} -> {stats['p95']:7.2f} ms "
+                f"{change(stats['p95'], previous['p95'])}"
+            )
+            if stats['queries'] is not None and previous.get('queries') is not None:
+                line += f"   queries {previous['queries']:.1f} -> {stats['queries']:.1f}"
+            self.stdout.write(line)
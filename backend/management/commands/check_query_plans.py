@@ -0,0 +1,132 @@
+# check_query_plans.py - EXPLAIN the hot billing queries and fail on sequential scans
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+import re
+
+from ...invoice_history import history_queryset
+from ...models import Invoice, UserSubscription, WebhookEvent
+
+def hot_queries():
+    """The lookups done by the webhook handlers, the worker and the billing pages"""
+    now = timezone.now()
+    return {
+        'subscription by stripe_subscription_id':
+            UserSubscription.objects.filter(stripe_subscription_id='sub_seed_42'),
+        'subscriptions by stripe_customer_id':
+            UserSubscription.objects.filter(stripe_customer_id='cus_seed_42'),
+        'subscriptions by user and status':
+            UserSubscription.objects.filter(user_id=42, status='active'),
+        'live subscriptions renewing this week':
+            UserSubscription.objects.filter(
+                status__in=['active', 'trialing'],
+                current_period_end__range=(now, now + timedelta(days=7))
+            ),
+        'invoices by stripe_subscription_id':
+            Invoice.objects.filter(stripe_subscription_id='sub_seed_42'),
+        'invoices by stripe_customer_id':
+            Invoice.objects.filter(stripe_customer_id='cus_seed_42'),
+        'latest invoices by status':
+            Invoice.objects.filter(status='payment_failed').order_by('-created_at')[:50],
+        'invoice history page (keyset, after a cursor)':
+            history_queryset(42, (now - timedelta(days=30), 10000))[:26],
+        'pending webhook events (worker claim)':
+            WebhookEvent.objects.filter(status='pending').order_by('created_at')[:50],
+        'recent webhook errors':
+            WebhookEvent.objects.filter(status='error', created_at__gte=now - timedelta(hours=1)),
+    }
+
+def is_sequential_scan(plan, table):
+    """Detect a full table scan in PostgreSQL or SQLite EXPLAIN output"""
+    if connection.vendor == 'postgresql':
+        return f'Seq Scan on {table}' in plan
+    if connection.vendor == 'sqlite':
+        # "SCAN invoices" is a full scan; index use shows as "SEARCH ... USING INDEX" or "SCAN ... USING INDEX"
+        return any(
+            re.search(rf'\bSCAN {table}\b', line) and 'USING' not in line
+            for line in plan.splitlines()
+        )
+    raise CommandError(f"Query plan checks are not implemented for {connection.vendor}")
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on hot billing queries and fail if any falls back to a sequential scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=20000,
+                            help='Synthetic rows per table to insert first (rolled back afterwards; 0 to use existing data)')
+
+    def handle(self, *args, **options):
+        failures = []
+
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+
+            for name, queryset in hot_queries().items():
+                plan = queryset.explain()
+                table = queryset.model._meta.db_table
+                if is_sequential_scan(plan, table):
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(f"❌ {name}: sequential scan\n{plan}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"✅ {name}"))
+
+            # Never keep the synthetic rows
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot queries fall back to a sequential scan")
+
+    def seed(self, rows):
+        """Insert a realistic spread of subscriptions, invoices and webhook events"""
+        now = timezone.now()
+        statuses = [choice for choice, _ in UserSubscription.STATUS_CHOICES]
+        invoice_statuses = [choice for choice, _ in Invoice.STATUS_CHOICES]
+        event_statuses = ['success'] * 17 + ['error', 'pending', 'processing']
+
+        users = User.objects.bulk_create(
+            [User(username=f'query_plan_seed_{i}') for i in range(rows)], batch_size=2000
+        )
+        UserSubscription.objects.bulk_create([
+            UserSubscription(
+                user=users[i],
+                plan_id='seed',
+                status=statuses[i % len(statuses)],
+                stripe_customer_id=f'cus_seed_{i}',
+                stripe_subscription_id=f'sub_seed_{i}',
+                current_period_end=now + timedelta(hours=i % 2000),
+            )
+            for i in range(rows)
+        ], batch_size=2000)
+        Invoice.objects.bulk_create([
+            Invoice(
+                stripe_invoice_id=f'in_seed_{i}',
+                stripe_customer_id=f'cus_seed_{i % rows}',
+                stripe_subscription_id=f'sub_seed_{i % rows}',
+                user=users[i % rows],
+                customer_email=f'seed{i}@example.com',
+                amount=Decimal('49.00'),
+                status=invoice_statuses[i % len(invoice_statuses)],
+            )
+            for i in range(rows)
+        ], batch_size=2000)
+        WebhookEvent.objects.bulk_create([
+            WebhookEvent(
+                stripe_event_id=f'evt_seed_{i}',
+                event_type='invoice.payment_succeeded',
+                status=event_statuses[i % len(event_statuses)],
+            )
+            for i in range(rows)
+        ], batch_size=2000)
+
+        # Refresh planner statistics so the plans reflect the seeded data
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                for model in (User, UserSubscription, Invoice, WebhookEvent):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
@@ -0,0 +1,22 @@
+# process_webhook_events.py - Worker command that drains queued Stripe webhook events
+from django.core.management.base import BaseCommand
+
+from ...webhook_worker import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Process Stripe webhook events queued by the webhook view (STRIPE_WEBHOOK_ASYNC_PROCESSING)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Number of handler threads (default: STRIPE_WEBHOOK_WORKERS)')
+        parser.add_argument('--batch-size', type=int, help='Events claimed per batch (default: STRIPE_WEBHOOK_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        run_worker(
+            max_workers=options['workers'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            once=options['once'],
+        )
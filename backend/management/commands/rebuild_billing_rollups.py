@@ -0,0 +1,45 @@
+# rebuild_billing_rollups.py - Recompute the dashboard rollups from Invoice and UserSubscription
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...models import DailyBillingRollup, PlanStatusRollup
+from ...rollups import rebuild_rollups
+
+def snapshot():
+    """Current rollup rows as comparable tuples (zero rows ignored)"""
+    daily = {
+        row for row in DailyBillingRollup.objects.values_list(
+            'day', 'stripe_price_id', 'currency', 'invoices_paid', 'revenue', 'invoices_failed'
+        )
+        if any(row[3:])
+    }
+    plans = set(PlanStatusRollup.objects.exclude(subscriptions=0).values_list('stripe_price_id', 'status', 'subscriptions'))
+    return daily, plans
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the billing dashboard rollups from scratch (run during a quiet period)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report rows that differ from a rebuild; nothing is written')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            before = snapshot()
+            daily, plans = rebuild_rollups()
+            after = snapshot()
+
+            drift = sum(len(old ^ new) for old, new in zip(before, after))
+            if options['check']:
+                transaction.set_rollback(True)
+
+        if options['check']:
+            if drift:
+                raise CommandError(f"❌ {drift} rollup rows differ from a rebuild")
+            self.stdout.write(self.style.SUCCESS("✅ Rollups match the billing tables"))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Rebuilt {daily} daily and {plans} plan rollup rows ({drift} rows changed)"
+        ))
@@ -0,0 +1,50 @@
+# reconcile_stripe.py - Correct UserSubscription and Invoice rows that drifted from Stripe
+from django.core.management.base import BaseCommand, CommandError
+
+from ...reconciliation import RESOURCES, parse_since, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Compare Stripe subscriptions and invoices changed since the last run with local rows and fix drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('resources', nargs='*', help=f"Any of {', '.join(RESOURCES)} (default: all)")
+        parser.add_argument('--full', action='store_true',
+                            help='Ignore the checkpoint and list everything created since the oldest local row')
+        parser.add_argument('--since', help='Examine objects created since this date (YYYY-MM-DD or ISO 8601)')
+        parser.add_argument('--concurrency', type=int, help='Stripe requests in flight (default: STRIPE_RECONCILE_CONCURRENCY)')
+        parser.add_argument('--windows', type=int, help='Time windows paged in parallel (default: 2 x concurrency)')
+        parser.add_argument('--page-size', type=int, default=100, help='Objects per Stripe list request (max 100)')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be corrected')
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(f"Invalid --since: {e}")
+
+        unknown = set(options['resources']) - set(RESOURCES)
+        if unknown:
+            raise CommandError(f"Unknown resources: {', '.join(sorted(unknown))}")
+
+        for name in options['resources'] or RESOURCES:
+            stats = reconcile(
+                name,
+                since=since,
+                full=options['full'],
+                concurrency=options['concurrency'],
+                windows=options['windows'],
+                page_size=min(options['page_size'], 100),
+                dry_run=options['dry_run'],
+            )
+
+            verb = 'would be corrected' if options['dry_run'] else 'corrected'
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {name}: {stats['examined']} examined, {stats['corrected']} {verb}"
+            ))
+            if stats['missing']:
+                self.stdout.write(self.style.WARNING(f"⚠️ {stats['missing']} {name} exist in Stripe but not locally"))
+            if stats['failed_windows']:
+                self.stdout.write(self.style.ERROR(
+                    f"❌ {stats['failed_windows']} time windows failed; the checkpoint was not advanced"
+                ))
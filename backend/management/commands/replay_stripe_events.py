@@ -0,0 +1,43 @@
+# replay_stripe_events.py - Bulk backfill from a Stripe event export or stored webhook events
+from django.core.management.base import BaseCommand, CommandError
+
+from ...replay import read_event_file, replay_events, stored_events
+
+
+class Command(BaseCommand):
+    help = 'Apply Stripe events in bulk from a JSONL export or from stored WebhookEvent payloads'
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--file', help='JSONL file with one Stripe event per line')
+        source.add_argument('--stored', action='store_true', help='Replay WebhookEvent rows that carry a payload')
+        parser.add_argument('--status', nargs='+', default=['pending', 'error'],
+                            help='WebhookEvent statuses to replay with --stored (default: pending error)')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes (events are partitioned by subscription)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Events folded into each bulk write')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk_create/bulk_update statement')
+        parser.add_argument('--include-processed', action='store_true',
+                            help='Also re-apply events already recorded as successful')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            try:
+                events = list(read_event_file(options['file']))
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read {options['file']}: {e}")
+        else:
+            events = stored_events(options['status'])
+
+        self.stdout.write(f"📦 Loaded {len(events)} events")
+
+        replayed, subscriptions, invoices = replay_events(
+            events,
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            skip_processed=not options['include_processed'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Replayed {replayed} events: {subscriptions} subscription updates, {invoices} invoices"
+        ))
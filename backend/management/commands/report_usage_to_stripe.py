@@ -0,0 +1,33 @@
+# report_usage_to_stripe.py - Send metered call minutes to Stripe usage records
+from django.core.management.base import BaseCommand
+
+from ...usage_reporting import report_usage
+
+
+class Command(BaseCommand):
+    help = 'Report UsagePeriod totals that grew since the last run to their Stripe subscription items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Reports sent before watermarks are saved')
+        parser.add_argument('--concurrency', type=int, help='Requests in flight (default: STRIPE_USAGE_REPORT_CONCURRENCY)')
+        parser.add_argument('--limit', type=int, help='Report at most this many periods')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the periods that would be reported')
+
+    def handle(self, *args, **options):
+        # Usage buffered in this process is written first so it is included
+        from ...metering import usage_meter
+        usage_meter.flush()
+
+        sent, failed = report_usage(
+            batch_size=options['batch_size'],
+            concurrency=options['concurrency'],
+            limit=options['limit'],
+            dry_run=options['dry_run'],
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f"📋 {sent} periods have usage to report")
+            return
+        self.stdout.write(self.style.SUCCESS(f"✅ Reported {sent} periods"))
+        if failed:
+            self.stdout.write(self.style.WARNING(f"⚠️ {failed} periods failed and will be retried on the next run"))
@@ -0,0 +1,215 @@
+# metering.py - Buffered call-minute metering per user and billing period
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+import atexit
+import logging
+import threading
+
+from .entitlements import billing_period, get_entitlement
+from .quotas import charge_usage
+from .rollups import increment
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRIC = 'minutes'
+
+# The billing period a usage event counts towards
+UsageKey = namedtuple('UsageKey', ['user_id', 'metric', 'period_start', 'period_end', 'subscription_id'])
+
+def usage_key(user_id, metric, occurred_at):
+    """The period a usage event counts towards (see entitlements.billing_period)"""
+    entitlement = get_entitlement(user_id)
+    subscription_id = entitlement.subscription_id if entitlement else None
+    return UsageKey(user_id, metric, *billing_period(entitlement, occurred_at), subscription_id)
+
+def write_usage(model, key, quantity, count):
+    increment(
+        model,
+        {'user_id': key.user_id, 'metric': key.metric, 'period_start': key.period_start},
+        {'quantity': quantity, 'events': count},
+        defaults={'period_end': key.period_end, 'subscription_id': key.subscription_id},
+    )
+
+class UsageMeter:
+    """
+    Aggregate usage in memory and write it as batched increments.
+
+    Pending totals are flushed every `flush_interval` seconds or once `max_events` events
+    are buffered. Each flush adds to UsagePeriod rows with UPDATE ... SET quantity =
+    quantity + n, so any number of processes can meter the same user.
+    """
+
+    def __init__(self, flush_interval, max_events):
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self._pending = {}
+        self._events = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def record(self, user_id, quantity, metric=DEFAULT_METRIC, occurred_at=None):
+        """Buffer one usage event and return its UsageKey; no database write on this path"""
+        key = usage_key(user_id, metric, occurred_at or timezone.now())
+
+        with self._lock:
+            totals = self._pending.get(key)
+            if totals is None:
+                totals = self._pending[key] = [Decimal('0'), 0]
+            totals[0] += Decimal(quantity)
+            totals[1] += 1
+            self._events += 1
+
+            full = self._events >= self.max_events
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._timer_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+        return key
+
+    def pending(self, user_id, metric=DEFAULT_METRIC):
+        """Usage buffered in this process but not yet written, per period key"""
+        with self._lock:
+            return {
+                key: totals[0] for key, totals in self._pending.items()
+                if key.user_id == user_id and key.metric == metric
+            }
+
+    def flush(self):
+        """Write all buffered usage in one transaction; returns the number of events written"""
+        from .models import UsagePeriod
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                events, self._events = self._events, 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            if not pending:
+                return 0
+
+            # A stable order keeps concurrent flushes from deadlocking on the same rows
+            keys = sorted(pending, key=lambda key: (key.user_id, key.metric, key.period_start))
+            try:
+                with transaction.atomic():
+                    for key in keys:
+                        write_usage(UsagePeriod, key, *pending[key])
+                logger.debug(f"📏 Flushed {events} usage events into {len(pending)} periods")
+                return events
+
+            except (IntegrityError, DataError) as e:
+                # A row the database rejects (e.g. a deleted user) must not hold back the rest
+                logger.warning(f"⚠️ Usage flush rejected ({e}), writing {len(pending)} periods one at a time")
+                return self.flush_each(UsagePeriod, keys, pending)
+
+            except Exception as e:
+                logger.error(f"❌ Error flushing usage, keeping {events} events for the next flush: {e}", exc_info=True)
+                self.requeue(pending, events)
+                return 0
+
+    def _timer_flush(self):
+        """Flush from the timer thread, then close the connection it opened"""
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush_each(self, model, keys, pending):
+        """Write each period in its own transaction, dropping the ones the database rejects"""
+        written = 0
+        for position, key in enumerate(keys):
+            quantity, count = pending[key]
+            try:
+                with transaction.atomic():
+                    write_usage(model, key, quantity, count)
+                written += count
+            except (IntegrityError, DataError) as e:
+                # Retrying cannot succeed; log the totals so they can be restored by hand
+                logger.error(f"❌ Dropping {count} usage events ({quantity} {key.metric}) for user {key.user_id}: {e}")
+            except Exception as e:
+                rest = {key: pending[key] for key in keys[position:]}
+                logger.error(f"❌ Error flushing usage, keeping {len(rest)} periods for the next flush: {e}", exc_info=True)
+                self.requeue(rest, sum(count for _, count in rest.values()))
+                break
+        return written
+
+    def requeue(self, pending, events):
+        """Put unwritten totals back so the next flush retries them"""
+        with self._lock:
+            for key, (quantity, count) in pending.items():
+                totals = self._pending.setdefault(key, [Decimal('0'), 0])
+                totals[0] += quantity
+                totals[1] += count
+            self._events += events
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._timer_flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+usage_meter = UsageMeter(
+    getattr(settings, 'USAGE_FLUSH_INTERVAL', 5),
+    getattr(settings, 'USAGE_FLUSH_MAX_EVENTS', 5000),
+)
+atexit.register(usage_meter.flush)
+
+def record_usage(user_id, quantity, metric=DEFAULT_METRIC, occurred_at=None):
+    """Meter `quantity` units (call minutes by default) for a user"""
+    key = usage_meter.record(user_id, quantity, metric, occurred_at)
+    # Keep the admission counters in step without waiting for the next flush
+    charge_usage(key, quantity)
+
+def current_usage(user_id, metric=DEFAULT_METRIC):
+    """
+    Usage in the user's current period against their plan limit.
+
+    One indexed query; totals still buffered in other processes show up after their next
+    flush (USAGE_FLUSH_INTERVAL).
+    """
+    from .models import UsagePeriod
+
+    key = usage_key(user_id, metric, timezone.now())
+    stored = (
+        UsagePeriod.objects.filter(user_id=user_id, metric=metric, period_start=key.period_start)
+        .values_list('quantity', flat=True)
+        .first()
+    )
+    used = (stored or Decimal('0')) + usage_meter.pending(user_id, metric).get(key, Decimal('0'))
+
+    entitlement = get_entitlement(user_id)
+    limit = entitlement.limits.get(metric) if entitlement else None
+    return {
+        'metric': metric,
+        'used': used,
+        'limit': limit,
+        'period_start': key.period_start,
+        'period_end': key.period_end,
+    }
+
+def unknown_users(user_ids):
+    """The IDs in `user_ids` that have no User row (usage for them could never be written)"""
+    from django.contrib.auth.models import User
+
+    user_ids = set(user_ids)
+    return user_ids - set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+
+def parse_occurred_at(value):
+    """Unix timestamp or ISO 8601 string -> aware datetime (None if missing)"""
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        except (OverflowError, OSError) as e:
+            # Beyond the platform's time_t or datetime range (e.g. 1e20 or inf)
+            raise ValueError(f"occurred_at out of range: {value!r}") from e
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, timezone.utc)
@@ -0,0 +1,18 @@
+# 0002_webhookevent_processing_status.py - Queue status for asynchronous webhook processing
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='status',
+            field=models.CharField(choices=[('success', 'Success'), ('error', 'Error'), ('pending', 'Pending'), ('processing', 'Processing')], default='pending', max_length=10),
+        ),
+    ]
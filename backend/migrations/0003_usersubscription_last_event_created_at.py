@@ -0,0 +1,18 @@
+# 0003_usersubscription_last_event_created_at.py - Track the newest applied Stripe event per subscription
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0002_webhookevent_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='last_event_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
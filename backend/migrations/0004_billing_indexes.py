@@ -0,0 +1,51 @@
+# 0004_billing_indexes.py - Indexes for the lookups done by webhook handlers and billing pages
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0003_usersubscription_last_event_created_at'),
+    ]
+
+    operations = [
+        # Redundant with the unique constraint on stripe_event_id
+        migrations.RemoveIndex(
+            model_name='webhookevent',
+            name='webhook_eve_stripe__b3a8a6_idx',
+        ),
+        # Superseded by the (status, created_at) index below
+        migrations.RemoveIndex(
+            model_name='webhookevent',
+            name='webhook_eve_status_96b87e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['status', 'created_at'], name='webhook_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['stripe_customer_id'], name='usersub_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['user', 'status'], name='usersub_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['status', 'current_period_end'], name='usersub_status_period_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['stripe_subscription_id'], name='invoice_subscription_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['stripe_customer_id'], name='invoice_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', '-created_at'], name='invoice_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# 0005_webhookpayload.py - Compressed, content-addressed storage for webhook payloads
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0004_billing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookPayload',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(help_text='Uncompressed size in bytes')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'webhook_payloads',
+            },
+        ),
+        migrations.AddField(
+            model_name='webhookevent',
+            name='payload',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='your_app.webhookpayload'),
+        ),
+    ]
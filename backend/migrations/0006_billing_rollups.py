@@ -0,0 +1,55 @@
+# 0006_billing_rollups.py - Incrementally maintained billing aggregates for the dashboard
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0005_webhookpayload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, help_text='Price of the first line item', max_length=100),
+        ),
+        migrations.CreateModel(
+            name='DailyBillingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('stripe_price_id', models.CharField(blank=True, max_length=100)),
+                ('currency', models.CharField(default='usd', max_length=3)),
+                ('invoices_paid', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('invoices_failed', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'billing_daily_rollups',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailybillingrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'stripe_price_id', 'currency'), name='billing_daily_rollup_key'),
+        ),
+        migrations.CreateModel(
+            name='PlanStatusRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_price_id', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('trialing', 'Trialing'), ('active', 'Active'), ('past_due', 'Past Due'), ('canceled', 'Canceled'), ('unpaid', 'Unpaid'), ('incomplete', 'Incomplete'), ('incomplete_expired', 'Incomplete Expired'), ('paused', 'Paused')], max_length=20)),
+                ('subscriptions', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'billing_plan_rollups',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='planstatusrollup',
+            constraint=models.UniqueConstraint(fields=('stripe_price_id', 'status'), name='billing_plan_rollup_key'),
+        ),
+    ]
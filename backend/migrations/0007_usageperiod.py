@@ -0,0 +1,39 @@
+# 0007_usageperiod.py - Metered usage per user, metric and billing period
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('your_app', '0006_billing_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsagePeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(default='minutes', help_text='Key in Plan.limits', max_length=50)),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField()),
+                ('quantity', models.DecimalField(decimal_places=3, default=Decimal('0'), max_digits=14)),
+                ('events', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('subscription', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='usage_periods', to='your_app.usersubscription')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_periods', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'usage_periods',
+                'ordering': ['-period_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usageperiod',
+            constraint=models.UniqueConstraint(fields=('user', 'metric', 'period_start'), name='usage_period_key'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# 0008_usage_reporting.py - Subscription item ids and reported-usage watermarks for Stripe
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0007_usageperiod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='stripe_subscription_item_id',
+            field=models.CharField(blank=True, help_text='Item that metered usage is reported to', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='usageperiod',
+            name='reported_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usageperiod',
+            name='reported_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='usageperiod',
+            index=models.Index(fields=['period_end'], name='usage_period_end_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# 0009_synccheckpoint.py - Checkpoints for incremental Stripe reconciliation
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0008_usage_reporting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text="Resource, e.g. 'subscriptions'", max_length=50, unique=True)),
+                ('synced_until', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'sync_checkpoints',
+            },
+        ),
+    ]
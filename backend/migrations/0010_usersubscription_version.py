@@ -0,0 +1,18 @@
+# 0010_usersubscription_version.py - Optimistic concurrency version for UserSubscription
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0009_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# 0011_invoice_user.py - Link invoices to users and index a user's invoice history
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('your_app', '0010_usersubscription_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to=settings.AUTH_USER_MODEL),
+        ),
+        # Existing rows are linked afterwards with manage.py backfill_invoice_users
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(
+                fields=['user', '-created_at', '-id'],
+                include=['stripe_invoice_id', 'amount', 'currency', 'status', 'paid_at', 'payment_failed_at'],
+                name='invoice_user_history_idx',
+            ),
+        ),
+    ]
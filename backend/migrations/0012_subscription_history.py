@@ -0,0 +1,29 @@
+# 0012_subscription_history.py - Actions, transition timestamps and timeline index for SubscriptionHistory
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('your_app', '0011_invoice_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscriptionhistory',
+            name='action',
+            field=models.CharField(choices=[('created', 'Created'), ('upgraded', 'Upgraded'), ('downgraded', 'Downgraded'), ('canceled', 'Canceled'), ('reactivated', 'Reactivated'), ('renewed', 'Renewed'), ('payment_failed', 'Payment Failed'), ('plan_changed', 'Plan Changed'), ('status_changed', 'Status Changed')], max_length=20),
+        ),
+        # Entries are written in batches, so the time is set when the change is recorded
+        migrations.AlterField(
+            model_name='subscriptionhistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='subscriptionhistory',
+            index=models.Index(fields=['subscription', 'created_at'], name='subhistory_sub_created_idx'),
+        ),
+    ]
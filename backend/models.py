@@ -1,9 +1,26 @@
 # models.py - Database Models for Webhook Integration
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils import timezone
 from decimal import Decimal
 
+from .plan_catalog import plan_changed
+from .rollups import subscription_deleted, subscription_saved, subscription_saving
+
+# Billing periods per month, for comparing plans with different intervals
+MONTHLY_MULTIPLIERS = {
+    'month': Decimal('1'),
+    'year': Decimal('1') / Decimal('12'),
+    'week': Decimal('4.33'),   # Average weeks per month
+    'day': Decimal('30.44'),   # Average days per month
+}
+
+def monthly_price_for(price, billing_interval):
+    """Monthly equivalent of a price, rounded to cents"""
+    multiplier = MONTHLY_MULTIPLIERS.get(billing_interval, Decimal('1'))
+    return (Decimal(price) * multiplier).quantize(Decimal('0.01'))
+
 class UserSubscription(models.Model):
     """User subscription model with Stripe integration"""
     
@@ -27,6 +44,7 @@ class UserSubscription(models.Model):
     stripe_customer_id = models.CharField(max_length=100, blank=True)
     stripe_subscription_id = models.CharField(max_length=100, blank=True, unique=True)
     stripe_price_id = models.CharField(max_length=100, blank=True)
+    stripe_subscription_item_id = models.CharField(max_length=100, blank=True, help_text="Item that metered usage is reported to")
     stripe_payment_intent_id = models.CharField(max_length=100, blank=True)
     
     # Subscription periods
@@ -43,6 +61,12 @@ class UserSubscription(models.Model):
     last_payment_date = models.DateTimeField(null=True, blank=True)
     last_invoice_paid_at = models.DateTimeField(null=True, blank=True)
     
+    # Stripe `created` time of the newest event applied, used to drop out-of-order deliveries
+    last_event_created_at = models.DateTimeField(null=True, blank=True)
+    
+    # Bumped by every webhook/replay write; compare-and-swap target for concurrent deliveries
+    version = models.PositiveIntegerField(default=0)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -50,6 +74,12 @@ class UserSubscription(models.Model):
     class Meta:
         db_table = 'user_subscriptions'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['stripe_customer_id'], name='usersub_customer_idx'),
+            models.Index(fields=['user', 'status'], name='usersub_user_status_idx'),
+            # Renewal and trial-ending lookups: status IN (...) AND current_period_end range
+            models.Index(fields=['status', 'current_period_end'], name='usersub_status_period_end_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.plan_id} ({self.status})"
@@ -88,6 +118,13 @@ class Invoice(models.Model):
     stripe_invoice_id = models.CharField(max_length=100, unique=True)
     stripe_customer_id = models.CharField(max_length=100, blank=True)
     stripe_subscription_id = models.CharField(max_length=100, blank=True)
+    stripe_price_id = models.CharField(max_length=100, blank=True, help_text="Price of the first line item")
+    
+    # Denormalized from UserSubscription by the invoice handlers (backfill_invoice_users for older rows);
+    # invoice_user_history_idx leads with user_id, so the FK needs no index of its own
+    user = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='invoices', db_index=False
+    )
     
     # Invoice details
     customer_email = models.EmailField()
@@ -110,10 +147,127 @@ class Invoice(models.Model):
     class Meta:
         db_table = 'invoices'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['stripe_subscription_id'], name='invoice_subscription_idx'),
+            models.Index(fields=['stripe_customer_id'], name='invoice_customer_idx'),
+            models.Index(fields=['status', '-created_at'], name='invoice_status_created_idx'),
+            # Keyset pages of a user's invoice history; INCLUDE makes them index-only scans on PostgreSQL
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                name='invoice_user_history_idx',
+                include=['stripe_invoice_id', 'amount', 'currency', 'status', 'paid_at', 'payment_failed_at'],
+            ),
+        ]
     
     def __str__(self):
         return f"Invoice {self.stripe_invoice_id} - ${self.amount} ({self.status})"
 
+class DailyBillingRollup(models.Model):
+    """Invoice totals per day, Stripe price and currency, kept current by the webhook handlers"""
+    
+    day = models.DateField()
+    stripe_price_id = models.CharField(max_length=100, blank=True)
+    currency = models.CharField(max_length=3, default='usd')
+    
+    # Invoices paid (by paid_at) and invoices whose payment failed (by payment_failed_at)
+    invoices_paid = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    invoices_failed = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'billing_daily_rollups'
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'stripe_price_id', 'currency'], name='billing_daily_rollup_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.stripe_price_id or '-'}: {self.revenue} {self.currency}"
+
+class PlanStatusRollup(models.Model):
+    """Number of subscriptions per Stripe price and status"""
+    
+    stripe_price_id = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=UserSubscription.STATUS_CHOICES)
+    subscriptions = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'billing_plan_rollups'
+        constraints = [
+            models.UniqueConstraint(fields=['stripe_price_id', 'status'], name='billing_plan_rollup_key'),
+        ]
+    
+    def __str__(self):
+        return f"{self.stripe_price_id or '-'} {self.status}: {self.subscriptions}"
+
+class UsagePeriod(models.Model):
+    """Metered usage (call minutes by default) per user, metric and billing period"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='usage_periods')
+    subscription = models.ForeignKey(
+        UserSubscription, null=True, blank=True, on_delete=models.SET_NULL, related_name='usage_periods'
+    )
+    metric = models.CharField(max_length=50, default='minutes', help_text="Key in Plan.limits")
+    
+    # UserSubscription.current_period_start/end when the usage was recorded
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    
+    # Only ever changed with F() increments by metering.UsageMeter
+    quantity = models.DecimalField(max_digits=14, decimal_places=3, default=Decimal('0'))
+    events = models.IntegerField(default=0)
+    
+    # Whole units last sent to Stripe as the period's usage record (usage_reporting)
+    reported_quantity = models.PositiveIntegerField(default=0)
+    reported_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'usage_periods'
+        ordering = ['-period_start']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'metric', 'period_start'], name='usage_period_key'),
+        ]
+        indexes = [
+            # Usage reporting only looks at recent periods
+            models.Index(fields=['period_end'], name='usage_period_end_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} {self.metric}: {self.quantity} ({self.period_start.date()} - {self.period_end.date()})"
+
+class WebhookPayload(models.Model):
+    """Compressed, content-addressed Stripe objects referenced by WebhookEvent"""
+    
+    # SHA-256 of the canonical JSON, so identical objects are stored once
+    digest = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField(help_text="Uncompressed size in bytes")
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'webhook_payloads'
+    
+    def __str__(self):
+        return f"Payload {self.digest[:12]} ({self.size} bytes)"
+
+class SyncCheckpoint(models.Model):
+    """How far reconcile_stripe has compared each Stripe resource with the local tables"""
+    
+    name = models.CharField(max_length=50, unique=True, help_text="Resource, e.g. 'subscriptions'")
+    # Stripe objects created before this time have been examined
+    synced_until = models.DateTimeField()
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'sync_checkpoints'
+    
+    def __str__(self):
+        return f"{self.name} synced until {self.synced_until}"
+
 class WebhookEvent(models.Model):
     """Track webhook events for monitoring and debugging"""
     
@@ -121,6 +275,7 @@ class WebhookEvent(models.Model):
         ('success', 'Success'),
         ('error', 'Error'),
         ('pending', 'Pending'),
+        ('processing', 'Processing'),
     ]
     
     # Event details
@@ -132,8 +287,11 @@ class WebhookEvent(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     error_message = models.TextField(blank=True)
     
-    # Event data
+    # Event data: the event envelope inline, its data.object in WebhookPayload
     event_data = models.JSONField(default=dict, blank=True)
+    payload = models.ForeignKey(
+        WebhookPayload, null=True, blank=True, on_delete=models.PROTECT, related_name='events'
+    )
     
     # Timestamps
     processed_at = models.DateTimeField(default=timezone.now)
@@ -142,10 +300,10 @@ class WebhookEvent(models.Model):
     class Meta:
         db_table = 'webhook_events'
         ordering = ['-created_at']
+        # stripe_event_id is already indexed by its unique constraint
         indexes = [
-            models.Index(fields=['stripe_event_id']),
             models.Index(fields=['event_type']),
-            models.Index(fields=['status']),
+            models.Index(fields=['status', 'created_at'], name='webhook_status_created_idx'),
         ]
     
     def __str__(self):
@@ -194,15 +352,7 @@ class Plan(models.Model):
     @property
     def monthly_price(self):
         """Convert price to monthly equivalent for comparison"""
-        if self.billing_interval == 'month':
-            return self.price
-        elif self.billing_interval == 'year':
-            return self.price / 12
-        elif self.billing_interval == 'week':
-            return self.price * 4.33  # Average weeks per month
-        elif self.billing_interval == 'day':
-            return self.price * 30.44  # Average days per month
-        return self.price
+        return monthly_price_for(self.price, self.billing_interval)
 
 class PaymentMethod(models.Model):
     """User payment methods"""
@@ -255,6 +405,8 @@ class SubscriptionHistory(models.Model):
         ('reactivated', 'Reactivated'),
         ('renewed', 'Renewed'),
         ('payment_failed', 'Payment Failed'),
+        ('plan_changed', 'Plan Changed'),
+        ('status_changed', 'Status Changed'),
     ]
     
     subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name='history')
@@ -268,12 +420,24 @@ class SubscriptionHistory(models.Model):
     reason = models.TextField(blank=True)
     metadata = models.JSONField(default=dict, blank=True)
     
-    # Timestamp
-    created_at = models.DateTimeField(auto_now_add=True)
+    # When the change was applied; entries are written in batches later (subscription_history.py)
+    created_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         db_table = 'subscription_history'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['subscription', 'created_at'], name='subhistory_sub_created_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.subscription.user.username} - {self.action} on {self.created_at.date()}"
\ No newline at end of file
+        return f"{self.subscription.user.username} - {self.action} on {self.created_at.date()}"
+
+# Keep the in-memory plan catalog in sync with Plan changes
+post_save.connect(plan_changed, sender=Plan, dispatch_uid='plan_catalog_save')
+post_delete.connect(plan_changed, sender=Plan, dispatch_uid='plan_catalog_delete')
+
+# Count subscriptions created, changed or deleted outside the webhook handlers in the plan rollups
+pre_save.connect(subscription_saving, sender=UserSubscription, dispatch_uid='rollups_subscription_saving')
+post_save.connect(subscription_saved, sender=UserSubscription, dispatch_uid='rollups_subscription_save')
+post_delete.connect(subscription_deleted, sender=UserSubscription, dispatch_uid='rollups_subscription_delete')
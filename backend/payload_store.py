@@ -0,0 +1,80 @@
+# payload_store.py - Compact storage and rehydration of raw Stripe event payloads
+import hashlib
+import json
+import zlib
+
+from .webhook_payload import loads
+
+try:
+    import orjson
+
+    def canonical_json(value):
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+except ImportError:  # orjson is optional; the stdlib encoder is the fallback
+    def canonical_json(value):
+        return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+COMPRESSION_LEVEL = 6
+
+def split_event(event):
+    """Separate the small event envelope from its (large) data.object"""
+    envelope = {key: value for key, value in event.items() if key != 'data'}
+    data = dict(event.get('data') or {})
+    obj = data.pop('object', None)
+    if data:
+        # e.g. previous_attributes on *.updated events
+        envelope['data'] = data
+    return envelope, obj
+
+def payload_row(obj):
+    """Unsaved WebhookPayload for a Stripe object, keyed by the digest of its canonical JSON"""
+    from .models import WebhookPayload
+
+    raw = canonical_json(obj)
+    return WebhookPayload(
+        digest=hashlib.sha256(raw).hexdigest(), data=zlib.compress(raw, COMPRESSION_LEVEL), size=len(raw)
+    )
+
+def store_object(obj):
+    """Compress and store a Stripe object once per distinct content; returns its digest"""
+    from .models import WebhookPayload
+
+    payload = payload_row(obj)
+    # A single INSERT ... ON CONFLICT DO NOTHING; identical objects are already stored
+    WebhookPayload.objects.bulk_create([payload], ignore_conflicts=True)
+    return payload.digest
+
+def pack_event(event):
+    """Store an event's object; returns (envelope for WebhookEvent.event_data, payload digest)"""
+    envelope, obj = split_event(event)
+    if obj is None:
+        return envelope, None
+    return envelope, store_object(obj)
+
+def decode_object(data):
+    """Decompress a stored WebhookPayload.data value"""
+    return loads(zlib.decompress(bytes(data)))
+
+def rehydrate(event_data, payload_data):
+    """Rebuild the full event dict from an envelope and compressed object bytes"""
+    event = dict(event_data or {})
+    if payload_data is not None:
+        event['data'] = dict(event.get('data') or {}, object=decode_object(payload_data))
+    return event
+
+def load_event(webhook_event):
+    """
+    Full Stripe event for a WebhookEvent, ready for dispatch_event.
+
+    Rows stored before payloads were split out keep the whole event in event_data.
+    Use select_related('payload') when loading many rows.
+    """
+    payload = webhook_event.payload
+    return rehydrate(webhook_event.event_data, payload.data if payload is not None else None)
+
+def delete_orphaned_payloads():
+    """Remove payloads no WebhookEvent references any more (e.g. after archiving)"""
+    from .models import WebhookPayload
+
+    deleted, _ = WebhookPayload.objects.filter(events__isnull=True).delete()
+    return deleted
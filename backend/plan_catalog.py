@@ -0,0 +1,159 @@
+# plan_catalog.py - Immutable in-process snapshot of the plans
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from types import MappingProxyType
+import hashlib
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PlanSnapshot = namedtuple('PlanSnapshot', [
+    'id',
+    'name',
+    'description',
+    'price',
+    'monthly_price',
+    'currency',
+    'billing_interval',
+    'stripe_price_id',
+    'stripe_product_id',
+    'features',
+    'limits',
+    'is_popular',
+    'is_active',
+])
+
+def content_digest(plans):
+    """Stable hash of plan snapshots, for ETags that change exactly when the content does"""
+    content = [dict(plan._asdict(), limits=dict(plan.limits), features=list(plan.features)) for plan in plans]
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+class PlanCatalog:
+    """
+    A versioned, read-only view of every plan, indexed by id and Stripe price ID.
+
+    Retired (inactive) plans stay in the indexes because existing subscriptions still
+    point at them; `active` is what may be offered to new customers.
+    """
+
+    __slots__ = ('version', 'plans', 'active', 'digest', 'by_id', 'by_price_id')
+
+    def __init__(self, version, plans):
+        self.version = version
+        self.plans = tuple(plans)
+        self.active = tuple(plan for plan in self.plans if plan.is_active)
+        self.digest = content_digest(self.active)
+        self.by_id = MappingProxyType({plan.id: plan for plan in self.plans})
+        self.by_price_id = MappingProxyType({plan.stripe_price_id: plan for plan in self.plans})
+
+    def get(self, plan_id):
+        try:
+            return self.by_id.get(int(plan_id))
+        except (TypeError, ValueError):
+            return None
+
+    def for_price(self, stripe_price_id):
+        return self.by_price_id.get(stripe_price_id)
+
+    def __iter__(self):
+        return iter(self.plans)
+
+    def __len__(self):
+        return len(self.plans)
+
+VERSION_KEY = 'plan_catalog:version'
+
+_catalog = None
+_checked_at = 0.0
+_built_at = 0.0
+_local_version = 0
+_lock = threading.Lock()
+
+def shared_cache():
+    """Cache used to share the catalog version between processes (PLAN_CATALOG_CACHE_ALIAS)"""
+    alias = getattr(settings, 'PLAN_CATALOG_CACHE_ALIAS', None)
+    return caches[alias] if alias else None
+
+def current_version():
+    shared = shared_cache()
+    if shared is None:
+        return _local_version
+    return shared.get_or_set(VERSION_KEY, 1, None)
+
+def build_catalog(version):
+    """Load every plan and precompute everything the pricing pages need"""
+    from .models import Plan, monthly_price_for
+
+    plans = []
+    for plan in Plan.objects.order_by('price', 'id'):
+        plans.append(PlanSnapshot(
+            id=plan.id,
+            name=plan.name,
+            description=plan.description,
+            price=plan.price,
+            monthly_price=monthly_price_for(plan.price, plan.billing_interval),
+            currency=plan.currency,
+            billing_interval=plan.billing_interval,
+            stripe_price_id=plan.stripe_price_id,
+            stripe_product_id=plan.stripe_product_id,
+            features=tuple(plan.features or ()),
+            limits=MappingProxyType(dict(plan.limits or {})),
+            is_popular=plan.is_popular,
+            is_active=plan.is_active,
+        ))
+
+    catalog = PlanCatalog(version, plans)
+    logger.info(f"📚 Loaded plan catalog v{version} ({len(plans)} plans, {len(catalog.active)} active)")
+    return catalog
+
+def get_catalog():
+    """
+    Return the current PlanCatalog, rebuilding it after a Plan change.
+
+    The shared version is checked at most every PLAN_CATALOG_CHECK_INTERVAL seconds, so
+    other processes pick up changes within that interval. The catalog is also rebuilt
+    once it is PLAN_CATALOG_MAX_AGE seconds old, which bounds staleness without a shared
+    cache (each process only sees its own version bumps) or after the version key was
+    evicted, and covers Plan changes made with queryset.update().
+    """
+    global _catalog, _checked_at, _built_at
+
+    interval = getattr(settings, 'PLAN_CATALOG_CHECK_INTERVAL', 5)
+    max_age = getattr(settings, 'PLAN_CATALOG_MAX_AGE', 60)
+    catalog = _catalog
+    if catalog is not None and time.monotonic() - _checked_at < interval:
+        return catalog
+
+    with _lock:
+        version = current_version()
+        now = time.monotonic()
+        if _catalog is None or _catalog.version != version or now - _built_at >= max_age:
+            _catalog = build_catalog(version)
+            _built_at = now
+        _checked_at = now
+        return _catalog
+
+def invalidate_catalog():
+    """Bump the catalog version once the current transaction commits"""
+    def bump():
+        global _local_version, _checked_at
+        with _lock:
+            _local_version += 1
+            _checked_at = 0.0
+        shared = shared_cache()
+        if shared is not None:
+            try:
+                shared.incr(VERSION_KEY)
+            except ValueError:
+                shared.set(VERSION_KEY, 2, None)
+
+    transaction.on_commit(bump)
+
+def plan_changed(sender, **kwargs):
+    """post_save/post_delete receiver for Plan (queryset.update() does not send signals)"""
+    invalidate_catalog()
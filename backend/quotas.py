@@ -0,0 +1,157 @@
+# quotas.py - Fast Plan.limits admission checks for outbound calls
+from collections import namedtuple
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+import logging
+import time
+
+from .entitlements import billing_period, entitlement_is_active, get_entitlement
+
+logger = logging.getLogger(__name__)
+
+# Keys in Plan.limits
+MINUTES_LIMIT = 'minutes'
+CONCURRENT_CALLS_LIMIT = 'concurrent_calls'
+AGENTS_LIMIT = 'agents'
+CALLS_PER_MINUTE_LIMIT = 'calls_per_minute'
+
+# Cache counters are integers, so minutes are counted in thousandths
+UNITS_PER_MINUTE = 1000
+
+Admission = namedtuple('Admission', ['allowed', 'reason', 'minutes_remaining'])
+
+# In-process fallback when QUOTA_CACHE_ALIAS is not set (single process / tests)
+local_store = LocMemCache('billing-quotas', {'MAX_ENTRIES': 100000})
+
+def quota_store():
+    """Cache holding the quota counters; must be shared (e.g. Redis) with several processes"""
+    alias = getattr(settings, 'QUOTA_CACHE_ALIAS', None)
+    return caches[alias] if alias else local_store
+
+def minutes_key(user_id, period_start):
+    return f"quota:{user_id}:minutes:{int(period_start.timestamp())}"
+
+def calls_key(user_id):
+    return f"quota:{user_id}:calls"
+
+def rate_key(user_id, window):
+    return f"quota:{user_id}:rate:{window}"
+
+def bump(store, key, delta, timeout):
+    """Atomically add `delta` to a counter, creating it when missing; returns the new value"""
+    try:
+        return store.incr(key, delta)
+    except ValueError:
+        if store.add(key, delta, timeout):
+            return delta
+        # Another process created it first
+        return store.incr(key, delta)
+
+def period_timeout(period_end):
+    """Keep period counters a day past the period so late checks still find them"""
+    return max(int((period_end - timezone.now()).total_seconds()) + 86400, 60)
+
+def seed_minutes(store, key, user_id, period_start, period_end):
+    """
+    Load used minutes from UsagePeriod plus this process's unflushed usage (rare path).
+
+    Other processes' unflushed usage is not visible here. It is only missed when the
+    counter is created while they still buffer usage charged before it existed (first
+    use of a period, or after the quota store evicted it), so the counter can trail by
+    up to USAGE_FLUSH_INTERVAL of their usage until the next reseed (reset_quota).
+    """
+    from .metering import usage_meter
+    from .models import UsagePeriod
+
+    stored = (
+        UsagePeriod.objects.filter(user_id=user_id, metric=MINUTES_LIMIT, period_start=period_start)
+        .values_list('quantity', flat=True)
+        .first()
+    ) or Decimal('0')
+    pending = sum(
+        (quantity for usage, quantity in usage_meter.pending(user_id, MINUTES_LIMIT).items()
+         if usage.period_start == period_start),
+        Decimal('0'),
+    )
+    units = int((stored + pending) * UNITS_PER_MINUTE)
+    if not store.add(key, units, period_timeout(period_end)):
+        units = store.get(key, units)
+    return units
+
+def check_call_admission(user_id, agents=None):
+    """
+    Decide whether `user_id` may start a call now, and reserve a concurrent-call slot.
+
+    Limits come from the cached entitlement and counters from the quota store, so the
+    common case makes no database query. Call end_call() when an admitted call ends.
+    `agents` is the number of agents the user has configured, if known.
+    """
+    entitlement = get_entitlement(user_id)
+    if not entitlement_is_active(entitlement):
+        return Admission(False, 'no_active_subscription', None)
+
+    limits = entitlement.limits
+    store = quota_store()
+
+    agent_limit = limits.get(AGENTS_LIMIT)
+    if agent_limit is not None and agents is not None and agents > agent_limit:
+        return Admission(False, 'agent_limit', None)
+
+    minutes_remaining = None
+    minute_limit = limits.get(MINUTES_LIMIT)
+    if minute_limit is not None:
+        period_start, period_end = billing_period(entitlement, timezone.now())
+        key = minutes_key(user_id, period_start)
+        used = store.get(key)
+        if used is None:
+            used = seed_minutes(store, key, user_id, period_start, period_end)
+        minutes_remaining = Decimal(minute_limit) - Decimal(used) / UNITS_PER_MINUTE
+        if minutes_remaining <= 0:
+            return Admission(False, 'minutes_exhausted', Decimal('0'))
+
+    rate_limit = limits.get(CALLS_PER_MINUTE_LIMIT)
+    if rate_limit is not None:
+        window = int(time.time() // 60)
+        if bump(store, rate_key(user_id, window), 1, 120) > rate_limit:
+            return Admission(False, 'rate_limited', minutes_remaining)
+
+    concurrency_limit = limits.get(CONCURRENT_CALLS_LIMIT)
+    if concurrency_limit is not None:
+        timeout = getattr(settings, 'QUOTA_CALL_SLOT_TTL', 4 * 60 * 60)
+        if bump(store, calls_key(user_id), 1, timeout) > concurrency_limit:
+            store.decr(calls_key(user_id))
+            return Admission(False, 'concurrent_calls', minutes_remaining)
+
+    return Admission(True, None, minutes_remaining)
+
+def end_call(user_id):
+    """Release the concurrent-call slot reserved by check_call_admission()"""
+    store = quota_store()
+    try:
+        if store.decr(calls_key(user_id)) < 0:
+            store.set(calls_key(user_id), 0, getattr(settings, 'QUOTA_CALL_SLOT_TTL', 4 * 60 * 60))
+    except ValueError:
+        # The slot counter expired (QUOTA_CALL_SLOT_TTL); nothing to release
+        pass
+
+def charge_usage(usage_key, quantity):
+    """Add metered minutes (a metering.UsageKey) to the admission counter for its period"""
+    if usage_key.metric != MINUTES_LIMIT:
+        return
+
+    store = quota_store()
+    key = minutes_key(usage_key.user_id, usage_key.period_start)
+    try:
+        store.incr(key, int(Decimal(quantity) * UNITS_PER_MINUTE))
+    except ValueError:
+        # Not seeded yet; the seed includes this process's unflushed usage, this event too
+        seed_minutes(store, key, usage_key.user_id, usage_key.period_start, usage_key.period_end)
+
+def reset_quota(user_id):
+    """Forget a user's counters so they are reseeded (e.g. after correcting usage by hand)"""
+    entitlement = get_entitlement(user_id)
+    period_start, _ = billing_period(entitlement, timezone.now())
+    quota_store().delete_many([minutes_key(user_id, period_start), calls_key(user_id)])
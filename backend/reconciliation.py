@@ -0,0 +1,281 @@
+# reconciliation.py - Bring UserSubscription and Invoice rows back in line with Stripe
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+import logging
+import queue
+import stripe
+import threading
+import time
+
+from .replay import ChangeSet, apply_changes
+from .stripe_client import call_stripe
+from .webhooks import (
+    INVOICE_FAILED_UPDATE_FIELDS,
+    INVOICE_PAID_UPDATE_FIELDS,
+    from_timestamp,
+    invoice_failed_fields,
+    invoice_paid_fields,
+    subscription_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+# UserSubscription columns subscription_fields() can set
+SUBSCRIPTION_FIELDS = (
+    'status', 'current_period_start', 'current_period_end', 'cancel_at_period_end',
+    'canceled_at', 'stripe_price_id', 'stripe_subscription_item_id', 'plan_id',
+)
+
+def subscription_drift(subscription, local):
+    """Fields of a local UserSubscription that differ from the Stripe subscription"""
+    return {name: value for name, value in subscription_fields(subscription).items() if local[name] != value}
+
+def invoice_correction(invoice, local):
+    """
+    (fields, update_fields) that bring a local Invoice in line with Stripe, or None.
+
+    Mirrors what the invoice webhooks record: paid and failed invoices, plus voided and
+    uncollectible ones. Drafts and unattempted open invoices are left alone.
+    """
+    status = invoice['status']
+
+    if status == 'paid':
+        fields = invoice_paid_fields(invoice)
+        paid_at = from_timestamp((invoice.get('status_transitions') or {}).get('paid_at'))
+        if local and local['status'] == 'paid' and local['amount'] == fields['amount'] and (
+            paid_at is None or local['paid_at'] == paid_at
+        ):
+            return None
+        if paid_at is None and local and local['paid_at']:
+            # Keep the time recorded by the webhook rather than "now"
+            fields['paid_at'] = local['paid_at']
+        return fields, INVOICE_PAID_UPDATE_FIELDS
+
+    if status == 'open' and invoice.get('attempt_count'):
+        if local and local['status'] == 'payment_failed':
+            return None
+        return invoice_failed_fields(invoice), INVOICE_FAILED_UPDATE_FIELDS
+
+    if status in ('void', 'uncollectible'):
+        if local and local['status'] == status:
+            return None
+        return {'status': status}, ['status']
+
+    return None
+
+def compare_subscriptions(page, changes):
+    """
+    Queue corrections for one page of (as_of, Stripe subscription) pairs (one query);
+    returns the missing count.
+
+    Each correction carries `as_of`, the time the Stripe state was read, as its event
+    time, so a webhook created before it cannot overwrite the reconciled row later.
+    """
+    from .models import UserSubscription
+
+    local = {
+        row['stripe_subscription_id']: row
+        for row in UserSubscription.objects.filter(
+            stripe_subscription_id__in=[subscription['id'] for _, subscription in page]
+        ).values('stripe_subscription_id', *SUBSCRIPTION_FIELDS)
+    }
+
+    missing = 0
+    for as_of, subscription in page:
+        row = local.get(subscription['id'])
+        if row is None:
+            # The handlers never create subscriptions either; the checkout flow does
+            missing += 1
+            continue
+        drift = subscription_drift(subscription, row)
+        if drift:
+            changes.update_subscription(subscription['id'], drift, as_of)
+    return missing
+
+def compare_invoices(page, changes):
+    """Queue corrections for one page of (as_of, Stripe invoice) pairs (one query)"""
+    from .models import Invoice
+
+    local = {
+        row['stripe_invoice_id']: row
+        for row in Invoice.objects.filter(
+            stripe_invoice_id__in=[invoice['id'] for _, invoice in page]
+        ).values('stripe_invoice_id', 'status', 'amount', 'paid_at')
+    }
+
+    for _, invoice in page:
+        correction = invoice_correction(invoice, local.get(invoice['id']))
+        if correction:
+            fields, update_fields = correction
+            changes.upsert_invoice(invoice, fields, update_fields)
+
+# What is reconciled: list endpoint, extra list parameters, events that change the objects, page comparison
+RESOURCES = {
+    'subscriptions': (stripe.Subscription, {'status': 'all'}, 'customer.subscription.*', compare_subscriptions),
+    'invoices': (stripe.Invoice, {}, 'invoice.*', compare_invoices),
+}
+
+# Stripe keeps events for 30 days; older checkpoints fall back to listing every object
+EVENT_RETENTION = timedelta(days=30)
+
+def time_windows(start, end, count):
+    """Split [start, end) into `count` consecutive unix-time windows"""
+    start, end = int(start.timestamp()), int(end.timestamp()) + 1
+    step = max(1, -(-(end - start) // max(1, count)))
+    return [(low, min(low + step, end)) for low in range(start, end, step)]
+
+def hand_over(pages, item, cancelled):
+    """Put `item` on the bounded queue unless the consumer gave up; False if it did"""
+    while not cancelled.is_set():
+        try:
+            pages.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def fetch_window(request, params, window, page_size, pages, cancelled):
+    """
+    Page through one creation-time window, handing each page to the consumer; runs in a thread.
+
+    Pages are queued as (time requested, objects), so a producer never outlives a
+    consumer that stopped early (see hand_over).
+    """
+    try:
+        starting_after = None
+        while True:
+            extra = {'starting_after': starting_after} if starting_after else {}
+            requested = int(time.time())
+            page = call_stripe(
+                request, limit=page_size, created={'gte': window[0], 'lt': window[1]}, **params, **extra
+            )
+            if page.data and not hand_over(pages, (requested, page.data), cancelled):
+                return
+            if not page.has_more or not page.data:
+                break
+            starting_after = page.data[-1]['id']
+    except Exception as e:
+        hand_over(pages, e, cancelled)
+    finally:
+        hand_over(pages, None, cancelled)
+
+def sync_range(name, since, full):
+    """(earliest time to examine for `name`, whether Stripe events can cover it)"""
+    from .models import Invoice, SyncCheckpoint, UserSubscription
+
+    if since:
+        return since, False
+
+    overlap = timedelta(seconds=getattr(settings, 'STRIPE_RECONCILE_OVERLAP', 3600))
+    checkpoint = SyncCheckpoint.objects.filter(name=name).values_list('synced_until', flat=True).first()
+    if checkpoint and not full:
+        # Events can show up in list results a little after their creation time
+        start = checkpoint - overlap
+        if start > timezone.now() - EVENT_RETENTION:
+            return start, True
+        logger.warning(f"⚠️ {name} checkpoint is older than Stripe's event retention; examining everything")
+
+    model = UserSubscription if name == 'subscriptions' else Invoice
+    earliest = model.objects.aggregate(earliest=Min('created_at'))['earliest']
+    # Local rows are created after their Stripe objects; a day of margin covers the gap
+    return (earliest or timezone.now()) - timedelta(days=1), False
+
+def latest_objects(events, latest):
+    """Keep the newest state of each object among `events` in `latest` (id -> (created, object))"""
+    for event in events:
+        obj = event['data']['object']
+        if not obj.get('id'):
+            # e.g. invoice.upcoming previews an invoice that does not exist yet
+            continue
+        known = latest.get(obj['id'])
+        if known is None or known[0] < event['created']:
+            latest[obj['id']] = (event['created'], obj)
+
+def reconcile(name, since=None, full=False, concurrency=None, windows=None, page_size=100,
+              batch_size=500, dry_run=False):
+    """
+    Compare Stripe objects with local rows and fix drift.
+
+    Incremental runs page through the events since the checkpoint, so every object that
+    changed is examined at its latest state, whenever it was created. `since`, `full`
+    and checkpoints older than Stripe's event retention list the objects created in the
+    range instead.
+
+    The time range is split into windows that are paged through concurrently, with at most
+    `concurrency` Stripe requests in flight. Objects are compared and corrected on the
+    calling thread, one query per page plus bulk writes only when something differs. The
+    checkpoint moves forward only when every window finished.
+    """
+    from .models import SyncCheckpoint
+
+    resource, params, event_types, compare = RESOURCES[name]
+    concurrency = concurrency or getattr(settings, 'STRIPE_RECONCILE_CONCURRENCY', 4)
+    started = timezone.now()
+    start, from_events = sync_range(name, since, full)
+    ranges = time_windows(start, started, windows or concurrency * 2)
+    request, params = (stripe.Event.list, {'type': event_types}) if from_events else (resource.list, params)
+
+    stats = {'examined': 0, 'corrected': 0, 'missing': 0, 'failed_windows': 0}
+    latest = {}
+
+    def check(page):
+        changes = ChangeSet()
+        stats['examined'] += len(page)
+        stats['missing'] += compare(page, changes) or 0
+        corrected = len(changes.subscriptions) + len(changes.invoices)
+        stats['corrected'] += corrected
+        if corrected and not dry_run:
+            apply_changes(changes, batch_size)
+
+    pages = queue.Queue(maxsize=concurrency * 2)
+    cancelled = threading.Event()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for window in ranges:
+            executor.submit(fetch_window, request, params, window, page_size, pages, cancelled)
+
+        try:
+            remaining = len(ranges)
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
+                    continue
+                if isinstance(page, Exception):
+                    logger.error(f"❌ Failed to list Stripe {name}: {page}")
+                    stats['failed_windows'] += 1
+                    continue
+
+                requested, objects = page
+                if from_events:
+                    # Windows finish in any order; only the newest state of each object counts
+                    latest_objects(objects, latest)
+                else:
+                    check([(requested, obj) for obj in objects])
+        finally:
+            # Producers still paging stop at their next hand-over instead of blocking forever
+            cancelled.set()
+
+    if stats['failed_windows']:
+        # A missing window may hold an object's newest event; applying an older one could regress it
+        latest.clear()
+    states = list(latest.values())
+    for offset in range(0, len(states), page_size):
+        check(states[offset:offset + page_size])
+
+    if not dry_run and not stats['failed_windows']:
+        SyncCheckpoint.objects.update_or_create(name=name, defaults={'synced_until': started})
+
+    logger.info(
+        f"🔁 Reconciled {stats['examined']} Stripe {name} since {start:%Y-%m-%d %H:%M}"
+        f"{' from events' if from_events else ''}: "
+        f"{stats['corrected']} corrected, {stats['missing']} missing locally"
+    )
+    return stats
+
+def parse_since(value):
+    """YYYY-MM-DD or ISO 8601 -> aware datetime"""
+    parsed = datetime.fromisoformat(value)
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, timezone.utc)
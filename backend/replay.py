@@ -0,0 +1,333 @@
+# replay.py - Bulk replay of exported or stored Stripe events
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+import django
+import json
+import logging
+import zlib
+
+from .entitlements import ENTITLEMENT_FIELDS, invalidate_users
+from .payload_store import rehydrate
+from .rollups import INVOICE_ROLLUP_FIELDS, RollupDelta, invoice_state
+from .subscription_history import history_batch, record_transition
+from .webhooks import (
+    EVENT_HANDLERS,
+    INVOICE_FAILED_UPDATE_FIELDS,
+    INVOICE_PAID_UPDATE_FIELDS,
+    cancellation_fields,
+    from_timestamp,
+    invoice_failed_fields,
+    invoice_paid_fields,
+    invoice_row,
+    invoice_update_fields,
+    payment_succeeded_fields,
+    subscription_fields,
+)
+
+logger = logging.getLogger(__name__)
+
+class ChangeSet:
+    """
+    Net effect of a run of events, folded in delivery order.
+
+    Payment intents name their subscription by UserSubscription.id; with `stripe_ids`
+    (id -> stripe_subscription_id) their changes join the same per-subscription list as
+    the subscription and invoice events, so all of them apply in delivery order.
+    """
+
+    def __init__(self, stripe_ids=None):
+        self.stripe_ids = stripe_ids or {}
+        self.subscriptions = {}       # stripe_subscription_id -> [(event time, fields)]
+        self.subscription_pks = {}    # UserSubscription.id without a Stripe ID -> [(None, fields)]
+        self.invoices = {}            # stripe_invoice_id -> (fields, update_fields)
+        self.event_ids = []
+        self.source = None            # (event_id, event_type) being folded, for SubscriptionHistory
+
+    def update_subscription(self, stripe_subscription_id, fields, event_created=None):
+        self.subscriptions.setdefault(stripe_subscription_id, []).append(
+            (from_timestamp(event_created), fields, self.source)
+        )
+
+    def update_subscription_pk(self, pk, fields):
+        stripe_subscription_id = self.stripe_ids.get(str(pk))
+        if stripe_subscription_id:
+            self.update_subscription(stripe_subscription_id, fields)
+        else:
+            self.subscription_pks.setdefault(str(pk), []).append((None, fields, self.source))
+
+    def upsert_invoice(self, invoice, fields, update_fields):
+        row, columns = self.invoices.get(invoice['id'], ({}, set()))
+        row.update(invoice_row(invoice))
+        row.update(fields)
+        self.invoices[invoice['id']] = (row, columns | set(update_fields))
+
+    def add(self, event):
+        """Fold one event using the same field mapping as the webhook handlers"""
+        event_type = event['type']
+        obj = event['data']['object']
+        created = event.get('created')
+        self.event_ids.append(event['id'])
+        self.source = (event['id'], event_type)
+
+        if event_type in ('customer.subscription.created', 'customer.subscription.updated'):
+            self.update_subscription(obj['id'], subscription_fields(obj), created)
+
+        elif event_type == 'customer.subscription.deleted':
+            self.update_subscription(obj['id'], cancellation_fields(obj), created)
+
+        elif event_type == 'payment_intent.succeeded':
+            subscription_id = obj.get('metadata', {}).get('subscription_id')
+            if subscription_id:
+                self.update_subscription_pk(subscription_id, payment_succeeded_fields(obj))
+
+        elif event_type == 'payment_intent.payment_failed':
+            subscription_id = obj.get('metadata', {}).get('subscription_id')
+            if subscription_id:
+                self.update_subscription_pk(subscription_id, {'status': 'past_due'})
+
+        elif event_type == 'invoice.payment_succeeded':
+            self.upsert_invoice(obj, invoice_paid_fields(obj), INVOICE_PAID_UPDATE_FIELDS)
+            if obj.get('subscription'):
+                self.update_subscription(obj['subscription'], {'last_invoice_paid_at': timezone.now()})
+
+        elif event_type == 'invoice.payment_failed':
+            self.upsert_invoice(obj, invoice_failed_fields(obj), INVOICE_FAILED_UPDATE_FIELDS)
+            if obj.get('subscription'):
+                self.update_subscription(obj['subscription'], {'status': 'past_due'}, created)
+
+def bulk_update_subscriptions(queryset, changes, key, batch_size, rollups):
+    """
+    Apply folded field changes to the matching rows with bulk_update.
+
+    bulk_update writes back every touched column, so the rows are locked (in id order)
+    until the transaction commits; webhook writes to other subscriptions are not blocked.
+    """
+    from .models import UserSubscription
+
+    rows = list(queryset.select_for_update().order_by('id'))
+    columns = {'updated_at', 'version'}
+    now = timezone.now()
+
+    for row in rows:
+        previous = (row.status, row.stripe_price_id)
+        for event_time, fields, source in changes[str(getattr(row, key))]:
+            # Same stale-event rule as webhooks.update_subscription
+            if event_time:
+                if row.last_event_created_at and row.last_event_created_at > event_time:
+                    continue
+                row.last_event_created_at = event_time
+                columns.add('last_event_created_at')
+            before = (row.status, row.stripe_price_id, row.plan_id)
+            for name, value in fields.items():
+                setattr(row, name, value)
+                columns.add(name)
+            # One entry per event, as the webhook handlers would have recorded
+            record_transition(row.id, before, (row.status, row.stripe_price_id, row.plan_id), source)
+        row.updated_at = now
+        row.version += 1
+        rollups.subscription_changed(previous, (row.status, row.stripe_price_id))
+
+    if rows:
+        UserSubscription.objects.bulk_update(rows, sorted(columns), batch_size=batch_size)
+        if ENTITLEMENT_FIELDS.intersection(columns):
+            invalidate_users(row.user_id for row in rows)
+    return len(rows)
+
+def apply_changes(changes, batch_size=500):
+    """Write a ChangeSet in one transaction; returns (subscriptions, invoices) written"""
+    from .models import Invoice, UserSubscription, WebhookEvent
+
+    subscriptions = 0
+    now = timezone.now()
+    rollups = RollupDelta()
+
+    with transaction.atomic(), history_batch():
+        # Record every replayed event as processed. Writing first also takes SQLite's write
+        # lock up front, so parallel workers wait for it instead of failing on an upgrade.
+        WebhookEvent.objects.filter(stripe_event_id__in=changes.event_ids).update(
+            status='success', error_message='', processed_at=now
+        )
+
+        previous = {
+            values.pop('stripe_invoice_id'): values
+            for values in Invoice.objects.select_for_update()
+            .filter(stripe_invoice_id__in=list(changes.invoices))
+            .values('stripe_invoice_id', 'user_id', *INVOICE_ROLLUP_FIELDS)
+        }
+        stored_users = {invoice_id: values.pop('user_id') for invoice_id, values in previous.items()}
+
+        # Invoices that took the same kind of events share one upsert statement
+        groups = {}
+        for invoice_id, (row, columns) in changes.invoices.items():
+            if invoice_id in stored_users:
+                columns = set(invoice_update_fields(list(columns), stored_users[invoice_id]))
+            groups.setdefault(tuple(sorted(columns)), []).append(Invoice(**row))
+            old = previous.get(invoice_id)
+            rollups.invoice_changed(old, invoice_state(old, row, columns))
+        for columns, invoices in groups.items():
+            Invoice.objects.bulk_create(
+                invoices,
+                update_conflicts=True,
+                unique_fields=['stripe_invoice_id'],
+                update_fields=list(columns) + ['updated_at'],
+                batch_size=batch_size,
+            )
+
+        if changes.subscriptions:
+            subscriptions += bulk_update_subscriptions(
+                UserSubscription.objects.filter(stripe_subscription_id__in=list(changes.subscriptions)),
+                changes.subscriptions, 'stripe_subscription_id', batch_size, rollups
+            )
+        if changes.subscription_pks:
+            subscriptions += bulk_update_subscriptions(
+                UserSubscription.objects.filter(id__in=list(changes.subscription_pks)),
+                changes.subscription_pks, 'id', batch_size, rollups
+            )
+
+        rollups.save()
+
+    return subscriptions, len(changes.invoices)
+
+def payment_subscription_pk(event):
+    """UserSubscription.id a payment intent event names in its metadata, if any"""
+    if not event['type'].startswith('payment_intent.'):
+        return None
+    pk = event['data']['object'].get('metadata', {}).get('subscription_id')
+    return str(pk) if pk else None
+
+def subscription_stripe_ids(events):
+    """UserSubscription.id -> stripe_subscription_id for the payment intents among `events`"""
+    from .models import UserSubscription
+
+    pks = {pk for pk in map(payment_subscription_pk, events) if pk and pk.isdigit()}
+    if not pks:
+        return {}
+    return {
+        str(pk): stripe_subscription_id
+        for pk, stripe_subscription_id in UserSubscription.objects.filter(id__in=pks)
+        .exclude(stripe_subscription_id='').values_list('id', 'stripe_subscription_id')
+    }
+
+def partition_key(event, stripe_ids=None):
+    """
+    Key that keeps all events for one subscription in the same partition.
+
+    Subscription and invoice events carry the Stripe subscription ID; payment intents
+    carry the local UserSubscription.id, which `stripe_ids` maps to the same key.
+    """
+    obj = event['data']['object']
+
+    if event['type'].startswith('customer.subscription.'):
+        return obj['id']
+    if event['type'].startswith('invoice.'):
+        return obj.get('subscription') or obj['id']
+    pk = payment_subscription_pk(event)
+    if pk:
+        return (stripe_ids or {}).get(pk) or f"pk:{pk}"
+    return obj.get('id', '')
+
+def partition_events(events, partitions, stripe_ids=None):
+    """Split events into partitions by subscription, each in delivery order"""
+    buckets = [[] for _ in range(partitions)]
+    for event in sorted(events, key=lambda e: e.get('created', 0)):
+        bucket = zlib.crc32(str(partition_key(event, stripe_ids)).encode()) % partitions
+        buckets[bucket].append(event)
+    return [bucket for bucket in buckets if bucket]
+
+def replay_partition(events, chunk_size=1000, batch_size=500, stripe_ids=None):
+    """Apply one partition chunk by chunk; runs inside a pool worker"""
+    totals = [0, 0, 0]
+
+    for start in range(0, len(events), chunk_size):
+        changes = ChangeSet(stripe_ids)
+        for event in events[start:start + chunk_size]:
+            changes.add(event)
+
+        subscriptions, invoices = apply_changes(changes, batch_size)
+        totals[0] += len(changes.event_ids)
+        totals[1] += subscriptions
+        totals[2] += invoices
+
+    return totals
+
+def init_replay_worker():
+    """Make sure Django is ready in spawned pool processes"""
+    django.setup()
+
+def without_processed(events, chunk_size=5000):
+    """Drop events already recorded as successfully processed"""
+    from .models import WebhookEvent
+
+    remaining = []
+    for start in range(0, len(events), chunk_size):
+        chunk = events[start:start + chunk_size]
+        processed = set(
+            WebhookEvent.objects.filter(
+                stripe_event_id__in=[event['id'] for event in chunk],
+                status='success'
+            ).values_list('stripe_event_id', flat=True)
+        )
+        remaining.extend(event for event in chunk if event['id'] not in processed)
+    return remaining
+
+def replay_events(events, workers=4, chunk_size=1000, batch_size=500, skip_processed=True):
+    """Replay events in bulk across a process pool; returns (events, subscriptions, invoices)"""
+    from .models import WebhookEvent
+
+    events = [event for event in events if event['type'] in EVENT_HANDLERS]
+    if skip_processed:
+        events = without_processed(events)
+    if not events:
+        return 0, 0, 0
+
+    # Make sure every replayed event has a WebhookEvent row to mark as processed
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(stripe_event_id=event['id'], event_type=event['type'], status='pending') for event in events],
+        ignore_conflicts=True,
+        batch_size=batch_size,
+    )
+
+    stripe_ids = subscription_stripe_ids(events)
+    partitions = partition_events(events, max(1, workers), stripe_ids)
+    totals = [0, 0, 0]
+
+    if workers <= 1:
+        results = [replay_partition(partition, chunk_size, batch_size, stripe_ids) for partition in partitions]
+    else:
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_replay_worker) as executor:
+            futures = [
+                executor.submit(replay_partition, partition, chunk_size, batch_size, {
+                    pk: stripe_ids[pk] for pk in map(payment_subscription_pk, partition) if pk in stripe_ids
+                })
+                for partition in partitions
+            ]
+            results = [future.result() for future in futures]
+
+    for result in results:
+        totals = [total + value for total, value in zip(totals, result)]
+
+    logger.info(f"✅ Replayed {totals[0]} events ({totals[1]} subscription updates, {totals[2]} invoices)")
+    return tuple(totals)
+
+def read_event_file(path):
+    """Yield Stripe events from a JSONL export (one event per line)"""
+    with open(path) as export:
+        for line in export:
+            if line.strip():
+                yield json.loads(line)
+
+def stored_events(statuses):
+    """Stored WebhookEvent payloads with the given statuses, oldest first"""
+    from .models import WebhookEvent
+
+    rows = (
+        WebhookEvent.objects.filter(status__in=statuses)
+        .filter(Q(payload__isnull=False) | ~Q(event_data={}))
+        .order_by('created_at')
+        .values_list('event_data', 'payload__data')
+    )
+    return [rehydrate(event_data, payload_data) for event_data, payload_data in rows.iterator(chunk_size=2000)]
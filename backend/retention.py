@@ -0,0 +1,112 @@
+# retention.py - Archive expired WebhookEvent rows to compressed daily JSONL files
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+import gzip
+import json
+import logging
+import os
+
+from .payload_store import delete_orphaned_payloads, rehydrate
+
+logger = logging.getLogger(__name__)
+
+# Statuses not listed here are kept forever; queued events are never archived
+DEFAULT_RETENTION_DAYS = {'success': 30, 'error': 180}
+
+ARCHIVED_FIELDS = [
+    'id', 'stripe_event_id', 'event_type', 'subscription_id', 'status',
+    'error_message', 'event_data', 'processed_at', 'created_at',
+]
+
+def retention_policy():
+    """Days to keep WebhookEvent rows, per status (STRIPE_WEBHOOK_RETENTION_DAYS)"""
+    policy = dict(getattr(settings, 'STRIPE_WEBHOOK_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    for status in ('pending', 'processing'):
+        policy.pop(status, None)
+    return policy
+
+class DailyArchive:
+    """Append-only gzip JSONL files, one per day of event creation"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+
+    def path_for(self, day):
+        return os.path.join(self.directory, f"{day:%Y}", f"{day:%m}", f"webhook_events-{day:%Y-%m-%d}.jsonl.gz")
+
+    def write(self, row):
+        day = row['created_at'].date()
+        archive = self._files.get(day)
+        if archive is None:
+            path = self.path_for(day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Appending adds a new gzip member, which gzip readers handle transparently
+            archive = self._files[day] = gzip.open(path, 'at', encoding='utf-8')
+        archive.write(json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n')
+
+    def flush(self):
+        for archive in self._files.values():
+            archive.flush()
+
+    def close(self):
+        for archive in self._files.values():
+            archive.close()
+        self._files.clear()
+
+def archive_expired_events(archive_dir=None, chunk_size=5000, dry_run=False, now=None):
+    """
+    Stream expired WebhookEvent rows into daily archives and delete them in batches.
+
+    Rows are only deleted after their chunk has been written and flushed. Returns the
+    number of rows archived per status.
+    """
+    from .models import WebhookEvent
+
+    archive_dir = archive_dir or getattr(settings, 'STRIPE_WEBHOOK_ARCHIVE_DIR', 'archives/webhooks')
+    now = now or timezone.now()
+    archived = {}
+
+    archive = None if dry_run else DailyArchive(archive_dir)
+    try:
+        for status, days in retention_policy().items():
+            expired = WebhookEvent.objects.filter(status=status, created_at__lt=now - timedelta(days=days))
+
+            if dry_run:
+                archived[status] = expired.count()
+                continue
+
+            archived[status] = 0
+            while True:
+                # Archived rows are deleted, so each pass simply takes the oldest remaining chunk
+                rows = list(expired.order_by('created_at', 'id').values(*ARCHIVED_FIELDS, 'payload__data')[:chunk_size])
+                if not rows:
+                    break
+
+                for row in rows:
+                    # Archives hold the full event so they stay readable without webhook_payloads
+                    row['event_data'] = rehydrate(row['event_data'], row.pop('payload__data'))
+                    archive.write(row)
+                archive.flush()
+
+                WebhookEvent.objects.filter(id__in=[row['id'] for row in rows]).delete()
+                archived[status] += len(rows)
+
+            if archived[status]:
+                logger.info(f"🗄️ Archived {archived[status]} {status} webhook events older than {days} days")
+
+        if not dry_run and any(archived.values()):
+            delete_orphaned_payloads()
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return archived
+
+def read_archive(path):
+    """Yield archived WebhookEvent rows from one daily archive file"""
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            yield json.loads(line)
@@ -0,0 +1,298 @@
+# rollups.py - Incrementally maintained billing aggregates for the dashboard
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Subscriptions that count towards monthly recurring revenue
+MRR_STATUSES = ('active', 'past_due')
+
+# Invoice columns the daily rollups are derived from
+INVOICE_ROLLUP_FIELDS = ('stripe_price_id', 'currency', 'status', 'amount', 'paid_at', 'payment_failed_at')
+
+# Values of a freshly inserted Invoice for columns an upsert may not set
+INVOICE_DEFAULTS = {
+    'stripe_price_id': '',
+    'currency': 'usd',
+    'status': 'draft',
+    'amount': Decimal('0.00'),
+    'paid_at': None,
+    'payment_failed_at': None,
+}
+
+def local_day(value):
+    """Calendar day of a datetime in the current time zone (matches TruncDate)"""
+    return timezone.localtime(value).date()
+
+def invoice_state(previous, row, update_fields):
+    """Rollup columns of an Invoice after upserting `row` over `previous` (None if new)"""
+    if previous is None:
+        state = dict(INVOICE_DEFAULTS)
+        state.update({name: row[name] for name in INVOICE_ROLLUP_FIELDS if name in row})
+    else:
+        state = dict(previous)
+        state.update({name: row[name] for name in update_fields if name in INVOICE_ROLLUP_FIELDS})
+    return state
+
+class RollupDelta:
+    """
+    Pending rollup changes.
+
+    Each Invoice and UserSubscription row contributes a fixed amount to the rollups, so
+    a change is recorded as "remove the old row's contribution, add the new one's". The
+    result is exactly what rebuild_rollups() would compute from the tables.
+    """
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: defaultdict(int))  # (day, price, currency) -> {column: delta}
+        self.plans = defaultdict(int)                       # (price, status) -> delta
+
+    def add_invoice(self, invoice, sign=1):
+        if invoice is None:
+            return
+        price_id, currency = invoice['stripe_price_id'] or '', invoice['currency']
+        if invoice['status'] == 'paid' and invoice['paid_at']:
+            counters = self.daily[(local_day(invoice['paid_at']), price_id, currency)]
+            counters['invoices_paid'] += sign
+            counters['revenue'] += sign * invoice['amount']
+        if invoice['payment_failed_at']:
+            self.daily[(local_day(invoice['payment_failed_at']), price_id, currency)]['invoices_failed'] += sign
+
+    def invoice_changed(self, previous, current):
+        self.add_invoice(previous, -1)
+        self.add_invoice(current)
+
+    def add_subscription(self, stripe_price_id, status, sign=1):
+        self.plans[(stripe_price_id or '', status)] += sign
+
+    def subscription_changed(self, previous, current):
+        """`previous` and `current` are (status, stripe_price_id) pairs; status None = no row"""
+        if previous == current:
+            return
+        if previous[0] is not None:
+            self.add_subscription(previous[1], previous[0], -1)
+        if current[0] is not None:
+            self.add_subscription(current[1], current[0])
+
+    def save(self):
+        """Apply the pending changes inside the caller's transaction"""
+        from .models import DailyBillingRollup, PlanStatusRollup
+
+        increment_rows(DailyBillingRollup, ('day', 'stripe_price_id', 'currency'), {
+            key: {name: value for name, value in counters.items() if value}
+            for key, counters in self.daily.items()
+        })
+        # A status change moves one subscription between two rows: a single UPDATE
+        increment_rows(PlanStatusRollup, ('stripe_price_id', 'status'), {
+            key: {'subscriptions': delta} for key, delta in self.plans.items()
+        })
+
+        self.daily.clear()
+        self.plans.clear()
+
+def increment(model, key, counters, defaults=None):
+    """Add `counters` to the row for `key`, creating it (with `defaults`) on first use"""
+    increments = {name: F(name) + value for name, value in counters.items()}
+    if model.objects.filter(**key).update(**increments):
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **counters, **(defaults or {}))
+    except IntegrityError:
+        # Another transaction created the row first
+        model.objects.filter(**key).update(**increments)
+
+def increment_rows(model, key_names, changes):
+    """
+    increment() for several rows in one UPDATE.
+
+    `changes` maps key tuples (values of `key_names`) to counters. Rows that do not
+    exist yet are found with one more query and created.
+    """
+    changes = {key: counters for key, counters in changes.items() if any(counters.values())}
+    if len(changes) < 2:
+        for key, counters in changes.items():
+            increment(model, dict(zip(key_names, key)), counters)
+        return
+
+    conditions = {key: Q(**dict(zip(key_names, key))) for key in changes}
+    matching = Q()
+    for condition in conditions.values():
+        matching |= condition
+
+    columns = {name for counters in changes.values() for name in counters}
+    increments = {
+        name: F(name) + Case(
+            *[When(conditions[key], then=Value(counters[name])) for key, counters in changes.items() if name in counters],
+            default=Value(0),
+            output_field=model._meta.get_field(name),
+        )
+        for name in columns
+    }
+    if model.objects.filter(matching).update(**increments) == len(changes):
+        return
+
+    existing = set(model.objects.filter(matching).values_list(*key_names))
+    for key, counters in changes.items():
+        if key not in existing:
+            increment(model, dict(zip(key_names, key)), counters)
+
+def record_invoice_change(previous, current):
+    delta = RollupDelta()
+    delta.invoice_changed(previous, current)
+    delta.save()
+
+def record_subscription_change(previous, current):
+    delta = RollupDelta()
+    delta.subscription_changed(previous, current)
+    delta.save()
+
+def subscription_saving(sender, instance, update_fields=None, **kwargs):
+    """pre_save receiver for UserSubscription; remembers the stored status and price of an update"""
+    if instance._state.adding:
+        return
+    if update_fields is not None and not {'status', 'stripe_price_id'}.intersection(update_fields):
+        return
+    instance._rollup_previous = sender.objects.filter(pk=instance.pk).values_list('status', 'stripe_price_id').first()
+
+def subscription_saved(sender, instance, created, **kwargs):
+    """
+    post_save receiver for UserSubscription.
+
+    The webhook handlers write with UPDATE and record their own changes; this covers
+    rows created or changed through save(), e.g. in the admin.
+    """
+    previous = instance.__dict__.pop('_rollup_previous', None)
+    if created:
+        previous = (None, None)
+    elif previous is None:
+        return
+    record_subscription_change(previous, (instance.status, instance.stripe_price_id))
+
+def subscription_deleted(sender, instance, **kwargs):
+    """post_delete receiver for UserSubscription"""
+    record_subscription_change((instance.status, instance.stripe_price_id), (None, None))
+
+def rebuild_rollups():
+    """Recompute every rollup row from Invoice and UserSubscription; returns (daily, plan) rows"""
+    from .models import DailyBillingRollup, Invoice, PlanStatusRollup, UserSubscription
+
+    with transaction.atomic():
+        DailyBillingRollup.objects.all().delete()
+        PlanStatusRollup.objects.all().delete()
+
+        daily = defaultdict(dict)
+        paid = (
+            Invoice.objects.filter(status='paid', paid_at__isnull=False)
+            .annotate(day=TruncDate('paid_at'))
+            .values_list('day', 'stripe_price_id', 'currency')
+            .annotate(count=Count('id'), revenue=Sum('amount'))
+            .order_by()
+        )
+        for day, price_id, currency, count, revenue in paid:
+            daily[(day, price_id, currency)].update(invoices_paid=count, revenue=revenue)
+
+        failed = (
+            Invoice.objects.filter(payment_failed_at__isnull=False)
+            .annotate(day=TruncDate('payment_failed_at'))
+            .values_list('day', 'stripe_price_id', 'currency')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        for day, price_id, currency, count in failed:
+            daily[(day, price_id, currency)]['invoices_failed'] = count
+
+        DailyBillingRollup.objects.bulk_create([
+            DailyBillingRollup(day=day, stripe_price_id=price_id, currency=currency, **counters)
+            for (day, price_id, currency), counters in daily.items()
+        ], batch_size=1000)
+
+        counts = (
+            UserSubscription.objects.values_list('stripe_price_id', 'status')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        plans = PlanStatusRollup.objects.bulk_create([
+            PlanStatusRollup(stripe_price_id=price_id, status=status, subscriptions=count)
+            for price_id, status, count in counts
+        ], batch_size=1000)
+
+    logger.info(f"📊 Rebuilt billing rollups: {len(daily)} daily rows, {len(plans)} plan rows")
+    return len(daily), len(plans)
+
+def dashboard_summary(start, end, trial_days=7):
+    """
+    Billing dashboard numbers for the days `start`..`end` (inclusive).
+
+    Always three queries: the daily rollups in range, the plan rollups and an indexed
+    count of trials ending soon. MRR is priced from the in-memory plan catalog.
+    """
+    from .models import DailyBillingRollup, PlanStatusRollup, UserSubscription
+    from .plan_catalog import get_catalog
+
+    catalog = get_catalog()
+
+    revenue = defaultdict(Decimal)
+    invoices_paid = invoices_failed = 0
+    days = defaultdict(lambda: {'revenue': defaultdict(Decimal), 'invoices_paid': 0, 'invoices_failed': 0})
+    rows = DailyBillingRollup.objects.filter(day__range=(start, end)).values_list(
+        'day', 'currency', 'invoices_paid', 'revenue', 'invoices_failed'
+    )
+    for day, currency, paid, amount, failed in rows:
+        revenue[currency] += amount
+        invoices_paid += paid
+        invoices_failed += failed
+        totals = days[day]
+        totals['revenue'][currency] += amount
+        totals['invoices_paid'] += paid
+        totals['invoices_failed'] += failed
+
+    statuses = defaultdict(int)
+    mrr = defaultdict(Decimal)
+    plans = {}
+    for price_id, status, count in PlanStatusRollup.objects.exclude(subscriptions=0).values_list(
+        'stripe_price_id', 'status', 'subscriptions'
+    ):
+        statuses[status] += count
+        plan = catalog.for_price(price_id)
+        entry = plans.setdefault(price_id, {
+            'stripe_price_id': price_id,
+            'plan_id': plan.id if plan else None,
+            'name': plan.name if plan else '',
+            'subscriptions': {},
+            'mrr': Decimal('0.00'),
+        })
+        entry['subscriptions'][status] = count
+        if plan and status in MRR_STATUSES:
+            entry['mrr'] += plan.monthly_price * count
+            mrr[plan.currency] += plan.monthly_price * count
+
+    now = timezone.now()
+    trials_ending = UserSubscription.objects.filter(
+        status='trialing', current_period_end__range=(now, now + timedelta(days=trial_days))
+    ).count()
+
+    return {
+        'start': start,
+        'end': end,
+        'mrr': dict(mrr),
+        'revenue': dict(revenue),
+        'invoices_paid': invoices_paid,
+        'invoices_failed': invoices_failed,
+        'subscriptions': dict(statuses),
+        'past_due': statuses.get('past_due', 0),
+        'trials_ending': trials_ending,
+        'daily': [
+            {'day': day, 'revenue': dict(totals['revenue']),
+             'invoices_paid': totals['invoices_paid'], 'invoices_failed': totals['invoices_failed']}
+            for day, totals in sorted(days.items())
+        ],
+        'plans': list(plans.values()),
+    }
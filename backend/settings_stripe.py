@@ -13,7 +13,114 @@ STRIPE_PUBLISHABLE_KEY = 'pk_test_...'  # Your Stripe publishable key
 STRIPE_SECRET_KEY = 'sk_test_...'       # Your Stripe secret key
 STRIPE_WEBHOOK_SECRET = 'whsec_...'     # Your webhook endpoint secret
 
-# Add to LOGGING configuration for webhook monitoring:
+# Asynchronous webhook processing:
+# When enabled the webhook view only verifies and queues events as pending
+# WebhookEvent rows; run `python manage.py process_webhook_events` to process them.
+STRIPE_WEBHOOK_ASYNC_PROCESSING = False
+STRIPE_WEBHOOK_WORKERS = 4                # Handler threads per worker process
+STRIPE_WEBHOOK_BATCH_SIZE = 50            # Events claimed per batch
+STRIPE_WEBHOOK_POLL_INTERVAL = 1.0        # Seconds to wait when the queue is empty
+STRIPE_WEBHOOK_PROCESSING_TIMEOUT = 300   # Seconds before a stuck event is requeued or reclaimed
+
+# Async view (webhooks/stripe/async/, ASGI only): handlers run on this many threads per
+# process, which also caps their database connections. Not compatible with ATOMIC_REQUESTS.
+STRIPE_WEBHOOK_ASYNC_HANDLER_THREADS = 8
+
+# Attempts at a subscription status/price change when concurrent deliveries for the same
+# subscription keep bumping its version; the event is marked as an error after that
+STRIPE_WEBHOOK_UPDATE_RETRIES = 5
+
+# Recently claimed event IDs kept in memory to short-circuit Stripe redeliveries
+STRIPE_WEBHOOK_IDEMPOTENCY_CACHE_SIZE = 10000
+
+# With async processing, leave queued customer.subscription.updated events pending for
+# this many seconds, then apply only the newest state of each subscription's burst and
+# mark the rest in the same transaction (0 disables). Synchronous deliveries are never held.
+STRIPE_WEBHOOK_COALESCE_WINDOW = 0
+
+# Verify signatures and decode payloads without building stripe.Event objects
+# (uses orjson when installed: pip install orjson)
+STRIPE_WEBHOOK_FAST_DECODE = False
+
+# Keep each event's raw payload: the envelope in WebhookEvent.event_data and data.object
+# zlib-compressed in WebhookPayload, stored once per distinct object (payload_store.load_event)
+STRIPE_WEBHOOK_STORE_PAYLOADS = True
+
+# Warn when an event needs more queries than webhooks.QUERY_BUDGETS allows; when unset
+# the check follows DEBUG
+# STRIPE_WEBHOOK_CHECK_QUERY_BUDGETS = True
+
+# WebhookEvent retention (python manage.py archive_webhook_events): days to keep rows per
+# status before they are moved to gzip JSONL archives; pending/processing rows are never archived
+STRIPE_WEBHOOK_RETENTION_DAYS = {'success': 30, 'error': 180}
+STRIPE_WEBHOOK_ARCHIVE_DIR = 'archives/webhooks'
+
+# Entitlement cache (entitlements.get_entitlement): per-process LRU in front of an
+# optional shared Django cache alias (e.g. a Redis-backed 'default'); None = local only
+ENTITLEMENT_CACHE_ALIAS = None
+ENTITLEMENT_CACHE_TTL = 300          # Seconds entries live in the shared cache
+ENTITLEMENT_LOCAL_CACHE_TTL = 5      # Seconds entries live in each process
+ENTITLEMENT_LOCAL_CACHE_SIZE = 10000
+
+# Plan catalog (plan_catalog.get_catalog): all plans held in memory (the plans API lists the
+# active ones) and rebuilt after Plan saves/deletes. Set a shared cache alias so other
+# processes notice changes within the check interval; without one they only see them
+# once their copy reaches PLAN_CATALOG_MAX_AGE.
+PLAN_CATALOG_CACHE_ALIAS = None
+PLAN_CATALOG_CHECK_INTERVAL = 5      # Seconds between checks of the shared catalog version
+PLAN_CATALOG_MAX_AGE = 60            # Seconds before a catalog is rebuilt regardless
+
+# Billing analytics (analytics.billing_analytics, needs NumPy): results are cached per day here
+BILLING_ANALYTICS_CACHE_ALIAS = 'default'
+
+# Usage metering (metering.record_usage / POST usage/events/): events are summed in memory
+# and written as batched increments every USAGE_FLUSH_INTERVAL seconds or once
+# USAGE_FLUSH_MAX_EVENTS are buffered; a crash loses at most that much usage per process
+USAGE_FLUSH_INTERVAL = 5
+USAGE_FLUSH_MAX_EVENTS = 5000
+USAGE_METRICS = ('minutes',)               # Accepted metrics (keys in Plan.limits)
+USAGE_INGEST_API_KEY = None                # Bearer token for the ingest API (None disables it)
+USAGE_INGEST_MAX_BATCH = 1000
+
+# Call admission (quotas.check_call_admission / POST calls/admission/): counters for the
+# minutes, concurrent_calls and calls_per_minute keys of Plan.limits. Use a shared alias
+# with atomic incr (Redis/Memcached) when several processes admit calls; None = in-process
+QUOTA_CACHE_ALIAS = None
+QUOTA_CALL_SLOT_TTL = 4 * 60 * 60    # Seconds before unreleased concurrent-call slots expire
+
+# Stripe API client (stripe_client.py): one pooled HTTP session per process, retries with
+# jittered exponential backoff, and Price/Product lookups cached in memory
+STRIPE_API_BASE = None                    # e.g. 'http://localhost:12111' for stripe-mock / a local stub
+STRIPE_HTTP_TIMEOUT = (5, 30)             # Connect and read timeouts in seconds
+STRIPE_HTTP_POOL_SIZE = 10                # Keep-alive connections kept open to Stripe
+STRIPE_RETRY_ATTEMPTS = 3
+STRIPE_RETRY_BACKOFF = 0.5                # Seconds before the first retry, doubling each time
+STRIPE_RETRY_MAX_DELAY = 8
+STRIPE_OBJECT_CACHE_TTL = 3600            # Seconds Prices and Products are cached
+STRIPE_OBJECT_CACHE_SIZE = 1000
+
+# Usage reporting (manage.py report_usage_to_stripe, e.g. every few minutes from cron):
+# period totals are sent to UserSubscription.stripe_subscription_item_id as usage records
+STRIPE_USAGE_REPORT_CONCURRENCY = 4       # Requests in flight
+STRIPE_USAGE_REPORT_ATTEMPTS = 5          # Tries per record on rate limits and network errors
+STRIPE_USAGE_REPORT_GRACE = 24 * 60 * 60  # Seconds after a period ends that it is still reported
+
+# Reconciliation (manage.py reconcile_stripe, e.g. hourly, plus a nightly --full run):
+# incremental runs page through the Stripe events since the checkpoint (Stripe keeps 30
+# days of them), so they see changes to objects of any age; --full re-lists everything
+STRIPE_RECONCILE_CONCURRENCY = 4          # Stripe list requests in flight
+STRIPE_RECONCILE_OVERLAP = 3600           # Seconds re-examined before the checkpoint
+
+# Share of each event type's deliveries whose INFO lines are logged, chosen per event id
+# ('*' = every other type). Warnings and errors are always logged.
+STRIPE_WEBHOOK_LOG_SAMPLING = {
+    # 'invoice.payment_succeeded': 0.05,
+    # '*': 1.0,
+}
+
+# Add to LOGGING configuration for webhook monitoring. The file handler formats and
+# writes on a background thread, so disk stalls do not reach webhook latency; lines are
+# key=value with the event_id/event_type of the delivery that logged them.
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -26,18 +133,29 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'structured': {
+            '()': 'your_app.webhook_logging.KeyValueFormatter',  # Replace with your app name
+        },
+    },
+    'filters': {
+        'webhook_event': {
+            '()': 'your_app.webhook_logging.EventContextFilter',
+        },
     },
     'handlers': {
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'your_app.webhook_logging.BackgroundFileHandler',
             'filename': 'logs/webhooks.log',
-            'formatter': 'verbose',
+            'queue_size': 10000,
+            'formatter': 'structured',
+            'filters': ['webhook_event'],
         },
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
+            'filters': ['webhook_event'],
         },
     },
     'loggers': {
@@ -80,6 +198,7 @@ Create a .env file in your project root:
 STRIPE_PUBLISHABLE_KEY=pk_test_your_key_here
 STRIPE_SECRET_KEY=sk_test_your_key_here
 STRIPE_WEBHOOK_SECRET=whsec_your_webhook_secret_here
+USAGE_INGEST_API_KEY=a_long_random_token
 """
 
 # Example of loading from environment variables:
@@ -90,4 +209,5 @@ load_dotenv()
 
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
-STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+USAGE_INGEST_API_KEY = os.getenv('USAGE_INGEST_API_KEY')
\ No newline at end of file
@@ -0,0 +1,105 @@
+# stripe_client.py - Shared Stripe API client: pooled connections, retries, cached lookups
+from django.conf import settings
+import logging
+import random
+import requests
+import stripe
+import threading
+import time
+
+from .local_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Errors worth another attempt; anything else (bad id, invalid params) is permanent
+RETRYABLE_ERRORS = (stripe.error.RateLimitError, stripe.error.APIConnectionError, stripe.error.APIError)
+
+_configured = False
+_configure_lock = threading.Lock()
+
+class PooledRequestsClient(stripe.http_client.RequestsClient):
+    """RequestsClient that never retries by itself, whatever stripe.max_network_retries says"""
+
+    def _max_network_retries(self):
+        # Retries are done by call_stripe(), with idempotency keys
+        return 0
+
+def pooled_session():
+    """One requests session shared by all threads, keeping connections to Stripe open"""
+    pool_size = getattr(settings, 'STRIPE_HTTP_POOL_SIZE', 10)
+    session = requests.Session()
+    # Retries are done by call_stripe(), with idempotency keys, not by urllib3
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def configure_stripe():
+    """Point the stripe library at the pooled client once per process (safe to call repeatedly)"""
+    global _configured
+    if _configured:
+        return
+
+    with _configure_lock:
+        if _configured:
+            return
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        if getattr(settings, 'STRIPE_API_BASE', None):
+            # e.g. stripe-mock or another local stand-in for offline tests
+            stripe.api_base = settings.STRIPE_API_BASE
+        stripe.default_http_client = PooledRequestsClient(
+            timeout=tuple(getattr(settings, 'STRIPE_HTTP_TIMEOUT', (5, 30))),
+            session=pooled_session(),
+        )
+        _configured = True
+
+def should_retry(error):
+    """Retry rate limits, network failures and 5xx, unless Stripe says not to"""
+    if not isinstance(error, RETRYABLE_ERRORS):
+        return False
+    headers = getattr(error, 'headers', None) or {}
+    return headers.get('stripe-should-retry') != 'false'
+
+def call_stripe(request, *args, attempts=None, backoff=None, **kwargs):
+    """
+    Call a stripe library function, retrying transient errors with jittered backoff.
+
+    Pass an `idempotency_key` for requests that create objects, so a retry after a
+    timeout cannot create a duplicate. The last error is raised when attempts run out.
+    """
+    configure_stripe()
+    attempts = attempts or getattr(settings, 'STRIPE_RETRY_ATTEMPTS', 3)
+    backoff = getattr(settings, 'STRIPE_RETRY_BACKOFF', 0.5) if backoff is None else backoff
+    max_delay = getattr(settings, 'STRIPE_RETRY_MAX_DELAY', 8)
+
+    for attempt in range(attempts):
+        try:
+            return request(*args, **kwargs)
+        except stripe.error.StripeError as e:
+            if attempt + 1 == attempts or not should_retry(e):
+                raise
+            delay = min(backoff * 2 ** attempt, max_delay) * random.uniform(0.5, 1.5)
+            logger.warning(f"⚠️ Stripe request failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+# Prices and products are effectively immutable (amounts never change), so a long TTL is safe
+object_cache = TTLCache(
+    getattr(settings, 'STRIPE_OBJECT_CACHE_SIZE', 1000),
+    getattr(settings, 'STRIPE_OBJECT_CACHE_TTL', 3600),
+)
+
+def cached_retrieve(resource, object_id):
+    key = (resource.OBJECT_NAME, object_id)
+    obj = object_cache.get(key)
+    if obj is None:
+        obj = call_stripe(resource.retrieve, object_id)
+        object_cache.set(key, obj)
+    return obj
+
+def get_price(price_id):
+    """Stripe Price, served from the in-process cache after the first lookup"""
+    return cached_retrieve(stripe.Price, price_id)
+
+def get_product(product_id):
+    """Stripe Product, served from the in-process cache after the first lookup"""
+    return cached_retrieve(stripe.Product, product_id)
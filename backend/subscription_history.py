@@ -0,0 +1,129 @@
+# subscription_history.py - Audit trail of subscription plan and status changes
+from contextlib import contextmanager
+from django.utils import timezone
+import contextvars
+import logging
+
+from .plan_catalog import get_catalog
+
+logger = logging.getLogger(__name__)
+
+# (event_id, event_type) whose handler is running, recorded as the source of its transitions
+source_event = contextvars.ContextVar('subscription_history_source', default=None)
+
+# Entries recorded inside the innermost history_batch(), written when it exits
+batch_entries = contextvars.ContextVar('subscription_history_batch', default=None)
+
+ACTIVE_STATUSES = ('active', 'trialing')
+DELINQUENT_STATUSES = ('past_due', 'unpaid')
+
+# SubscriptionHistory columns returned by the timeline queries
+TIMELINE_FIELDS = ('action', 'old_plan', 'new_plan', 'old_status', 'new_status', 'reason', 'metadata', 'created_at')
+
+@contextmanager
+def history_batch():
+    """
+    Write the entries recorded inside the block with one bulk_create as it exits.
+
+    Enter it inside the transaction that makes the changes: the INSERT runs before the
+    commit, so the entries are stored or rolled back together with what they describe.
+    Nothing is written when the block raises.
+    """
+    from .models import SubscriptionHistory
+
+    entries = []
+    token = batch_entries.set(entries)
+    try:
+        yield
+    finally:
+        batch_entries.reset(token)
+    if entries:
+        SubscriptionHistory.objects.bulk_create(entries)
+
+@contextmanager
+def history_source(event_id, event_type):
+    """Record the transitions inside the block as caused by this event, in one history_batch()"""
+    token = source_event.set((event_id, event_type))
+    try:
+        with history_batch():
+            yield
+    finally:
+        source_event.reset(token)
+
+def plan_change(old_price_id, new_price_id):
+    """'upgraded' or 'downgraded' by monthly price; 'plan_changed' when a price is not in the catalog"""
+    catalog = get_catalog()
+    old, new = catalog.for_price(old_price_id), catalog.for_price(new_price_id)
+    if old is None or new is None or old.monthly_price == new.monthly_price:
+        return 'plan_changed'
+    return 'upgraded' if new.monthly_price > old.monthly_price else 'downgraded'
+
+def transition_action(previous, current):
+    """SubscriptionHistory.action for a (status, stripe_price_id, plan_id) change"""
+    old_status, old_price_id, _ = previous
+    new_status, new_price_id, _ = current
+
+    if new_status != old_status:
+        if new_status == 'canceled':
+            return 'canceled'
+        if new_status in DELINQUENT_STATUSES:
+            return 'payment_failed'
+        if new_status in ACTIVE_STATUSES and old_status in ('incomplete', None):
+            return 'created'
+        if new_status in ACTIVE_STATUSES and old_status not in ACTIVE_STATUSES:
+            return 'reactivated'
+    if new_price_id != old_price_id:
+        return plan_change(old_price_id, new_price_id)
+    return 'status_changed'
+
+
+def record_transition(subscription_pk, previous, current, source=None):
+    """
+    Record a history entry for a (status, stripe_price_id, plan_id) change.
+
+    Inside history_batch() the entry joins the batch's single INSERT; otherwise it is
+    written at once, in the caller's transaction. `source` defaults to the event whose
+    handler is running.
+    """
+    from .models import SubscriptionHistory
+
+    if previous == current:
+        return
+
+    event_id, event_type = source or source_event.get() or (None, None)
+    entry = SubscriptionHistory(
+        subscription_id=subscription_pk,
+        action=transition_action(previous, current),
+        old_status=previous[0] or '',
+        new_status=current[0] or '',
+        old_plan=previous[2] or previous[1] or '',
+        new_plan=current[2] or current[1] or '',
+        reason=event_type or '',
+        metadata={'event_id': event_id, 'old_price_id': previous[1], 'new_price_id': current[1]},
+        created_at=timezone.now(),
+    )
+    entries = batch_entries.get()
+    if entries is None:
+        entry.save()
+    else:
+        entries.append(entry)
+
+def subscription_timeline(subscription_pk, limit=None):
+    """A subscription's transitions, oldest first, in one query"""
+    from .models import SubscriptionHistory
+
+    rows = SubscriptionHistory.objects.filter(subscription_id=subscription_pk).order_by('created_at', 'id')
+    rows = rows.values(*TIMELINE_FIELDS)
+    return list(rows[:limit] if limit else rows)
+
+def user_timeline(user_id, stripe_subscription_id=None, limit=100):
+    """Transitions of a user's subscriptions, newest first; the join replaces a query per subscription"""
+    from .models import SubscriptionHistory
+
+    rows = SubscriptionHistory.objects.filter(subscription__user_id=user_id)
+    if stripe_subscription_id:
+        rows = rows.filter(subscription__stripe_subscription_id=stripe_subscription_id)
+    return list(
+        rows.order_by('-created_at', '-id')
+        .values('subscription__stripe_subscription_id', *TIMELINE_FIELDS)[:limit]
+    )
@@ -0,0 +1,133 @@
+# synthetic_events.py - Realistic, signed Stripe events for benchmarks and load tests
+import hashlib
+import hmac
+import itertools
+import json
+import time
+
+_sequence = itertools.count(1)
+
+def sign_payload(payload, secret, timestamp=None):
+    """Build a Stripe-Signature header for a raw payload"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+def make_event(event_type, obj, created=None):
+    """Wrap a Stripe object in an event envelope"""
+    return {
+        'id': f"evt_synthetic_{next(_sequence)}_{time.time_ns()}",
+        'object': 'event',
+        'api_version': '2023-10-16',
+        'created': int(created or time.time()),
+        'livemode': False,
+        'pending_webhooks': 1,
+        'request': {'id': None, 'idempotency_key': None},
+        'type': event_type,
+        'data': {'object': obj},
+    }
+
+def invoice_object(invoice_id, subscription_id, customer_id='cus_synthetic', line_count=1, amount=4900):
+    """A Stripe invoice with `line_count` line items, shaped like the API response"""
+    now = int(time.time())
+    lines = [
+        {
+            'id': f"il_{invoice_id}_{index}",
+            'object': 'line_item',
+            'amount': amount // line_count,
+            'currency': 'usd',
+            'description': f"1 × Synthetic plan (at ${amount / 100:.2f} / month)",
+            'period': {'start': now - 30 * 86400, 'end': now},
+            'price': {'id': 'price_synthetic', 'object': 'price', 'unit_amount': amount, 'currency': 'usd',
+                      'recurring': {'interval': 'month', 'interval_count': 1}, 'product': 'prod_synthetic'},
+            'quantity': 1,
+            'subscription': subscription_id,
+            'type': 'subscription',
+        }
+        for index in range(line_count)
+    ]
+    return {
+        'id': invoice_id,
+        'object': 'invoice',
+        'amount_due': amount,
+        'amount_paid': amount,
+        'currency': 'usd',
+        'customer': customer_id,
+        'customer_email': 'customer@example.com',
+        'subscription': subscription_id,
+        'status': 'paid',
+        'status_transitions': {'finalized_at': now - 60, 'paid_at': now},
+        'lines': {'object': 'list', 'data': lines, 'has_more': False, 'total_count': line_count},
+        'metadata': {},
+    }
+
+def subscription_object(subscription_id, status='active', price_id='price_synthetic', customer_id='cus_synthetic'):
+    """A Stripe subscription with one item, shaped like the API response"""
+    now = int(time.time())
+    return {
+        'id': subscription_id,
+        'object': 'subscription',
+        'customer': customer_id,
+        'status': status,
+        'created': now - 90 * 86400,
+        'current_period_start': now - 5 * 86400,
+        'current_period_end': now + 25 * 86400,
+        'cancel_at_period_end': False,
+        'canceled_at': now if status == 'canceled' else None,
+        'trial_end': now + 3 * 86400 if status == 'trialing' else None,
+        'items': {
+            'object': 'list',
+            'data': [{
+                'id': f"si_{subscription_id}",
+                'object': 'subscription_item',
+                'price': {'id': price_id, 'object': 'price', 'unit_amount': 4900, 'currency': 'usd',
+                          'recurring': {'interval': 'month', 'interval_count': 1}, 'product': 'prod_synthetic'},
+                'quantity': 1,
+            }],
+            'has_more': False,
+        },
+        'metadata': {},
+    }
+
+def payment_intent_object(payment_intent_id, subscription_pk, status='succeeded', action_type='subscription_purchase'):
+    """A Stripe payment intent tagged with the UserSubscription it pays for"""
+    return {
+        'id': payment_intent_id,
+        'object': 'payment_intent',
+        'amount': 4900,
+        'currency': 'usd',
+        'status': status,
+        'last_payment_error': {'message': 'Your card was declined.'} if status != 'succeeded' else None,
+        'metadata': {'subscription_id': str(subscription_pk), 'action_type': action_type},
+    }
+
+def synthetic_event(event_type, subscription_id, subscription_pk, price_id='price_synthetic'):
+    """A realistic event of `event_type` for one existing subscription (every routed type)"""
+    unique = f"{next(_sequence)}_{time.time_ns()}"
+
+    if event_type == 'payment_intent.succeeded':
+        obj = payment_intent_object(f"pi_{unique}", subscription_pk)
+    elif event_type == 'payment_intent.payment_failed':
+        obj = payment_intent_object(f"pi_{unique}", subscription_pk, status='requires_payment_method')
+    elif event_type == 'customer.subscription.deleted':
+        obj = subscription_object(subscription_id, 'canceled', price_id)
+    elif event_type == 'customer.subscription.trial_will_end':
+        obj = subscription_object(subscription_id, 'trialing', price_id)
+    elif event_type.startswith('customer.subscription.'):
+        obj = subscription_object(subscription_id, 'active', price_id)
+    elif event_type == 'invoice.payment_failed':
+        obj = invoice_object(f"in_{unique}", subscription_id)
+        obj.update(status='open', amount_paid=0, attempt_count=1, status_transitions={'paid_at': None})
+    elif event_type == 'invoice.payment_succeeded':
+        obj = invoice_object(f"in_{unique}", subscription_id)
+    else:
+        raise ValueError(f"No synthetic event for {event_type}")
+
+    return make_event(event_type, obj)
+
+def encode_event(event, secret):
+    """Serialize an event and sign it; returns (payload bytes, signature header)"""
+    payload = json.dumps(event).encode('utf-8')
+    return payload, sign_payload(payload, secret)
@@ -0,0 +1,53 @@
+# test_analytics.py - MRR movement computed from paid invoices
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from django.test import TestCase
+import unittest
+
+from ..analytics import load_invoices, month_index, mrr_movement, np, price_terms
+from ..models import Invoice, Plan
+
+
+@unittest.skipIf(np is None, "Billing analytics need NumPy")
+class MrrMovementTests(TestCase):
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Plan.objects.create(name='Weekly', price='10.00', billing_interval='week', stripe_price_id='price_weekly')
+            Plan.objects.create(name='Yearly', price='120.00', billing_interval='year', stripe_price_id='price_yearly')
+        self.month = month_index(datetime(2026, 3, 1))
+
+    def paid(self, invoice_id, amount, day, subscription_id='', price_id='', month=3):
+        Invoice.objects.create(
+            stripe_invoice_id=invoice_id, stripe_subscription_id=subscription_id, stripe_price_id=price_id,
+            customer_email='billing@example.com', amount=Decimal(amount), status='paid',
+            paid_at=datetime(2026, month, day, tzinfo=dt_timezone.utc),
+        )
+
+    def movement(self):
+        invoices = load_invoices('usd')
+        shares, covered = price_terms(invoices.price_ids)
+        return mrr_movement(invoices, shares, covered, self.month, self.month + 1)
+
+    def mrr(self):
+        return self.movement()['mrr'].tolist()
+
+    def test_weekly_mrr_does_not_depend_on_invoices_per_month(self):
+        # March 2026 has five Mondays, April four
+        for month, days in ((3, (2, 9, 16, 23, 30)), (4, (6, 13, 20, 27))):
+            for day in days:
+                self.paid(f'in_week_{month}_{day}', '10.00', day, 'sub_weekly', 'price_weekly', month)
+
+        movement = self.movement()
+        self.assertEqual([round(value, 2) for value in movement['mrr']], [43.33, 43.33])
+        self.assertEqual(movement['expansion'].tolist(), [0.0, 0.0])
+        self.assertEqual(movement['contraction'].tolist(), [0.0, 0.0])
+
+    def test_yearly_invoice_is_spread_over_its_months(self):
+        self.paid('in_year', '120.00', 15, 'sub_yearly', 'price_yearly')
+        self.assertEqual(self.mrr(), [10.0, 10.0])
+
+    def test_one_off_invoices_are_not_recurring_revenue(self):
+        self.paid('in_one_off_1', '500.00', 3)
+        self.paid('in_one_off_2', '80.00', 4)
+        self.assertEqual(self.mrr(), [0.0, 0.0])
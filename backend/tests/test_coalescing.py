@@ -0,0 +1,44 @@
+# test_coalescing.py - Queued subscription updates coalesced by the webhook worker
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from ..coalescing import apply_burst, split_batch
+from ..idempotency import claim_event, recent_events
+from ..models import UserSubscription, WebhookEvent
+from ..synthetic_events import make_event, subscription_object
+from ..webhook_worker import claim_pending_events
+
+
+@override_settings(STRIPE_WEBHOOK_COALESCE_WINDOW=30)
+class CoalescingTests(TransactionTestCase):
+    # The worker closes its connection after each event, so no wrapping transaction
+
+    def setUp(self):
+        recent_events.clear()
+        user = User.objects.create(username='coalesce')
+        UserSubscription.objects.create(user=user, plan_id='1', stripe_subscription_id='sub_burst')
+
+    def enqueue(self, status, created):
+        event = make_event('customer.subscription.updated', subscription_object('sub_burst', status=status), created)
+        claim_event(event['id'], event['type'], status='pending', event=event, subscription_id='sub_burst')
+        return event['id']
+
+    def test_updates_wait_for_the_window(self):
+        self.enqueue('past_due', 1000)
+        self.assertEqual(claim_pending_events(10), [])
+
+    def test_burst_is_claimed_together_and_applied_once(self):
+        first = self.enqueue('trialing', 1000)
+        self.enqueue('active', 1002)
+        self.enqueue('past_due', 1001)
+        WebhookEvent.objects.filter(stripe_event_id=first).update(created_at=timezone.now() - timedelta(seconds=60))
+
+        claimed = claim_pending_events(1)
+        singles, bursts = split_batch(claimed)
+        self.assertEqual((len(singles), [len(burst) for burst in bursts]), (0, [3]))
+
+        apply_burst(bursts[0])
+        self.assertEqual(UserSubscription.objects.get().status, 'active')
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', flat=True)), {'success'})
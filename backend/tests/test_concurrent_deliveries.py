@@ -0,0 +1,92 @@
+# test_concurrent_deliveries.py - Conflicting webhook deliveries handled in any order
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+import random
+import time
+
+from ..idempotency import claim_event, recent_events
+from ..management.commands.rebuild_billing_rollups import snapshot
+from ..models import UserSubscription
+from ..rollups import rebuild_rollups
+from ..synthetic_events import invoice_object, make_event, subscription_object
+from ..webhooks import dispatch_event
+
+STATUSES = ('active', 'past_due', 'unpaid', 'trialing')
+PRICES = ('price_synthetic', 'price_synthetic_pro')
+
+
+def deliver(event):
+    try:
+        if claim_event(event['id'], event['type']):
+            dispatch_event(event)
+    finally:
+        # Each pool thread owns its own connection
+        connection.close()
+
+
+class ConcurrentDeliveryTests(TransactionTestCase):
+    # Deliveries commit on their own threads' connections
+
+    def setUp(self):
+        recent_events.clear()
+        self.subscription_ids = []
+        for index in range(5):
+            user = User.objects.create(username=f'concurrent-{index}')
+            # Created one by one so the rollup signals see them
+            subscription = UserSubscription.objects.create(
+                user=user, plan_id='1', status='active', stripe_price_id='price_synthetic',
+                stripe_subscription_id=f'sub_concurrent_{index}',
+            )
+            self.subscription_ids.append(subscription.stripe_subscription_id)
+
+    def conflicting_events(self, per_subscription, rng):
+        """
+        Subscription updates and invoices with increasing `created` times, shuffled.
+
+        Each subscription's newest event is an update, so whatever order the deliveries
+        are handled in, the row must end with that update's status and price.
+        """
+        base = int(time.time()) - per_subscription
+        events, expected = [], {}
+        for subscription_id in self.subscription_ids:
+            for index in range(per_subscription):
+                kind = 'update' if index == per_subscription - 1 else rng.choice(('update', 'failed', 'paid'))
+                if kind == 'update':
+                    status, price_id = rng.choice(STATUSES), rng.choice(PRICES)
+                    obj = subscription_object(subscription_id, status, price_id)
+                    events.append(make_event('customer.subscription.updated', obj, base + index))
+                    expected[subscription_id] = (status, price_id)
+                else:
+                    obj = invoice_object(f"in_{subscription_id}_{index}", subscription_id)
+                    if kind == 'failed':
+                        obj.update(status='open', amount_paid=0, attempt_count=1, status_transitions={'paid_at': None})
+                    events.append(make_event(f"invoice.payment_{'failed' if kind == 'failed' else 'succeeded'}", obj, base + index))
+        rng.shuffle(events)
+        return events, expected
+
+    def test_final_state_follows_the_newest_update(self):
+        events, expected = self.conflicting_events(40, random.Random(42))
+        if connection.vendor == 'sqlite':
+            # SQLite serializes writers; the shuffled order still exercises the stale-event rules
+            for event in events:
+                claim_event(event['id'], event['type'])
+                dispatch_event(event)
+        else:
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                list(executor.map(deliver, events))
+
+        final = {
+            subscription_id: (status, price_id)
+            for subscription_id, status, price_id in UserSubscription.objects.filter(
+                stripe_subscription_id__in=self.subscription_ids
+            ).values_list('stripe_subscription_id', 'status', 'stripe_price_id')
+        }
+        self.assertEqual(final, expected)
+
+        with transaction.atomic():
+            before = snapshot()
+            rebuild_rollups()
+            self.assertEqual(snapshot(), before)
+            transaction.set_rollback(True)
@@ -0,0 +1,55 @@
+# test_entitlements.py - Entitlement cache invalidation by webhook handlers
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from ..entitlements import get_entitlement, get_plan_limits, has_active_subscription, local_entitlements
+from ..idempotency import claim_event, recent_events
+from ..models import Plan, UserSubscription
+from ..synthetic_events import make_event, subscription_object
+from ..webhooks import dispatch_event
+
+
+@override_settings(ENTITLEMENT_CACHE_ALIAS='default')
+class EntitlementInvalidationTests(TestCase):
+
+    def setUp(self):
+        recent_events.clear()
+        local_entitlements.clear()
+        cache.clear()
+        self.user = User.objects.create(username='entitled')
+        # The incomplete checkout is older than the canceled subscription the cache holds
+        UserSubscription.objects.create(
+            user=self.user, plan_id='1', status='incomplete', stripe_subscription_id='sub_new',
+        )
+        UserSubscription.objects.create(
+            user=self.user, plan_id='1', status='canceled', stripe_subscription_id='sub_old',
+        )
+
+    def dispatch(self, event_type, obj):
+        event = make_event(event_type, obj)
+        claim_event(event['id'], event_type)
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_event(event)
+
+    def test_new_subscription_invalidates_the_cached_one(self):
+        self.assertFalse(has_active_subscription(self.user.id))
+        self.assertEqual(get_entitlement(self.user.id).stripe_subscription_id, 'sub_old')
+
+        self.dispatch('customer.subscription.created', subscription_object('sub_new', status='active'))
+
+        # Another process only has the shared cache
+        local_entitlements.clear()
+        self.assertTrue(has_active_subscription(self.user.id))
+
+    def test_upgrade_payment_switches_plan_and_limits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            plan = Plan.objects.create(name='Scale', price='99.00', stripe_price_id='price_scale', limits={'minutes': 900})
+        subscription = UserSubscription.objects.get(stripe_subscription_id='sub_new')
+        self.assertEqual(get_plan_limits(self.user.id), {})
+
+        metadata = {'subscription_id': str(subscription.id), 'package_id': str(plan.id), 'action_type': 'upgrade'}
+        self.dispatch('payment_intent.succeeded', {'id': 'pi_upgrade', 'object': 'payment_intent', 'metadata': metadata})
+
+        self.assertEqual(UserSubscription.objects.get(id=subscription.id).stripe_price_id, 'price_scale')
+        self.assertEqual(get_plan_limits(self.user.id), {'minutes': 900})
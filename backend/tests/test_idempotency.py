@@ -0,0 +1,41 @@
+# test_idempotency.py - Claiming webhook events and storing their payloads
+from django.test import TransactionTestCase
+from unittest import mock
+
+from .. import idempotency
+from ..idempotency import claim_event, recent_events
+from ..models import WebhookEvent, WebhookPayload
+from ..payload_store import delete_orphaned_payloads, load_event, pack_event
+from ..synthetic_events import make_event, subscription_object
+
+
+class ClaimEventTests(TransactionTestCase):
+    # Foreign keys are checked when the claim commits
+
+    def setUp(self):
+        recent_events.clear()
+        self.event = make_event('customer.subscription.updated', subscription_object('sub_claimed'))
+
+    def test_payload_removed_before_the_claim_is_stored_again(self):
+        calls = []
+
+        def pack_then_clean_up(event):
+            packed = pack_event(event)
+            if not calls:
+                # The retention job runs between storing the payload and the claim
+                delete_orphaned_payloads()
+            calls.append(event['id'])
+            return packed
+
+        with mock.patch.object(idempotency, 'pack_event', pack_then_clean_up):
+            self.assertTrue(claim_event(self.event['id'], self.event['type'], event=self.event))
+
+        self.assertEqual(len(calls), 2)
+        claimed = WebhookEvent.objects.select_related('payload').get(stripe_event_id=self.event['id'])
+        self.assertEqual(load_event(claimed), self.event)
+
+    def test_duplicates_are_still_rejected(self):
+        self.assertTrue(claim_event(self.event['id'], self.event['type'], event=self.event))
+        recent_events.clear()
+        self.assertFalse(claim_event(self.event['id'], self.event['type'], event=self.event))
+        self.assertEqual(WebhookPayload.objects.count(), 1)
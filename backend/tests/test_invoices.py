@@ -0,0 +1,41 @@
+# test_invoices.py - Invoice upserts from webhooks and replays
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..idempotency import claim_event, recent_events
+from ..models import Invoice, UserSubscription
+from ..replay import replay_events
+from ..synthetic_events import invoice_object, make_event
+from ..webhooks import dispatch_event
+
+
+class InvoiceUserTests(TestCase):
+
+    def setUp(self):
+        recent_events.clear()
+        self.user = User.objects.create(username='invoiced')
+
+    def paid(self, invoice_id, subscription_id):
+        return make_event('invoice.payment_succeeded', invoice_object(invoice_id, subscription_id, customer_id='cus_gone'))
+
+    def dispatch(self, event):
+        claim_event(event['id'], event['type'])
+        with self.captureOnCommitCallbacks(execute=True):
+            dispatch_event(event)
+
+    def test_stored_user_survives_a_failed_lookup(self):
+        # Backfilled earlier; the subscription row has since been deleted
+        Invoice.objects.create(stripe_invoice_id='in_kept', customer_email='a@example.com', user=self.user)
+
+        self.dispatch(self.paid('in_kept', 'sub_gone'))
+        replay_events([self.paid('in_kept', 'sub_gone')], workers=1)
+
+        invoice = Invoice.objects.get(stripe_invoice_id='in_kept')
+        self.assertEqual((invoice.status, invoice.user_id), ('paid', self.user.id))
+
+    def test_missing_user_is_filled_in(self):
+        Invoice.objects.create(stripe_invoice_id='in_orphan', customer_email='a@example.com')
+        UserSubscription.objects.create(user=self.user, plan_id='1', stripe_subscription_id='sub_found')
+
+        self.dispatch(self.paid('in_orphan', 'sub_found'))
+        self.assertEqual(Invoice.objects.get(stripe_invoice_id='in_orphan').user_id, self.user.id)
@@ -0,0 +1,90 @@
+# test_metering.py - Usage ingestion and buffered flushes
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from unittest import mock
+import json
+import threading
+
+from .. import metering
+from ..metering import UsageMeter, parse_occurred_at
+from ..models import UsagePeriod
+from ..views import usage_events
+
+
+@override_settings(USAGE_INGEST_API_KEY='usage_test_key')
+class UsageIngestTests(TestCase):
+
+    def post(self, body):
+        request = RequestFactory().post(
+            '/usage/events/', json.dumps(body), content_type='application/json',
+            HTTP_AUTHORIZATION='Bearer usage_test_key',
+        )
+        return usage_events(request)
+
+    def test_malformed_events_are_rejected(self):
+        for events in ([42], ['minutes'], [{'user_id': 1, 'minutes': 1, 'occurred_at': 1e20}]):
+            self.assertEqual(self.post({'events': events}).status_code, 400, events)
+
+    def test_unknown_users_are_rejected(self):
+        user = User.objects.create(username='metered')
+        response = self.post({'events': [{'user_id': user.id, 'minutes': 1}, {'user_id': user.id + 1, 'minutes': 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(user.id + 1), json.loads(response.content)['error'])
+
+    def test_out_of_range_timestamps_raise_value_error(self):
+        for value in (1e20, float('inf')):
+            with self.assertRaises(ValueError):
+                parse_occurred_at(value)
+
+
+class UsageFlushTests(TransactionTestCase):
+    # Foreign keys are checked when the flush commits
+
+    def test_rejected_period_does_not_block_the_rest(self):
+        user = User.objects.create(username='metered')
+        meter = UsageMeter(flush_interval=3600, max_events=1000)
+        meter.record(user.id, 2)
+        meter.record(user.id + 1, 5)  # e.g. deleted after ingestion
+
+        self.assertEqual(meter.flush(), 1)
+        self.assertEqual(UsagePeriod.objects.get().quantity, Decimal('2'))
+        # Nothing is kept for a retry that could never succeed
+        self.assertEqual(meter.flush(), 0)
+
+    def test_threshold_flush_keeps_the_request_connection(self):
+        user = User.objects.create(username='metered')
+        meter = UsageMeter(flush_interval=3600, max_events=2)
+        outcome = []
+
+        def request():
+            # e.g. a view under ATOMIC_REQUESTS on a server worker thread
+            try:
+                with transaction.atomic(), mock.patch.object(metering, 'connection', wraps=connection) as used:
+                    meter.record(user.id, 1)
+                    meter.record(user.id, 2)  # reaches max_events and flushes here
+                    outcome.append((used.close.called, connection.needs_rollback))
+                    outcome.append(User.objects.filter(id=user.id).exists())
+            except Exception as e:
+                outcome.append(e)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(outcome, [(False, False), True])
+        self.assertEqual(UsagePeriod.objects.get().quantity, Decimal('3'))
+
+    def test_timer_flush_closes_its_connection(self):
+        user = User.objects.create(username='metered')
+        meter = UsageMeter(flush_interval=3600, max_events=1000)
+        meter.record(user.id, 1)
+
+        with mock.patch.object(metering, 'connection') as used:
+            meter._timer_flush()
+
+        used.close.assert_called_once_with()
+        self.assertEqual(UsagePeriod.objects.get().quantity, Decimal('1'))
@@ -0,0 +1,54 @@
+# test_plan_catalog.py - Plan catalog contents, refresh and the plans API
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase, override_settings
+import json
+
+from ..entitlements import get_plan_limits, local_entitlements
+from ..models import Plan, UserSubscription
+from ..plan_catalog import build_catalog, get_catalog
+from ..views import plans_list
+
+
+class PlanCatalogTests(TestCase):
+
+    def setUp(self):
+        local_entitlements.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.current = Plan.objects.create(name='Pro', price='49.00', stripe_price_id='price_pro')
+            self.retired = Plan.objects.create(
+                name='Legacy', price='29.00', stripe_price_id='price_legacy', is_active=False, limits={'minutes': 300},
+            )
+
+    def list_plans(self, **headers):
+        return plans_list(RequestFactory().get('/plans/', **headers))
+
+    def test_retired_plans_keep_their_limits(self):
+        user = User.objects.create(username='legacy')
+        UserSubscription.objects.create(
+            user=user, plan_id=str(self.retired.id), status='active', stripe_price_id='price_legacy',
+        )
+        self.assertEqual(get_catalog().for_price('price_legacy').id, self.retired.id)
+        self.assertEqual(get_plan_limits(user.id), {'minutes': 300})
+
+    def test_listing_offers_active_plans_only(self):
+        plans = json.loads(self.list_plans().content)['plans']
+        self.assertEqual([plan['stripe_price_id'] for plan in plans], ['price_pro'])
+
+    def test_etag_follows_content(self):
+        etag = self.list_plans()['ETag']
+        self.assertEqual(self.list_plans(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Same plans under another version number (e.g. another process) give the same ETag
+        self.assertEqual(build_catalog(12345).digest, get_catalog().digest)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.current.price = '59.00'
+            self.current.save()
+        self.assertNotEqual(self.list_plans()['ETag'], etag)
+
+    @override_settings(PLAN_CATALOG_MAX_AGE=0)
+    def test_catalog_expires_without_a_version_bump(self):
+        get_catalog()
+        # queryset.update() sends no signal, so only the age limit notices it
+        Plan.objects.filter(id=self.current.id).update(name='Pro 2')
+        with override_settings(PLAN_CATALOG_CHECK_INTERVAL=0):
+            self.assertEqual(get_catalog().get(self.current.id).name, 'Pro 2')
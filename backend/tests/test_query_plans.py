@@ -0,0 +1,18 @@
+# test_query_plans.py - The hot billing queries use indexes, not sequential scans
+from django.test import TestCase
+
+from ..management.commands.check_query_plans import Command, hot_queries, is_sequential_scan
+
+
+class QueryPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Enough rows that the planner prefers an index wherever one fits
+        Command().seed(2000)
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in hot_queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertFalse(is_sequential_scan(plan, queryset.model._meta.db_table), plan)
@@ -0,0 +1,21 @@
+# test_quotas.py - Call admission API
+from django.test import RequestFactory, SimpleTestCase, override_settings
+import json
+
+from ..views import call_admission, call_release
+
+
+@override_settings(USAGE_INGEST_API_KEY='usage_test_key')
+class CallAdmissionRequestTests(SimpleTestCase):
+
+    def post(self, view, body):
+        request = RequestFactory().post(
+            '/calls/', json.dumps(body), content_type='application/json',
+            HTTP_AUTHORIZATION='Bearer usage_test_key',
+        )
+        return view(request)
+
+    def test_non_object_bodies_are_rejected(self):
+        for body in ([{'user_id': 1}], 'user_id', 1, None):
+            self.assertEqual(self.post(call_admission, body).status_code, 400, body)
+            self.assertEqual(self.post(call_release, body).status_code, 400, body)
@@ -0,0 +1,78 @@
+# test_reconciliation.py - Reconciling local rows with (stubbed) Stripe list responses
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+from django.utils import timezone
+from types import SimpleNamespace
+from unittest import mock
+import stripe
+import threading
+
+from .. import reconciliation
+from ..idempotency import claim_event, recent_events
+from ..models import SyncCheckpoint, UserSubscription
+from ..synthetic_events import make_event, subscription_object
+from ..webhooks import dispatch_event
+
+
+class ReconciliationTests(TransactionTestCase):
+    # Pages are fetched on pool threads, each with its own connection
+
+    def setUp(self):
+        recent_events.clear()
+        user = User.objects.create(username='reconciled')
+        UserSubscription.objects.create(user=user, plan_id='1', status='past_due', stripe_subscription_id='sub_rec')
+        SyncCheckpoint.objects.create(name='subscriptions', synced_until=timezone.now() - timedelta(hours=2))
+
+    def test_incremental_run_applies_the_newest_event(self):
+        now = int(timezone.now().timestamp())
+        events = [
+            make_event('customer.subscription.updated', subscription_object('sub_rec', status='active'), now - 60),
+            make_event('customer.subscription.updated', subscription_object('sub_rec', status='trialing'), now - 600),
+        ]
+        requests = []
+
+        def list_events(request, **params):
+            requests.append(request)
+            in_window = [event for event in events if params['created']['gte'] <= event['created'] < params['created']['lt']]
+            return SimpleNamespace(data=in_window, has_more=False)
+
+        with mock.patch.object(reconciliation, 'call_stripe', list_events):
+            stats = reconciliation.reconcile('subscriptions', concurrency=2)
+
+        self.assertEqual(set(requests), {stripe.Event.list})
+        self.assertEqual((stats['examined'], stats['corrected']), (1, 1))
+        subscription = UserSubscription.objects.get()
+        self.assertEqual(subscription.status, 'active')
+        self.assertEqual(subscription.last_event_created_at.timestamp(), now - 60)
+
+        # A webhook older than the reconciled state arrives late
+        stale = make_event('customer.subscription.updated', subscription_object('sub_rec', status='past_due'), now - 120)
+        claim_event(stale['id'], stale['type'])
+        dispatch_event(stale)
+        self.assertEqual(UserSubscription.objects.get().status, 'active')
+
+    def test_consumer_failure_does_not_hang_producers(self):
+        def endless_pages(request, **params):
+            return SimpleNamespace(data=[make_event('customer.subscription.updated', subscription_object('sub_rec'))],
+                                   has_more=True)
+
+        def fail(events, latest):
+            raise RuntimeError('compare failed')
+
+        outcome = []
+
+        def run():
+            try:
+                reconciliation.reconcile('subscriptions', concurrency=2, windows=4)
+            except RuntimeError as e:
+                outcome.append(e)
+
+        with mock.patch.object(reconciliation, 'call_stripe', endless_pages), \
+                mock.patch.object(reconciliation, 'latest_objects', fail):
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(outcome), 1)
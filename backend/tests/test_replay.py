@@ -0,0 +1,43 @@
+# test_replay.py - Partitioning and ordering of bulk replays
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..models import UserSubscription
+from ..replay import partition_events, partition_key, replay_events, subscription_stripe_ids
+from ..synthetic_events import invoice_object, make_event, subscription_object
+
+
+class ReplayPartitionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='replay')
+        cls.subscription = UserSubscription.objects.create(
+            user=user, plan_id='1', status='active', stripe_subscription_id='sub_replay',
+        )
+
+    def payment_failed(self, created):
+        obj = {'id': 'pi_replay', 'object': 'payment_intent', 'metadata': {'subscription_id': str(self.subscription.id)}}
+        return make_event('payment_intent.payment_failed', obj, created)
+
+    def test_payment_intents_share_the_subscription_partition(self):
+        events = [
+            make_event('customer.subscription.updated', subscription_object('sub_replay'), 1000),
+            make_event('invoice.payment_failed', invoice_object('in_replay', 'sub_replay'), 1001),
+            self.payment_failed(1002),
+        ]
+        stripe_ids = subscription_stripe_ids(events)
+        self.assertEqual({partition_key(event, stripe_ids) for event in events}, {'sub_replay'})
+        self.assertEqual(len(partition_events(events, 8, stripe_ids)), 1)
+
+    def test_events_apply_in_delivery_order_across_sources(self):
+        events = [
+            make_event('customer.subscription.updated', subscription_object('sub_replay', status='active'), 1000),
+            self.payment_failed(1001),
+            make_event('customer.subscription.updated', subscription_object('sub_replay', status='active'), 1002),
+        ]
+        replay_events(events, workers=1)
+        self.assertEqual(UserSubscription.objects.get(id=self.subscription.id).status, 'active')
+
+        replay_events([self.payment_failed(1003)], workers=1)
+        self.assertEqual(UserSubscription.objects.get(id=self.subscription.id).status, 'past_due')
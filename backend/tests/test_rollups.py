@@ -0,0 +1,44 @@
+# test_rollups.py - Plan rollups follow subscriptions changed outside the webhook handlers
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from ..models import PlanStatusRollup, UserSubscription
+from ..rollups import rebuild_rollups
+
+
+class SubscriptionSaveTests(TestCase):
+
+    def counts(self):
+        return dict(
+            ((price_id, status), count) for price_id, status, count in
+            PlanStatusRollup.objects.exclude(subscriptions=0).values_list('stripe_price_id', 'status', 'subscriptions')
+        )
+
+    def test_saved_changes_move_the_subscription(self):
+        user = User.objects.create(username='admin-edited')
+        subscription = UserSubscription.objects.create(
+            user=user, plan_id='1', status='trialing', stripe_price_id='price_basic', stripe_subscription_id='sub_saved',
+        )
+        self.assertEqual(self.counts(), {('price_basic', 'trialing'): 1})
+
+        subscription.status = 'active'
+        subscription.save()
+        self.assertEqual(self.counts(), {('price_basic', 'active'): 1})
+
+        # A stale instance still moves the row from what is stored
+        stale = UserSubscription.objects.get(id=subscription.id)
+        subscription.stripe_price_id = 'price_pro'
+        subscription.save(update_fields=['stripe_price_id'])
+        stale.status = 'past_due'
+        stale.save()
+        self.assertEqual(self.counts(), {('price_basic', 'past_due'): 1})
+
+        # Saves that leave status and price alone change nothing
+        stale.current_period_end = None
+        stale.save(update_fields=['current_period_end'])
+        stale.save()
+        self.assertEqual(self.counts(), {('price_basic', 'past_due'): 1})
+
+        before = self.counts()
+        rebuild_rollups()
+        self.assertEqual(self.counts(), before)
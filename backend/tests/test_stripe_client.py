@@ -0,0 +1,86 @@
+# test_stripe_client.py - Retries and pooled connections against a local Stripe stand-in
+from django.test import SimpleTestCase, override_settings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import json
+import stripe
+import threading
+
+from .. import stripe_client
+from ..stripe_client import get_price, object_cache
+
+
+class StubStripe(BaseHTTPRequestHandler):
+    """Answers each GET with the next queued status; 200s return a Price"""
+    protocol_version = 'HTTP/1.1'  # keep-alive, so reused connections are visible
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status == 200:
+            body = {'id': self.path.rsplit('/', 1)[-1], 'object': 'price', 'unit_amount': 1000}
+        else:
+            body = {'error': {'type': 'api_error', 'message': f'stub status {status}'}}
+        raw = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CallStripeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubStripe)
+        self.server.daemon_threads = True
+        self.server.requests, self.server.statuses = [], []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        saved = stripe.api_base, stripe.api_key, stripe.default_http_client
+        self.addCleanup(self.restore_stripe, *saved)
+        settings = override_settings(
+            STRIPE_SECRET_KEY='sk_test_stub', STRIPE_API_BASE=f'http://127.0.0.1:{self.server.server_port}',
+            STRIPE_RETRY_ATTEMPTS=3, STRIPE_RETRY_BACKOFF=0.01, STRIPE_RETRY_MAX_DELAY=1,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # configure_stripe() runs once per process; start from an unconfigured client
+        stripe_client._configured = False
+        object_cache.clear()
+
+    def restore_stripe(self, api_base, api_key, http_client):
+        stripe.default_http_client._session.close()
+        stripe.api_base, stripe.api_key, stripe.default_http_client = api_base, api_key, http_client
+        stripe_client._configured = False
+        object_cache.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_transient_errors_are_retried_with_backoff_on_one_connection(self):
+        self.server.statuses = [429, 500]
+        with mock.patch.object(stripe_client.random, 'uniform', return_value=1.0), \
+                mock.patch.object(stripe_client.time, 'sleep') as sleep:
+            price = get_price('price_stub')
+
+        self.assertEqual(price.id, 'price_stub')
+        self.assertEqual([path for path, _ in self.server.requests], ['/v1/prices/price_stub'] * 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.01, 0.02])
+        # Every attempt went over the same keep-alive connection of the pooled session
+        self.assertEqual(len({client for _, client in self.server.requests}), 1)
+
+        # Served from memory afterwards
+        self.assertEqual(get_price('price_stub').id, 'price_stub')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_errors_are_raised_when_attempts_run_out(self):
+        self.server.statuses = [503, 503, 503, 200]
+        with mock.patch.object(stripe_client.time, 'sleep') as sleep, self.assertRaises(stripe.error.APIError):
+            get_price('price_unavailable')
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertIsNone(object_cache.get(('price', 'price_unavailable')))
@@ -0,0 +1,45 @@
+# test_subscription_history.py - History entries written with the change they describe
+from django.contrib.auth.models import User
+from django.test import TestCase
+from unittest import mock
+
+from .. import webhooks
+from ..idempotency import claim_event, recent_events
+from ..models import SubscriptionHistory, UserSubscription
+from ..synthetic_events import make_event, subscription_object
+
+
+class SubscriptionHistoryTests(TestCase):
+
+    def setUp(self):
+        recent_events.clear()
+        user = User.objects.create(username='audited')
+        self.subscription = UserSubscription.objects.create(
+            user=user, plan_id='1', status='active', stripe_subscription_id='sub_audit',
+        )
+
+    def dispatch_past_due(self):
+        event = make_event('customer.subscription.updated', subscription_object('sub_audit', status='past_due'))
+        claim_event(event['id'], event['type'])
+        webhooks.dispatch_event(event)
+        return event
+
+    def test_entry_is_written_in_the_handler_transaction(self):
+        event = self.dispatch_past_due()
+        # No commit callback or background flush involved
+        entry = SubscriptionHistory.objects.get(subscription=self.subscription)
+        self.assertEqual((entry.action, entry.metadata['event_id']), ('payment_failed', event['id']))
+
+    def test_failed_handler_leaves_no_entry(self):
+        log = webhooks.log_webhook_event
+
+        def fail_on_success(event_id, event_type, subscription_id, status, *args):
+            if status == 'success':
+                raise RuntimeError('outcome not recorded')
+            return log(event_id, event_type, subscription_id, status, *args)
+
+        with mock.patch.object(webhooks, 'log_webhook_event', fail_on_success):
+            self.dispatch_past_due()
+
+        self.assertEqual(UserSubscription.objects.get(id=self.subscription.id).status, 'active')
+        self.assertFalse(SubscriptionHistory.objects.exists())
@@ -0,0 +1,78 @@
+# test_usage_reporting.py - Sending metered usage to (stubbed) Stripe usage records
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from unittest import mock
+import stripe
+
+from ..models import UsagePeriod, UserSubscription
+from ..usage_reporting import report_usage
+
+
+@override_settings(STRIPE_SECRET_KEY='sk_test_stub', STRIPE_USAGE_REPORT_ATTEMPTS=2, STRIPE_RETRY_BACKOFF=0)
+class ReportUsageTests(TestCase):
+
+    def setUp(self):
+        self.period_start = timezone.now().replace(microsecond=0) - timedelta(days=3)
+        self.periods = {}
+        for item_id, minutes in (('si_alpha', '2.5'), ('si_beta', '7')):
+            user = User.objects.create(username=item_id)
+            subscription = UserSubscription.objects.create(
+                user=user, plan_id='1', status='active', stripe_subscription_item_id=item_id,
+                stripe_subscription_id=f'sub_{item_id}',
+            )
+            self.periods[item_id] = UsagePeriod.objects.create(
+                user=user, subscription=subscription, quantity=Decimal(minutes), events=3,
+                period_start=self.period_start, period_end=self.period_start + timedelta(days=30),
+            )
+        self.calls = []
+        # Errors to raise, in order, per subscription item
+        self.failures = {}
+
+    def create_usage_record(self, item_id, **params):
+        self.calls.append((item_id, params))
+        failures = self.failures.get(item_id)
+        if failures:
+            raise failures.pop(0)
+        return {'id': f'mbur_{len(self.calls)}', 'quantity': params['quantity']}
+
+    def run_report(self):
+        self.calls = []
+        with mock.patch.object(stripe.SubscriptionItem, 'create_usage_record', self.create_usage_record):
+            return report_usage(concurrency=2)
+
+    def reported(self, item_id):
+        return UsagePeriod.objects.get(id=self.periods[item_id].id).reported_quantity
+
+    def test_totals_are_set_once_per_item_and_failures_retried_next_run(self):
+        self.failures = {
+            'si_alpha': [stripe.error.RateLimitError('slow down')],
+            'si_beta': [stripe.error.APIError('unavailable'), stripe.error.APIError('unavailable')],
+        }
+        self.assertEqual(self.run_report(), (1, 1))
+
+        alpha = [params for item_id, params in self.calls if item_id == 'si_alpha']
+        self.assertEqual(len(alpha), 2)  # retried within the run
+        self.assertEqual(alpha[0], alpha[1])
+        self.assertEqual(alpha[0]['action'], 'set')
+        self.assertEqual(alpha[0]['quantity'], 3)  # 2.5 minutes, rounded up
+        self.assertEqual(alpha[0]['timestamp'], int(self.period_start.timestamp()))
+        beta_key = {params['idempotency_key'] for item_id, params in self.calls if item_id == 'si_beta'}
+        self.assertEqual(len(beta_key), 1)
+        self.assertEqual((self.reported('si_alpha'), self.reported('si_beta')), (3, 0))
+
+        # The failed item is sent again with the same key; the reported one is not
+        self.assertEqual(self.run_report(), (1, 0))
+        self.assertEqual([(item_id, {params['idempotency_key']}) for item_id, params in self.calls],
+                         [('si_beta', beta_key)])
+        self.assertEqual(self.reported('si_beta'), 7)
+
+        # New usage resets the period's total, under a new key
+        UsagePeriod.objects.filter(id=self.periods['si_alpha'].id).update(quantity=Decimal('4.2'))
+        self.assertEqual(self.run_report(), (1, 0))
+        [(item_id, params)] = self.calls
+        self.assertEqual((item_id, params['quantity'], params['action']), ('si_alpha', 5, 'set'))
+        self.assertNotEqual(params['idempotency_key'], alpha[0]['idempotency_key'])
+        self.assertEqual(self.run_report(), (0, 0))
@@ -0,0 +1,86 @@
+# test_webhook_queries.py - Per-event query budgets of the webhook handlers
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from ..idempotency import claim_event, recent_events
+from ..models import DailyBillingRollup, Invoice, Plan, PlanStatusRollup, UserSubscription, WebhookEvent
+from ..plan_catalog import get_catalog
+from ..synthetic_events import invoice_object, make_event, subscription_object
+from ..webhooks import QUERY_BUDGETS, count_queries, dispatch_event
+
+PRICE_ID = 'price_synthetic'
+STATUSES = ('active', 'past_due', 'canceled', 'trialing')
+
+
+class WebhookQueryBudgetTests(TestCase):
+    """Each event type stays within webhooks.QUERY_BUDGETS once the rollup rows exist"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='budget')
+        cls.subscription = UserSubscription.objects.create(
+            user=cls.user, plan_id='1', status='active', stripe_price_id=PRICE_ID,
+            stripe_subscription_id='sub_budget', stripe_customer_id='cus_synthetic',
+        )
+        # Rows a steady-state deployment already has; creating them is a one-off
+        for status in STATUSES:
+            PlanStatusRollup.objects.get_or_create(stripe_price_id=PRICE_ID, status=status)
+        DailyBillingRollup.objects.create(day=timezone.localdate(), stripe_price_id=PRICE_ID, currency='usd')
+
+    def setUp(self):
+        recent_events.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            Plan.objects.create(name='Synthetic', price='49.00', stripe_price_id=PRICE_ID)
+        get_catalog()
+
+    def handle(self, event_type, obj):
+        """Claim and dispatch an event; returns the SQL its handler ran"""
+        event = make_event(event_type, obj)
+        self.assertTrue(claim_event(event['id'], event_type))
+        with count_queries() as executed:
+            dispatch_event(event)
+        self.assertEqual(WebhookEvent.objects.get(stripe_event_id=event['id']).status, 'success')
+        return executed
+
+    def assertWithinBudget(self, event_type, obj):
+        executed = self.handle(event_type, obj)
+        self.assertLessEqual(len(executed), QUERY_BUDGETS[event_type], '\n'.join(executed))
+        return executed
+
+    def payment_intent(self, **metadata):
+        return {'id': 'pi_budget', 'object': 'payment_intent',
+                'metadata': dict(subscription_id=str(self.subscription.id), **metadata)}
+
+    def test_subscription_events(self):
+        self.assertWithinBudget('customer.subscription.updated', subscription_object('sub_budget', status='past_due'))
+        self.assertWithinBudget('customer.subscription.created', subscription_object('sub_budget', status='trialing'))
+        self.assertWithinBudget('customer.subscription.deleted', subscription_object('sub_budget', status='canceled'))
+        self.assertEqual(UserSubscription.objects.get(id=self.subscription.id).status, 'canceled')
+
+    def test_unchanged_status_costs_three_queries(self):
+        executed = self.handle('customer.subscription.updated', subscription_object('sub_budget', status='active'))
+        self.assertEqual(len(executed), 3, '\n'.join(executed))
+
+    def test_payment_intent_events(self):
+        self.assertWithinBudget('payment_intent.payment_failed', self.payment_intent())
+        self.assertWithinBudget('payment_intent.succeeded', self.payment_intent(action_type='subscription_purchase'))
+        self.assertEqual(UserSubscription.objects.get(id=self.subscription.id).status, 'active')
+
+    def test_invoice_events(self):
+        failed = dict(invoice_object('in_budget_failed', 'sub_budget'), status='open')
+        self.assertWithinBudget('invoice.payment_failed', failed)
+        self.assertWithinBudget('invoice.payment_succeeded', invoice_object('in_budget_paid', 'sub_budget'))
+        self.assertEqual(Invoice.objects.get(stripe_invoice_id='in_budget_paid').user_id, self.user.id)
+        self.assertEqual(UserSubscription.objects.get(id=self.subscription.id).status, 'past_due')
+
+    def test_trial_will_end(self):
+        self.assertWithinBudget('customer.subscription.trial_will_end', subscription_object('sub_budget', status='trialing'))
+
+    def test_rollups_follow_changes(self):
+        self.handle('customer.subscription.updated', subscription_object('sub_budget', status='past_due'))
+        self.handle('invoice.payment_succeeded', invoice_object('in_budget_paid', 'sub_budget'))
+        counts = dict(PlanStatusRollup.objects.filter(stripe_price_id=PRICE_ID).values_list('status', 'subscriptions'))
+        self.assertEqual(counts['active'], 0)
+        self.assertEqual(counts['past_due'], 1)
+        self.assertEqual(DailyBillingRollup.objects.get(stripe_price_id=PRICE_ID).invoices_paid, 1)
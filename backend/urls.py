@@ -1,13 +1,39 @@
 # urls.py - URL Configuration for Stripe Webhooks
 from django.urls import path
-from . import webhooks
+from . import views, webhooks, webhooks_async
 
 urlpatterns = [
     # Stripe webhook endpoint
     path('webhooks/stripe/', webhooks.stripe_webhook, name='stripe_webhook'),
     
+    # Same endpoint as a native async view, for ASGI deployments
+    path('webhooks/stripe/async/', webhooks_async.stripe_webhook_async, name='stripe_webhook_async'),
+    
     # Health check for webhook
     path('webhooks/health/', webhooks.webhook_health, name='webhook_health'),
+    
+    # Active plans from the in-memory plan catalog
+    path('plans/', views.plans_list, name='plans_list'),
+    
+    # Billing dashboard numbers from the incrementally maintained rollups
+    path('dashboard/billing/', views.billing_dashboard, name='billing_dashboard'),
+    
+    # Churn, cohorts, MRR movement and LTV (needs NumPy)
+    path('dashboard/analytics/', views.analytics_dashboard, name='analytics_dashboard'),
+    
+    # Usage metering: batched ingest for the calling service, current period for the user
+    path('usage/events/', views.usage_events, name='usage_events'),
+    path('usage/', views.usage_summary, name='usage_summary'),
+    
+    # The signed-in user's invoice history, keyset-paginated
+    path('invoices/', views.invoice_history, name='invoice_history'),
+    
+    # Audit trail of the signed-in user's plan and status changes
+    path('subscriptions/history/', views.subscription_history, name='subscription_history'),
+    
+    # Plan-limit admission checks before an outbound call, and slot release after it
+    path('calls/admission/', views.call_admission, name='call_admission'),
+    path('calls/release/', views.call_release, name='call_release'),
 ]
 
 # Add these URLs to your main urls.py:
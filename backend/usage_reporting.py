@@ -0,0 +1,120 @@
+# usage_reporting.py - Batched reporting of metered usage to Stripe usage records
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import ROUND_CEILING
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+import logging
+import stripe
+
+from .metering import DEFAULT_METRIC
+from .stripe_client import call_stripe
+
+logger = logging.getLogger(__name__)
+
+# Total usage of one subscription item for one billing period
+UsageReport = namedtuple('UsageReport', ['period_id', 'subscription_item_id', 'quantity', 'timestamp'])
+
+def stripe_quantity(quantity):
+    """Stripe usage quantities are whole units; partial minutes are rounded up"""
+    return int(quantity.to_integral_value(rounding=ROUND_CEILING))
+
+def pending_reports(limit=None, now=None):
+    """
+    UsagePeriod rows whose total has grown since it was last reported.
+
+    Only periods that ended less than STRIPE_USAGE_REPORT_GRACE ago are considered; Stripe
+    no longer accepts usage for older ones.
+    """
+    from .models import UsagePeriod
+
+    now = now or timezone.now()
+    grace = timedelta(seconds=getattr(settings, 'STRIPE_USAGE_REPORT_GRACE', 24 * 60 * 60))
+    rows = (
+        UsagePeriod.objects.filter(
+            metric=DEFAULT_METRIC,
+            period_end__gt=now - grace,
+            quantity__gt=F('reported_quantity'),
+            subscription__isnull=False,
+        )
+        .exclude(subscription__stripe_subscription_item_id='')
+        .order_by('id')
+        .values_list('id', 'subscription__stripe_subscription_item_id', 'quantity', 'reported_quantity', 'period_start')
+    )
+    if limit:
+        rows = rows[:limit]
+
+    return [
+        UsageReport(period_id, item_id, stripe_quantity(quantity), int(period_start.timestamp()))
+        for period_id, item_id, quantity, reported, period_start in rows
+        if stripe_quantity(quantity) > reported
+    ]
+
+def send_usage_record(report, attempts=None):
+    """
+    Set the item's usage for the period to the report's total.
+
+    Usage is always written with action='set' at the period start, so resending after a
+    timeout or a crash cannot double count. The idempotency key makes Stripe answer an
+    identical retry from its cache.
+    """
+    try:
+        call_stripe(
+            stripe.SubscriptionItem.create_usage_record,
+            report.subscription_item_id,
+            quantity=report.quantity,
+            timestamp=report.timestamp,
+            action='set',
+            idempotency_key=f"usage-{report.period_id}-{report.quantity}",
+            attempts=attempts,
+        )
+        return True
+    except stripe.error.StripeError as e:
+        logger.error(f"❌ Stripe did not accept usage for period {report.period_id}: {e}")
+        return False
+
+def mark_reported(reports):
+    """Record what Stripe now has, in one UPDATE; never moves a watermark backwards"""
+    from .models import UsagePeriod
+
+    if not reports:
+        return 0
+    reported = Case(
+        *[When(id=report.period_id, then=Value(report.quantity)) for report in reports],
+        output_field=IntegerField(),
+    )
+    return UsagePeriod.objects.filter(id__in=[report.period_id for report in reports]).update(
+        reported_quantity=Greatest(F('reported_quantity'), reported),
+        reported_at=timezone.now(),
+    )
+
+def report_usage(batch_size=100, concurrency=None, limit=None, dry_run=False):
+    """
+    Send every pending usage total to Stripe; returns (reported, failed) counts.
+
+    Reports go out in batches of `batch_size` with at most `concurrency` requests in
+    flight (STRIPE_USAGE_REPORT_CONCURRENCY). Each batch's watermarks are saved before
+    the next batch starts, so an interrupted run resumes where it stopped.
+    """
+    reports = pending_reports(limit)
+    if dry_run:
+        return len(reports), 0
+
+    concurrency = concurrency or getattr(settings, 'STRIPE_USAGE_REPORT_CONCURRENCY', 4)
+    attempts = getattr(settings, 'STRIPE_USAGE_REPORT_ATTEMPTS', 5)
+    sent = failed = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for start in range(0, len(reports), batch_size):
+            batch = reports[start:start + batch_size]
+            results = list(executor.map(lambda report: send_usage_record(report, attempts), batch))
+            delivered = [report for report, ok in zip(batch, results) if ok]
+            mark_reported(delivered)
+            sent += len(delivered)
+            failed += len(batch) - len(delivered)
+
+    logger.info(f"📤 Reported usage for {sent} periods to Stripe ({failed} failed)")
+    return sent, failed
@@ -0,0 +1,230 @@
+# views.py - JSON endpoints for billing pages
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+import hmac
+
+from .analytics import billing_analytics
+from .invoice_history import invoice_page
+from .metering import DEFAULT_METRIC, current_usage, parse_occurred_at, record_usage, unknown_users
+from .plan_catalog import get_catalog
+from .quotas import check_call_admission, end_call
+from .rollups import dashboard_summary
+from .subscription_history import user_timeline
+from .webhook_payload import loads
+
+def serialize_plan(plan):
+    return {
+        'id': plan.id,
+        'name': plan.name,
+        'description': plan.description,
+        'price': str(plan.price),
+        'monthly_price': str(plan.monthly_price),
+        'currency': plan.currency,
+        'billing_interval': plan.billing_interval,
+        'stripe_price_id': plan.stripe_price_id,
+        'features': list(plan.features),
+        'limits': dict(plan.limits),
+        'is_popular': plan.is_popular,
+    }
+
+@require_GET
+def plans_list(request):
+    """Active plans served from the in-memory catalog (no database query)"""
+    catalog = get_catalog()
+    # A content hash, so every process gives the same plans the same ETag
+    etag = f'"plans-{catalog.digest}"'
+
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified()
+
+    response = JsonResponse({'plans': [serialize_plan(plan) for plan in catalog.active]})
+    response['ETag'] = etag
+    return response
+
+def parse_day(value, default):
+    return date.fromisoformat(value) if value else default
+
+@require_GET
+def billing_dashboard(request):
+    """MRR, revenue, past-due and trial numbers for staff, served from the billing rollups"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+
+    today = timezone.localdate()
+    try:
+        # Defaults to the current calendar month
+        start = parse_day(request.GET.get('start'), today.replace(day=1))
+        end = parse_day(request.GET.get('end'), today)
+        trial_days = int(request.GET.get('trial_days', 7))
+    except ValueError:
+        return JsonResponse({'error': 'start/end must be YYYY-MM-DD and trial_days an integer'}, status=400)
+
+    # JsonResponse's encoder turns dates and Decimals into strings
+    return JsonResponse(dashboard_summary(start, end, trial_days))
+
+@require_GET
+def analytics_dashboard(request):
+    """Churn, cohort retention, MRR movement and LTV for staff (cached per day)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+
+    try:
+        months = int(request.GET.get('months', 12))
+    except ValueError:
+        months = 0
+    if not 1 <= months <= 60:
+        return JsonResponse({'error': 'months must be an integer between 1 and 60'}, status=400)
+
+    return JsonResponse(billing_analytics(
+        months=months,
+        currency=request.GET.get('currency', 'usd').lower(),
+        refresh=request.GET.get('refresh') == '1',
+    ))
+
+def ingest_authorized(request):
+    """Bearer token check for service-to-service usage ingestion (USAGE_INGEST_API_KEY)"""
+    api_key = getattr(settings, 'USAGE_INGEST_API_KEY', None)
+    header = request.headers.get('Authorization', '')
+    return bool(api_key) and header.startswith('Bearer ') and hmac.compare_digest(header[7:], api_key)
+
+def parse_usage_event(event):
+    """Validate one ingested event; returns record_usage() arguments"""
+    if not isinstance(event, dict):
+        raise ValueError('each event must be an object')
+    metrics = getattr(settings, 'USAGE_METRICS', (DEFAULT_METRIC,))
+    metric = event.get('metric', DEFAULT_METRIC)
+    if metric not in metrics:
+        raise ValueError(f"unknown metric {metric!r}")
+
+    quantity = Decimal(str(event.get('quantity', event.get('minutes'))))
+    if not quantity.is_finite() or quantity <= 0:
+        raise ValueError('quantity must be a positive number')
+
+    return int(event['user_id']), quantity, metric, parse_occurred_at(event.get('occurred_at'))
+
+@csrf_exempt
+@require_POST
+def usage_events(request):
+    """
+    Ingest a batch of usage events: {"events": [{"user_id": 1, "minutes": 3.5}, ...]}.
+
+    Events are buffered in memory and written in batches; the only query checks that the
+    batch's users exist.
+    """
+    if not ingest_authorized(request):
+        return JsonResponse({'error': 'Invalid API key'}, status=401)
+
+    try:
+        events = loads(request.body)['events']
+        if len(events) > getattr(settings, 'USAGE_INGEST_MAX_BATCH', 1000):
+            return JsonResponse({'error': 'Too many events in one batch'}, status=413)
+        # Validate the whole batch before recording any of it
+        parsed = [parse_usage_event(event) for event in events]
+    except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+        return JsonResponse({'error': f'Invalid usage events: {e}'}, status=400)
+
+    # Buffered usage for a missing user could never be written
+    unknown = unknown_users(user_id for user_id, _, _, _ in parsed)
+    if unknown:
+        return JsonResponse({'error': f'Unknown user_id: {", ".join(map(str, sorted(unknown)))}'}, status=400)
+
+    for user_id, quantity, metric, occurred_at in parsed:
+        record_usage(user_id, quantity, metric, occurred_at)
+
+    return JsonResponse({'accepted': len(parsed)}, status=202)
+
+@require_GET
+def usage_summary(request):
+    """The signed-in user's usage in the current billing period against their plan limit"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    return JsonResponse(current_usage(request.user.id, request.GET.get('metric', DEFAULT_METRIC)))
+
+@require_GET
+def invoice_history(request):
+    """The signed-in user's invoices, newest first; pass `next_cursor` back as ?cursor= for the next page"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        limit = int(request.GET.get('limit', 25))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= 100:
+        return JsonResponse({'error': 'limit must be an integer between 1 and 100'}, status=400)
+
+    try:
+        page = invoice_page(request.user.id, request.GET.get('cursor'), limit)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+
+    # Stripe ids only; row ids are for the cursor
+    for invoice in page['invoices']:
+        del invoice['id']
+    return JsonResponse(page)
+
+@require_GET
+def subscription_history(request):
+    """Plan and status changes of the signed-in user's subscriptions, newest first (?subscription=sub_...)"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        limit = int(request.GET.get('limit', 100))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= 500:
+        return JsonResponse({'error': 'limit must be an integer between 1 and 500'}, status=400)
+
+    timeline = user_timeline(request.user.id, request.GET.get('subscription'), limit)
+    for entry in timeline:
+        entry['subscription'] = entry.pop('subscription__stripe_subscription_id')
+    return JsonResponse({'history': timeline})
+
+@csrf_exempt
+@require_POST
+def call_admission(request):
+    """
+    Ask whether a user may start an outbound call: {"user_id": 1, "agents": 2}.
+
+    Answered from cached entitlements and quota counters. An admitted call holds a
+    concurrent-call slot until it is released through call_release.
+    """
+    if not ingest_authorized(request):
+        return JsonResponse({'error': 'Invalid API key'}, status=401)
+
+    try:
+        body = loads(request.body)
+        if not isinstance(body, dict):
+            raise TypeError('the body must be a JSON object')
+        user_id = int(body['user_id'])
+        agents = int(body['agents']) if body.get('agents') is not None else None
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid admission request: {e}'}, status=400)
+
+    admission = check_call_admission(user_id, agents)
+    return JsonResponse(
+        {'allowed': admission.allowed, 'reason': admission.reason, 'minutes_remaining': admission.minutes_remaining},
+        status=200 if admission.allowed else 429,
+    )
+
+@csrf_exempt
+@require_POST
+def call_release(request):
+    """Release the concurrent-call slot of an admitted call once it ends: {"user_id": 1}"""
+    if not ingest_authorized(request):
+        return JsonResponse({'error': 'Invalid API key'}, status=401)
+
+    try:
+        user_id = int(loads(request.body)['user_id'])
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({'error': f'Invalid release request: {e}'}, status=400)
+
+    end_call(user_id)
+    return JsonResponse({'released': True})
@@ -0,0 +1,137 @@
+# webhook_logging.py - Structured, sampled logging that keeps file I/O off the webhook request path
+from contextlib import contextmanager
+from django.conf import settings
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import zlib
+
+# (event_id, event_type, sampled) of the delivery being handled; contextvars follow it
+# into sync_to_async handler threads and stay separate per ASGI request
+current_event = contextvars.ContextVar('webhook_event', default=None)
+
+# LogRecord attributes that are not key/value fields
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+def sample_rate(event_type):
+    """Share of `event_type` events whose INFO lines are kept (STRIPE_WEBHOOK_LOG_SAMPLING)"""
+    rates = getattr(settings, 'STRIPE_WEBHOOK_LOG_SAMPLING', None) or {}
+    return rates.get(event_type, rates.get('*', 1.0))
+
+def is_sampled(event_id, rate):
+    """Decided from the event id, so every line of an event (in every process) is kept or none"""
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    return zlib.crc32(event_id.encode('utf-8')) < rate * 2 ** 32
+
+def bind_event(event_id, event_type):
+    """Attach an event to the log records of this request; returns a token for unbind_event()"""
+    return current_event.set((event_id, event_type, is_sampled(event_id, sample_rate(event_type))))
+
+def unbind_event(token):
+    if token is not None:
+        current_event.reset(token)
+
+@contextmanager
+def event_logging(event_id, event_type):
+    token = bind_event(event_id, event_type)
+    try:
+        yield
+    finally:
+        unbind_event(token)
+
+
+class EventContextFilter(logging.Filter):
+    """Add event_id/event_type to records and drop unsampled INFO/DEBUG; warnings and errors always pass"""
+
+    def filter(self, record):
+        context = current_event.get()
+        if context is None:
+            return True
+        record.event_id, record.event_type, sampled = context
+        return sampled or record.levelno >= logging.WARNING
+
+
+def quote(value):
+    value = str(value)
+    if not value or any(char in value for char in ' "=\n'):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class KeyValueFormatter(logging.Formatter):
+    """
+    One `key=value` line per record: time, level, logger, msg, then event_id, event_type
+    and anything passed in `extra`. Tracebacks follow on the next lines.
+    """
+
+    def format(self, record):
+        record.message = record.getMessage()
+        fields = [
+            f"ts={self.formatTime(record)}",
+            f"level={record.levelname}",
+            f"logger={record.name}",
+            f"msg={quote(record.message)}",
+        ]
+        fields += [f"{key}={quote(value)}" for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES]
+        line = ' '.join(fields)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+
+class BackgroundFileHandler(logging.handlers.QueueHandler):
+    """
+    FileHandler whose formatting and writes happen on a listener thread.
+
+    Logging a record costs a queue put. Messages are formatted later, so pass values
+    as %-style arguments rather than objects that may still change. When the queue is
+    full, INFO/DEBUG records are dropped (counted in `dropped`); warnings and errors
+    wait for space.
+    """
+
+    def __init__(self, filename, queue_size=10000, encoding=None):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.FileHandler(filename, encoding=encoding, delay=True)
+        self.listener = logging.handlers.QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.dropped = 0
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        # The listener thread formats, with the file handler's formatter
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # The queue stays in-process, so nothing has to be pickled or formatted here
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record)
+            else:
+                self.dropped += 1
+
+    def close(self):
+        if self.listener:
+            # Writes out everything still queued
+            self.listener.stop()
+            self.listener = None
+            if self.dropped:
+                self.target.handle(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': '⚠️ %d log records dropped while the queue was full', 'args': (self.dropped,),
+                }))
+            self.target.close()
+        super().close()
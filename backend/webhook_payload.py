@@ -0,0 +1,85 @@
+# webhook_payload.py - Fast signature verification and decoding for Stripe webhooks
+import hashlib
+import hmac
+import json
+import time
+
+import stripe
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # orjson is optional; the stdlib parser is the fallback
+    loads = json.loads
+
+# Same default tolerance as stripe.Webhook.construct_event
+DEFAULT_TOLERANCE = 300
+
+class WebhookEnvelope:
+    """Lightweight view of a Stripe event exposing only what dispatch and the handlers read"""
+
+    __slots__ = ('id', 'type', 'created', 'object', 'payload')
+
+    def __init__(self, id, type, created, object, payload=None):
+        self.id = id
+        self.type = type
+        self.created = created
+        self.object = object
+        self.payload = payload
+
+    @classmethod
+    def from_event(cls, event):
+        """Wrap a decoded event dict or a stripe.Event"""
+        return cls(event['id'], event['type'], event.get('created'), event['data']['object'], event)
+
+    def __repr__(self):
+        return f"<WebhookEnvelope {self.type} {self.id}>"
+
+def verify_signature(payload, sig_header, secret, tolerance=DEFAULT_TOLERANCE):
+    """Check the Stripe-Signature header (v1 HMAC-SHA256) against the raw request body"""
+    if not sig_header:
+        raise stripe.error.SignatureVerificationError('No signature header', sig_header, payload)
+
+    timestamp = None
+    signatures = []
+    for item in sig_header.split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            timestamp = value
+        elif key == 'v1':
+            signatures.append(value)
+
+    if not timestamp or not signatures:
+        raise stripe.error.SignatureVerificationError(
+            'Unable to extract timestamp and signatures from header', sig_header, payload
+        )
+
+    signed_payload = timestamp.encode() + b'.' + payload
+    expected = hmac.new(secret.encode(), signed_payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise stripe.error.SignatureVerificationError(
+            'No signatures found matching the expected signature for payload', sig_header, payload
+        )
+
+    try:
+        timestamp = int(timestamp)
+    except ValueError:
+        raise stripe.error.SignatureVerificationError('Invalid timestamp in header', sig_header, payload)
+
+    if tolerance and timestamp < time.time() - tolerance:
+        raise stripe.error.SignatureVerificationError(
+            'Timestamp outside the tolerance zone', sig_header, payload
+        )
+
+def decode_event(payload, sig_header, secret, tolerance=DEFAULT_TOLERANCE):
+    """
+    Verify and decode a webhook body without building a stripe.Event object graph.
+
+    Raises stripe.error.SignatureVerificationError for bad signatures and ValueError
+    for malformed JSON, matching stripe.Webhook.construct_event.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    verify_signature(payload, sig_header, secret, tolerance)
+    return WebhookEnvelope.from_event(loads(payload))
@@ -0,0 +1,104 @@
+# webhook_worker.py - Background processing for queued Stripe webhook events
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+import logging
+import time
+
+from .coalescing import apply_burst, burst_filter, claimable, split_batch
+from .idempotency import release_event, stale_claim_cutoff
+from .payload_store import load_event
+from .webhook_logging import event_logging
+from .webhooks import dispatch_event
+
+logger = logging.getLogger(__name__)
+
+def claim_pending_events(limit):
+    """Atomically move up to `limit` pending events to processing and return them"""
+    from .models import WebhookEvent
+
+    with transaction.atomic():
+        # Rows locked by another worker's claim are skipped rather than waited on
+        pending = WebhookEvent.objects.select_for_update(skip_locked=True).filter(status='pending')
+        claimed = list(
+            pending.filter(claimable())
+            .order_by('created_at')
+            .values_list('id', 'event_type', 'subscription_id')[:limit]
+        )
+        claimed_ids = [pk for pk, _, _ in claimed]
+
+        # Subscription updates bring the rest of their burst along to be coalesced
+        burst = burst_filter([(event_type, subscription_id) for _, event_type, subscription_id in claimed])
+        if burst is not None:
+            claimed_ids += pending.filter(burst).exclude(id__in=claimed_ids).values_list('id', flat=True)
+
+        if claimed_ids:
+            WebhookEvent.objects.filter(id__in=claimed_ids).update(
+                status='processing',
+                processed_at=timezone.now()
+            )
+
+    return list(WebhookEvent.objects.filter(id__in=claimed_ids).select_related('payload').order_by('created_at'))
+
+def process_webhook_event(webhook_event):
+    """Run the regular handler for one claimed event"""
+    from .models import WebhookEvent
+
+    try:
+        with event_logging(webhook_event.stripe_event_id, webhook_event.event_type):
+            dispatch_event(load_event(webhook_event))
+
+    except Exception as e:
+        logger.error(f"❌ Error processing queued webhook {webhook_event.stripe_event_id}: {e}", exc_info=True)
+        WebhookEvent.objects.filter(id=webhook_event.id).update(
+            status='error',
+            error_message=str(e),
+            processed_at=timezone.now()
+        )
+        release_event(webhook_event.stripe_event_id)
+
+    finally:
+        # Each pool thread owns its own connection
+        connection.close()
+
+def requeue_stale_events():
+    """Return events stuck in processing (e.g. after a worker crash) to the queue"""
+    from .models import WebhookEvent
+
+    requeued = WebhookEvent.objects.filter(status='processing', processed_at__lt=stale_claim_cutoff()).update(status='pending')
+    if requeued:
+        logger.warning(f"⚠️ Requeued {requeued} stale webhook events")
+    return requeued
+
+def drain_pending_events(executor, batch_size):
+    """Claim one batch of pending events and process it on the pool; returns the batch size"""
+    events = claim_pending_events(batch_size)
+    if events:
+        singles, bursts = split_batch(events)
+        futures = [executor.submit(process_webhook_event, event) for event in singles]
+        futures += [executor.submit(apply_burst, burst) for burst in bursts]
+        # Wait so the batch finishes before the next claim
+        for future in futures:
+            future.result()
+        logger.info(f"✅ Processed {len(events)} queued webhook events")
+    return len(events)
+
+def run_worker(max_workers=None, batch_size=None, poll_interval=None, once=False):
+    """Drain the webhook queue until interrupted (or until empty when `once` is set)"""
+    max_workers = max_workers or getattr(settings, 'STRIPE_WEBHOOK_WORKERS', 4)
+    batch_size = batch_size or getattr(settings, 'STRIPE_WEBHOOK_BATCH_SIZE', 50)
+    poll_interval = poll_interval or getattr(settings, 'STRIPE_WEBHOOK_POLL_INTERVAL', 1.0)
+
+    logger.info(f"🚀 Webhook worker started ({max_workers} threads, batch size {batch_size})")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            close_old_connections()
+            requeue_stale_events()
+            processed = drain_pending_events(executor, batch_size)
+
+            if once and not processed:
+                break
+            if not processed:
+                time.sleep(poll_interval)
@@ -6,14 +6,28 @@ from django.conf import settings
 import stripe
 import json
 import logging
+from contextlib import contextmanager
 from datetime import datetime
+from decimal import Decimal
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from .entitlements import ENTITLEMENT_FIELDS, invalidate_users
+from .idempotency import claim_event, mark_event_processed, release_event
+from .plan_catalog import get_catalog
+from .rollups import INVOICE_ROLLUP_FIELDS, invoice_state, record_invoice_change, record_subscription_change
+from .stripe_client import configure_stripe
+from .subscription_history import history_source, record_transition
+from .webhook_logging import bind_event, unbind_event
+from .webhook_payload import WebhookEnvelope, decode_event
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Set Stripe API key
-stripe.api_key = settings.STRIPE_SECRET_KEY
+# Set the Stripe API key and the pooled HTTP client
+configure_stripe()
 
 @csrf_exempt
 @require_POST
@@ -29,384 +43,525 @@ def stripe_webhook(request):
         logger.error('❌ STRIPE_WEBHOOK_SECRET not configured')
         return HttpResponseBadRequest('Webhook secret not configured')
     
+    fast_decode = getattr(settings, 'STRIPE_WEBHOOK_FAST_DECODE', False)
+    log_context = None
+    
     try:
         # Verify webhook signature
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, endpoint_secret
-        )
+        if fast_decode:
+            event = decode_event(payload, sig_header, endpoint_secret)
+        else:
+            event = WebhookEnvelope.from_event(stripe.Webhook.construct_event(
+                payload, sig_header, endpoint_secret
+            ))
         
-        logger.info(f"📡 Received Stripe webhook: {event['type']} - {event['id']}")
+        # Tag this request's log lines with the event and apply log sampling
+        log_context = bind_event(event.id, event.type)
+        logger.info("📡 Received Stripe webhook: %s - %s", event.type, event.id)
         
-        # Handle different event types
-        event_type = event['type']
-        event_data = event['data']['object']
+        if getattr(settings, 'STRIPE_WEBHOOK_ASYNC_PROCESSING', False):
+            # Ack immediately; a webhook worker runs the handlers later
+            enqueue_webhook_event(event, event.payload if fast_decode else json.loads(payload))
+            return HttpResponse('Webhook queued', status=200)
         
-        if event_type == 'payment_intent.succeeded':
-            handle_payment_succeeded(event_data, event['id'])
-            
-        elif event_type == 'payment_intent.payment_failed':
-            handle_payment_failed(event_data, event['id'])
-            
-        elif event_type == 'customer.subscription.created':
-            handle_subscription_created(event_data, event['id'])
-            
-        elif event_type == 'customer.subscription.updated':
-            handle_subscription_updated(event_data, event['id'])
-            
-        elif event_type == 'customer.subscription.deleted':
-            handle_subscription_cancelled(event_data, event['id'])
-            
-        elif event_type == 'invoice.payment_succeeded':
-            handle_invoice_paid(event_data, event['id'])
-            
-        elif event_type == 'invoice.payment_failed':
-            handle_invoice_failed(event_data, event['id'])
-            
-        elif event_type == 'customer.subscription.trial_will_end':
-            handle_trial_ending(event_data, event['id'])
-            
-        else:
-            logger.info(f"⚠️ Unhandled event type: {event_type}")
+        # Keep the raw event for replays and debugging
+        raw_event = None
+        if getattr(settings, 'STRIPE_WEBHOOK_STORE_PAYLOADS', True):
+            raw_event = event.payload if fast_decode else json.loads(payload)
+        
+        # Stripe redelivers events; skip any we have already claimed
+        if not claim_event(event.id, event.type, event=raw_event):
+            logger.info("↩️ Duplicate webhook ignored: %s", event.id)
+            return HttpResponse('Duplicate webhook ignored', status=200)
+        
+        dispatch_event(event)
             
-        logger.info(f"✅ Successfully processed webhook: {event['id']}")
+        logger.info("✅ Successfully processed webhook: %s", event.id)
         return HttpResponse('Webhook processed successfully', status=200)
         
     except ValueError as e:
-        logger.error(f"❌ Invalid webhook payload: {e}")
+        logger.error("❌ Invalid webhook payload: %s", e)
         return HttpResponseBadRequest("Invalid payload")
         
     except stripe.error.SignatureVerificationError as e:
-        logger.error(f"❌ Invalid webhook signature: {e}")
+        logger.error("❌ Invalid webhook signature: %s", e)
         return HttpResponseBadRequest("Invalid signature")
         
     except Exception as e:
-        logger.error(f"❌ Webhook processing error: {e}", exc_info=True)
+        logger.error("❌ Webhook processing error: %s", e, exc_info=True)
         return HttpResponseBadRequest(f"Webhook error: {str(e)}")
+    
+    finally:
+        unbind_event(log_context)
 
-def handle_payment_succeeded(payment_intent, event_id):
-    """Handle successful payment - updates subscription status"""
-    logger.info(f"✅ Processing payment success: {payment_intent['id']}")
+def dispatch_event(event):
+    """Route a verified Stripe event to its handler inside a single transaction"""
+    if not isinstance(event, WebhookEnvelope):
+        event = WebhookEnvelope.from_event(event)
+    
+    event_type = event.type
+    event_id = event.id
+    
+    handler = EVENT_HANDLERS.get(event_type)
+    
+    if handler is None:
+        logger.info("⚠️ Unhandled event type: %s", event_type)
+        mark_event_processed(event_id)
+        return
     
     try:
-        # Extract metadata
-        metadata = payment_intent.get('metadata', {})
-        subscription_id = metadata.get('subscription_id')
-        package_id = metadata.get('package_id')
-        action_type = metadata.get('action_type')
-        
-        logger.info(f"Payment metadata: subscription_id={subscription_id}, package_id={package_id}, action_type={action_type}")
-        
-        if subscription_id:
-            # Import here to avoid circular imports
-            from .models import UserSubscription
-            
-            try:
-                subscription = UserSubscription.objects.get(id=subscription_id)
-                
-                # Update subscription based on action type
-                if action_type == 'subscription_purchase':
-                    subscription.status = 'active'
-                    subscription.stripe_payment_intent_id = payment_intent['id']
-                    
-                elif action_type in ['upgrade', 'downgrade']:
-                    subscription.status = 'active'
-                    if package_id:
-                        # Update plan details
-                        subscription.plan_id = package_id
-                        # Note: You might want to fetch plan details from your Plan model
-                        
-                subscription.last_payment_date = timezone.now()
-                subscription.save()
-                
-                logger.info(f"✅ Subscription {subscription_id} updated successfully")
-                
-                # Log webhook event
-                log_webhook_event(event_id, 'payment_intent.succeeded', subscription_id, 'success')
+        with query_budget(event_type):
+            # History is written as history_source exits, before the commit
+            with transaction.atomic(), history_source(event_id, event_type):
+                subscription_id = handler(event.object, event_id, event.created)
+                log_webhook_event(event_id, event_type, subscription_id, 'success')
                 
-            except UserSubscription.DoesNotExist:
-                logger.error(f"❌ Subscription {subscription_id} not found")
-                
-        else:
-            logger.warning("⚠️ No subscription_id in payment metadata")
-            
     except Exception as e:
-        logger.error(f"❌ Error processing payment success: {e}", exc_info=True)
-        log_webhook_event(event_id, 'payment_intent.succeeded', subscription_id, 'error', str(e))
+        logger.error("❌ Error processing %s: %s", event_type, e, exc_info=True)
+        log_webhook_event(event_id, event_type, None, 'error', str(e))
 
-def handle_payment_failed(payment_intent, event_id):
-    """Handle failed payment"""
-    logger.warning(f"❌ Processing payment failure: {payment_intent['id']}")
+def queued_subscription_id(event):
+    """Stripe subscription a queued subscription event belongs to; the worker coalesces by it"""
+    return event.object.get('id') if event.type.startswith('customer.subscription.') else None
+
+def enqueue_webhook_event(event, payload):
+    """Persist a verified event as a pending WebhookEvent for the webhook worker"""
+    if claim_event(event.id, event.type, status='pending', event=payload, subscription_id=queued_subscription_id(event)):
+        logger.info("📥 Queued webhook %s for processing", event.id)
+    else:
+        # Stripe redelivered an event we already hold
+        logger.info("↩️ Webhook %s already queued", event.id)
+
+@contextmanager
+def count_queries():
+    """Collect the SQL run on this thread's connection, leaving out transaction control"""
+    executed = []
     
-    try:
-        metadata = payment_intent.get('metadata', {})
-        subscription_id = metadata.get('subscription_id')
+    def record(execute, sql, params, many, context):
+        # Transaction control depends on the caller and the backend, not on the handler
+        if sql.split(' ', 1)[0].upper() not in TRANSACTION_STATEMENTS:
+            executed.append(sql)
+        return execute(sql, params, many, context)
+    
+    with connection.execute_wrapper(record):
+        yield executed
+
+@contextmanager
+def query_budget(event_type):
+    """Warn when handling an event takes more queries than QUERY_BUDGETS allows"""
+    if not getattr(settings, 'STRIPE_WEBHOOK_CHECK_QUERY_BUDGETS', settings.DEBUG):
+        yield
+        return
+    
+    with count_queries() as executed:
+        yield
+    
+    budget = QUERY_BUDGETS.get(event_type)
+    if budget is not None and len(executed) > budget:
+        logger.warning("⚠️ %s used %s queries (budget %s)", event_type, len(executed), budget)
+
+def from_timestamp(value):
+    """Convert a Stripe unix timestamp to an aware datetime"""
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value else None
+
+def subscription_fields(subscription):
+    """Map a Stripe subscription object to UserSubscription field values"""
+    fields = {
+        'status': subscription['status'],
+        'current_period_start': from_timestamp(subscription['current_period_start']),
+        'current_period_end': from_timestamp(subscription['current_period_end']),
+        'cancel_at_period_end': subscription.get('cancel_at_period_end', False),
+    }
+    
+    if subscription.get('canceled_at'):
+        fields['canceled_at'] = from_timestamp(subscription['canceled_at'])
+    
+    # Extract plan information from subscription items
+    if subscription.get('items', {}).get('data'):
+        fields['stripe_price_id'] = subscription['items']['data'][0]['price']['id']
+        fields['stripe_subscription_item_id'] = subscription['items']['data'][0]['id']
         
-        if subscription_id:
-            from .models import UserSubscription
-            
-            try:
-                subscription = UserSubscription.objects.get(id=subscription_id)
-                subscription.status = 'past_due'
-                subscription.save()
-                
-                logger.info(f"⚠️ Subscription {subscription_id} marked as past_due")
-                log_webhook_event(event_id, 'payment_intent.payment_failed', subscription_id, 'success')
-                
-            except UserSubscription.DoesNotExist:
-                logger.error(f"❌ Subscription {subscription_id} not found")
-                
-    except Exception as e:
-        logger.error(f"❌ Error processing payment failure: {e}", exc_info=True)
-        log_webhook_event(event_id, 'payment_intent.payment_failed', subscription_id, 'error', str(e))
+        # Map the Stripe price to our plan without a query
+        plan = get_catalog().for_price(fields['stripe_price_id'])
+        if plan:
+            fields['plan_id'] = str(plan.id)
+    
+    return fields
 
-def handle_subscription_created(subscription, event_id):
-    """Handle new subscription created"""
-    logger.info(f"➕ Processing subscription created: {subscription['id']}")
+def payment_succeeded_fields(payment_intent):
+    """Map a successful payment intent to UserSubscription field values"""
+    metadata = payment_intent.get('metadata', {})
+    action_type = metadata.get('action_type')
+    package_id = metadata.get('package_id')
     
-    try:
-        from .models import UserSubscription
+    fields = {'last_payment_date': timezone.now()}
+    
+    # Update subscription based on action type
+    if action_type == 'subscription_purchase':
+        fields['status'] = 'active'
+        fields['stripe_payment_intent_id'] = payment_intent['id']
         
-        # Find subscription by Stripe subscription ID
-        try:
-            user_subscription = UserSubscription.objects.get(
-                stripe_subscription_id=subscription['id']
-            )
-            
-            # Update subscription details from Stripe
-            user_subscription.status = subscription['status']
-            user_subscription.current_period_start = datetime.fromtimestamp(
-                subscription['current_period_start'], tz=timezone.utc
-            )
-            user_subscription.current_period_end = datetime.fromtimestamp(
-                subscription['current_period_end'], tz=timezone.utc
-            )
-            user_subscription.cancel_at_period_end = subscription.get('cancel_at_period_end', False)
-            
-            # Extract plan information from subscription items
-            if subscription.get('items', {}).get('data'):
-                price_id = subscription['items']['data'][0]['price']['id']
-                user_subscription.stripe_price_id = price_id
-                
-            user_subscription.save()
-            
-            logger.info(f"✅ Subscription {subscription['id']} updated successfully")
-            log_webhook_event(event_id, 'customer.subscription.created', user_subscription.id, 'success')
-            
-        except UserSubscription.DoesNotExist:
-            logger.warning(f"⚠️ UserSubscription not found for Stripe subscription {subscription['id']}")
-            
-    except Exception as e:
-        logger.error(f"❌ Error processing subscription created: {e}", exc_info=True)
-        log_webhook_event(event_id, 'customer.subscription.created', None, 'error', str(e))
+    elif action_type in ['upgrade', 'downgrade']:
+        fields['status'] = 'active'
+        if package_id:
+            # Update plan details
+            fields['plan_id'] = package_id
+            # Limits follow the price, so take the new plan's price from the catalog too
+            plan = get_catalog().get(package_id)
+            if plan:
+                fields['stripe_price_id'] = plan.stripe_price_id
+    
+    return fields
 
-def handle_subscription_updated(subscription, event_id):
-    """Handle subscription changes (plan changes, cancellations, etc.)"""
-    logger.info(f"🔄 Processing subscription updated: {subscription['id']}")
+def cancellation_fields(subscription):
+    """Map a deleted Stripe subscription to UserSubscription field values"""
+    fields = {'status': 'canceled'}
+    if subscription.get('canceled_at'):
+        fields['canceled_at'] = from_timestamp(subscription['canceled_at'])
+    return fields
+
+def invoice_price_id(invoice):
+    """Stripe price of the invoice's first line item, if any"""
+    for line in (invoice.get('lines') or {}).get('data') or []:
+        if line.get('price'):
+            return line['price']['id']
+    return ''
+
+def invoice_user(subscription_id, customer_id):
+    """
+    The invoice's user: its subscription's, else the customer's newest subscription's.
     
-    try:
-        from .models import UserSubscription
+    Takes values or OuterRefs and returns an expression, so the lookup runs inside the
+    INSERT/UPDATE that stores the invoice instead of costing a query of its own.
+    """
+    from .models import UserSubscription
+    
+    by_subscription = (
+        UserSubscription.objects.filter(stripe_subscription_id=subscription_id)
+        .exclude(stripe_subscription_id='').order_by().values('user_id')[:1]
+    )
+    by_customer = (
+        UserSubscription.objects.filter(stripe_customer_id=customer_id)
+        .exclude(stripe_customer_id='').order_by('-created_at').values('user_id')[:1]
+    )
+    return Coalesce(Subquery(by_subscription), Subquery(by_customer))
+
+def invoice_row(invoice):
+    """Invoice field values shared by every invoice event"""
+    return {
+        'stripe_invoice_id': invoice['id'],
+        'stripe_customer_id': invoice.get('customer') or '',
+        'stripe_subscription_id': invoice.get('subscription') or '',
+        'user_id': invoice_user(invoice.get('subscription') or '', invoice.get('customer') or ''),
+        'stripe_price_id': invoice_price_id(invoice),
+        'customer_email': invoice.get('customer_email') or '',
+        'currency': invoice.get('currency', 'usd'),
+    }
+
+def invoice_paid_fields(invoice):
+    """Invoice field values for a paid invoice"""
+    return {
+        'status': 'paid',
+        'amount': Decimal(invoice['amount_paid']) / 100,  # Convert from cents
+        'paid_at': from_timestamp(invoice.get('status_transitions', {}).get('paid_at')) or timezone.now(),
+    }
+
+def invoice_failed_fields(invoice):
+    """Invoice field values for a failed invoice payment"""
+    return {
+        'status': 'payment_failed',
+        'amount': Decimal(invoice['amount_due']) / 100,
+        'payment_failed_at': timezone.now(),
+    }
+
+# Fields an existing invoice row takes from each event (the amount only changes once paid;
+# the user only fills in a missing one, see invoice_update_fields)
+INVOICE_PAID_UPDATE_FIELDS = ['status', 'amount', 'paid_at', 'user']
+INVOICE_FAILED_UPDATE_FIELDS = ['status', 'payment_failed_at', 'user']
+
+def invoice_update_fields(update_fields, stored_user_id):
+    """
+    `update_fields` for an existing invoice row whose user_id is `stored_user_id`.
+    
+    The upsert writes the looked-up user as is, and the lookup finds none once the
+    subscription is gone, so a user the row already has (e.g. backfilled) is left alone.
+    """
+    if stored_user_id is None:
+        return update_fields
+    return [name for name in update_fields if name != 'user']
+
+def update_subscription(lookup, event_created=None, **fields):
+    """
+    Apply field changes with a single UPDATE; returns the number of rows changed.
+    
+    When `event_created` (the Stripe event's `created` timestamp) is given, rows that
+    already reflect a newer event are left untouched, so late deliveries are dropped.
+    
+    Every write bumps `version`. Changes to entitlement fields (status, price, plan,
+    period) also need the row's previous values, for the plan rollups and its user's
+    cached entitlement, so they are a compare-and-swap on the version that was read and
+    are retried (STRIPE_WEBHOOK_UPDATE_RETRIES) when a concurrent delivery for the same
+    subscription got there first. Nothing is locked between the read and the write.
+    """
+    from .models import UserSubscription
+    
+    subscriptions = UserSubscription.objects.filter(**lookup)
+    
+    if event_created:
+        event_time = from_timestamp(event_created)
+        subscriptions = subscriptions.filter(
+            Q(last_event_created_at__isnull=True) | Q(last_event_created_at__lte=event_time)
+        )
+        fields['last_event_created_at'] = event_time
+    
+    # update() bypasses auto_now, so stamp updated_at explicitly
+    changes = dict(fields, updated_at=timezone.now(), version=F('version') + 1)
+    
+    if not ENTITLEMENT_FIELDS.intersection(fields):
+        return subscriptions.update(**changes)
+    
+    user_id = compare_and_swap(subscriptions, changes, lookup)
+    if user_id is None:
+        return 0
+    invalidate_users([user_id])
+    return 1
+
+def compare_and_swap(subscriptions, changes, lookup):
+    """
+    Write `changes` only if the row is still at the version whose status/price was read.
+    
+    Returns the written row's user_id, or None when no row matched.
+    """
+    attempts = getattr(settings, 'STRIPE_WEBHOOK_UPDATE_RETRIES', 5)
+    
+    for attempt in range(attempts):
+        previous = subscriptions.values_list('id', 'user_id', 'status', 'stripe_price_id', 'plan_id', 'version').first()
+        if previous is None:
+            # Missing, or a newer event has been applied meanwhile
+            return None
         
-        try:
-            user_subscription = UserSubscription.objects.get(
-                stripe_subscription_id=subscription['id']
-            )
-            
-            # Update subscription details
-            old_status = user_subscription.status
-            user_subscription.status = subscription['status']
-            user_subscription.current_period_start = datetime.fromtimestamp(
-                subscription['current_period_start'], tz=timezone.utc
-            )
-            user_subscription.current_period_end = datetime.fromtimestamp(
-                subscription['current_period_end'], tz=timezone.utc
-            )
-            user_subscription.cancel_at_period_end = subscription.get('cancel_at_period_end', False)
-            
-            # Handle cancellation
-            if subscription.get('canceled_at'):
-                user_subscription.canceled_at = datetime.fromtimestamp(
-                    subscription['canceled_at'], tz=timezone.utc
-                )
-            
-            # Handle plan changes
-            if subscription.get('items', {}).get('data'):
-                new_price_id = subscription['items']['data'][0]['price']['id']
-                if new_price_id != user_subscription.stripe_price_id:
-                    logger.info(f"Plan changed from {user_subscription.stripe_price_id} to {new_price_id}")
-                    user_subscription.stripe_price_id = new_price_id
-                    # Update plan details if needed
-                    
-            user_subscription.save()
-            
-            logger.info(f"✅ Subscription {subscription['id']} updated: {old_status} -> {subscription['status']}")
-            log_webhook_event(event_id, 'customer.subscription.updated', user_subscription.id, 'success')
-            
-        except UserSubscription.DoesNotExist:
-            logger.error(f"❌ UserSubscription not found for Stripe subscription {subscription['id']}")
-            
-    except Exception as e:
-        logger.error(f"❌ Error processing subscription updated: {e}", exc_info=True)
-        log_webhook_event(event_id, 'customer.subscription.updated', None, 'error', str(e))
+        pk, user_id, status, price_id, plan_id, version = previous
+        if subscriptions.filter(version=version).update(**changes):
+            current = (changes.get('status', status), changes.get('stripe_price_id', price_id))
+            record_subscription_change((status, price_id), current)
+            record_transition(pk, (status, price_id, plan_id), current + (changes.get('plan_id', plan_id),))
+            return user_id
+        logger.info("🔁 Subscription %s changed concurrently, retrying (%s/%s)", lookup, attempt + 1, attempts)
+    
+    raise DatabaseError(f"Subscription {lookup} kept changing concurrently; gave up after {attempts} attempts")
 
-def handle_subscription_cancelled(subscription, event_id):
+def handle_payment_succeeded(payment_intent, event_id, event_created=None):
+    """Handle successful payment - updates subscription status"""
+    logger.info("✅ Processing payment success: %s", payment_intent['id'])
+    
+    # Extract metadata
+    metadata = payment_intent.get('metadata', {})
+    subscription_id = metadata.get('subscription_id')
+    package_id = metadata.get('package_id')
+    action_type = metadata.get('action_type')
+    
+    logger.info("Payment metadata: subscription_id=%s, package_id=%s, action_type=%s", subscription_id, package_id, action_type)
+    
+    if not subscription_id:
+        logger.warning("⚠️ No subscription_id in payment metadata")
+        return None
+    
+    if update_subscription({'id': subscription_id}, **payment_succeeded_fields(payment_intent)):
+        logger.info("✅ Subscription %s updated successfully", subscription_id)
+    else:
+        logger.error("❌ Subscription %s not found", subscription_id)
+    
+    return subscription_id
+
+def handle_payment_failed(payment_intent, event_id, event_created=None):
+    """Handle failed payment"""
+    logger.warning("❌ Processing payment failure: %s", payment_intent['id'])
+    
+    metadata = payment_intent.get('metadata', {})
+    subscription_id = metadata.get('subscription_id')
+    
+    if not subscription_id:
+        return None
+    
+    if update_subscription({'id': subscription_id}, status='past_due'):
+        logger.info("⚠️ Subscription %s marked as past_due", subscription_id)
+    else:
+        logger.error("❌ Subscription %s not found", subscription_id)
+    
+    return subscription_id
+
+def handle_subscription_created(subscription, event_id, event_created=None):
+    """Handle new subscription created"""
+    logger.info("➕ Processing subscription created: %s", subscription['id'])
+    
+    # Find subscription by Stripe subscription ID and sync it from Stripe
+    if update_subscription(
+        {'stripe_subscription_id': subscription['id']},
+        event_created=event_created,
+        **subscription_fields(subscription)
+    ):
+        logger.info("✅ Subscription %s updated successfully", subscription['id'])
+    else:
+        logger.warning("⚠️ UserSubscription not found or newer state already applied for %s", subscription['id'])
+    
+    return subscription['id']
+
+def handle_subscription_updated(subscription, event_id, event_created=None):
+    """Handle subscription changes (plan changes, cancellations, etc.)"""
+    logger.info("🔄 Processing subscription updated: %s", subscription['id'])
+    
+    if update_subscription(
+        {'stripe_subscription_id': subscription['id']},
+        event_created=event_created,
+        **subscription_fields(subscription)
+    ):
+        logger.info("✅ Subscription %s updated: %s", subscription['id'], subscription['status'])
+    else:
+        logger.warning("⚠️ UserSubscription not found or newer state already applied for %s", subscription['id'])
+    
+    return subscription['id']
+
+def handle_subscription_cancelled(subscription, event_id, event_created=None):
     """Handle subscription cancellation"""
-    logger.info(f"🗑️ Processing subscription cancelled: {subscription['id']}")
+    logger.info("🗑️ Processing subscription cancelled: %s", subscription['id'])
     
-    try:
-        from .models import UserSubscription
-        
-        try:
-            user_subscription = UserSubscription.objects.get(
-                stripe_subscription_id=subscription['id']
-            )
-            
-            user_subscription.status = 'canceled'
-            if subscription.get('canceled_at'):
-                user_subscription.canceled_at = datetime.fromtimestamp(
-                    subscription['canceled_at'], tz=timezone.utc
-                )
-            
-            user_subscription.save()
-            
-            logger.info(f"✅ Subscription {subscription['id']} marked as canceled")
-            log_webhook_event(event_id, 'customer.subscription.deleted', user_subscription.id, 'success')
-            
-        except UserSubscription.DoesNotExist:
-            logger.error(f"❌ UserSubscription not found for Stripe subscription {subscription['id']}")
-            
-    except Exception as e:
-        logger.error(f"❌ Error processing subscription cancellation: {e}", exc_info=True)
-        log_webhook_event(event_id, 'customer.subscription.deleted', None, 'error', str(e))
+    if update_subscription(
+        {'stripe_subscription_id': subscription['id']},
+        event_created=event_created,
+        **cancellation_fields(subscription)
+    ):
+        logger.info("✅ Subscription %s marked as canceled", subscription['id'])
+    else:
+        logger.warning("⚠️ UserSubscription not found or newer state already applied for %s", subscription['id'])
+    
+    return subscription['id']
+
+def upsert_invoice(invoice, update_fields, **fields):
+    """Insert or update an Invoice row in a single statement and keep the rollups in step"""
+    from .models import Invoice
+    
+    row = dict(invoice_row(invoice), **fields)
+    previous = (
+        Invoice.objects.select_for_update()
+        .filter(stripe_invoice_id=invoice['id'])
+        .values('user_id', *INVOICE_ROLLUP_FIELDS)
+        .first()
+    )
+    if previous is not None:
+        update_fields = invoice_update_fields(update_fields, previous.pop('user_id'))
+    
+    Invoice.objects.bulk_create(
+        [Invoice(**row)],
+        update_conflicts=True,
+        unique_fields=['stripe_invoice_id'],
+        update_fields=update_fields + ['updated_at'],
+    )
+    record_invoice_change(previous, invoice_state(previous, row, update_fields))
 
-def handle_invoice_paid(invoice, event_id):
+def handle_invoice_paid(invoice, event_id, event_created=None):
     """Handle successful invoice payment"""
-    logger.info(f"💰 Processing invoice paid: {invoice['id']}")
+    logger.info("💰 Processing invoice paid: %s", invoice['id'])
     
-    try:
-        from .models import Invoice, UserSubscription
-        
-        # Create or update invoice record
-        invoice_obj, created = Invoice.objects.get_or_create(
-            stripe_invoice_id=invoice['id'],
-            defaults={
-                'customer_email': invoice.get('customer_email', ''),
-                'amount': invoice['amount_paid'] / 100,  # Convert from cents
-                'status': 'paid',
-                'currency': invoice.get('currency', 'usd'),
-                'paid_at': datetime.fromtimestamp(
-                    invoice['status_transitions']['paid_at'], tz=timezone.utc
-                ) if invoice.get('status_transitions', {}).get('paid_at') else timezone.now()
-            }
+    # Create or update invoice record
+    upsert_invoice(invoice, INVOICE_PAID_UPDATE_FIELDS, **invoice_paid_fields(invoice))
+    
+    # Update related subscription if exists
+    if invoice.get('subscription'):
+        update_subscription(
+            {'stripe_subscription_id': invoice['subscription']},
+            last_invoice_paid_at=timezone.now()
         )
-        
-        if not created:
-            invoice_obj.status = 'paid'
-            invoice_obj.amount = invoice['amount_paid'] / 100
-            invoice_obj.paid_at = datetime.fromtimestamp(
-                invoice['status_transitions']['paid_at'], tz=timezone.utc
-            ) if invoice.get('status_transitions', {}).get('paid_at') else timezone.now()
-            invoice_obj.save()
-        
-        # Update related subscription if exists
-        if invoice.get('subscription'):
-            try:
-                subscription = UserSubscription.objects.get(
-                    stripe_subscription_id=invoice['subscription']
-                )
-                subscription.last_invoice_paid_at = timezone.now()
-                subscription.save()
-            except UserSubscription.DoesNotExist:
-                pass
-        
-        action = 'created' if created else 'updated'
-        logger.info(f"✅ Invoice {invoice['id']} {action} successfully")
-        log_webhook_event(event_id, 'invoice.payment_succeeded', None, 'success')
-        
-    except Exception as e:
-        logger.error(f"❌ Error processing invoice payment: {e}", exc_info=True)
-        log_webhook_event(event_id, 'invoice.payment_succeeded', None, 'error', str(e))
+    
+    logger.info("✅ Invoice %s recorded as paid", invoice['id'])
+    return invoice.get('subscription')
 
-def handle_invoice_failed(invoice, event_id):
+def handle_invoice_failed(invoice, event_id, event_created=None):
     """Handle failed invoice payment"""
-    logger.warning(f"💸 Processing invoice payment failed: {invoice['id']}")
+    logger.warning("💸 Processing invoice payment failed: %s", invoice['id'])
     
-    try:
-        from .models import Invoice, UserSubscription
-        
-        # Create or update invoice record
-        invoice_obj, created = Invoice.objects.get_or_create(
-            stripe_invoice_id=invoice['id'],
-            defaults={
-                'customer_email': invoice.get('customer_email', ''),
-                'amount': invoice['amount_due'] / 100,
-                'status': 'payment_failed',
-                'currency': invoice.get('currency', 'usd')
-            }
-        )
-        
-        if not created:
-            invoice_obj.status = 'payment_failed'
-            invoice_obj.save()
-        
-        # Update related subscription status
-        if invoice.get('subscription'):
-            try:
-                subscription = UserSubscription.objects.get(
-                    stripe_subscription_id=invoice['subscription']
-                )
-                subscription.status = 'past_due'
-                subscription.save()
-                logger.info(f"⚠️ Subscription {invoice['subscription']} marked as past_due due to failed invoice")
-            except UserSubscription.DoesNotExist:
-                pass
-        
-        logger.info(f"✅ Failed invoice {invoice['id']} processed")
-        log_webhook_event(event_id, 'invoice.payment_failed', None, 'success')
-        
-    except Exception as e:
-        logger.error(f"❌ Error processing failed invoice: {e}", exc_info=True)
-        log_webhook_event(event_id, 'invoice.payment_failed', None, 'error', str(e))
+    # Create or update invoice record
+    upsert_invoice(invoice, INVOICE_FAILED_UPDATE_FIELDS, **invoice_failed_fields(invoice))
+    
+    # Update related subscription status
+    if invoice.get('subscription'):
+        if update_subscription(
+            {'stripe_subscription_id': invoice['subscription']},
+            event_created=event_created,
+            status='past_due'
+        ):
+            logger.info("⚠️ Subscription %s marked as past_due due to failed invoice", invoice['subscription'])
+    
+    logger.info("✅ Failed invoice %s processed", invoice['id'])
+    return invoice.get('subscription')
 
-def handle_trial_ending(subscription, event_id):
+def handle_trial_ending(subscription, event_id, event_created=None):
     """Handle trial period ending soon"""
-    logger.info(f"⏰ Processing trial ending: {subscription['id']}")
+    logger.info("⏰ Processing trial ending: %s", subscription['id'])
     
-    try:
-        from .models import UserSubscription
-        
-        try:
-            user_subscription = UserSubscription.objects.get(
-                stripe_subscription_id=subscription['id']
-            )
-            
-            # You can add logic here to send trial ending notifications
-            logger.info(f"⚠️ Trial ending soon for subscription {subscription['id']}")
-            log_webhook_event(event_id, 'customer.subscription.trial_will_end', user_subscription.id, 'success')
-            
-        except UserSubscription.DoesNotExist:
-            logger.error(f"❌ UserSubscription not found for trial ending: {subscription['id']}")
-            
-    except Exception as e:
-        logger.error(f"❌ Error processing trial ending: {e}", exc_info=True)
-        log_webhook_event(event_id, 'customer.subscription.trial_will_end', None, 'error', str(e))
+    from .models import UserSubscription
+    
+    if UserSubscription.objects.filter(stripe_subscription_id=subscription['id']).exists():
+        # You can add logic here to send trial ending notifications
+        logger.info("⚠️ Trial ending soon for subscription %s", subscription['id'])
+    else:
+        logger.error("❌ UserSubscription not found for trial ending: %s", subscription['id'])
+    
+    return subscription['id']
 
 def log_webhook_event(event_id, event_type, subscription_id, status, error_message=None):
     """Log webhook events for monitoring and debugging"""
     try:
         from .models import WebhookEvent
         
-        WebhookEvent.objects.create(
-            stripe_event_id=event_id,
-            event_type=event_type,
-            subscription_id=subscription_id,
-            status=status,
-            error_message=error_message,
-            processed_at=timezone.now()
-        )
+        fields = {
+            'event_type': event_type,
+            'subscription_id': subscription_id,
+            'status': status,
+            'error_message': error_message or '',
+            'processed_at': timezone.now(),
+        }
+        
+        # The event was claimed up front, so this is normally a single UPDATE
+        if not WebhookEvent.objects.filter(stripe_event_id=event_id).update(**fields):
+            WebhookEvent.objects.create(stripe_event_id=event_id, **fields)
+        
+        if status == 'error':
+            release_event(event_id)
         
     except Exception as e:
         logger.error(f"❌ Failed to log webhook event: {e}")
 
+TRANSACTION_STATEMENTS = {'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE'}
+
+# Maximum queries per event (excluding the idempotency claim), checked by query_budget()
+# and by tests/test_webhook_queries.py. An event that leaves status and price alone costs
+# three: the version read, the conditional UPDATE and the WebhookEvent outcome. A status or
+# price change adds one rollup counter UPDATE and the SubscriptionHistory INSERT; neither
+# can ride on the subscription UPDATE because they live in other tables. Invoices add the
+# locking read of the previous row (its rollup contribution), the upsert and a daily
+# rollup UPDATE.
+QUERY_BUDGETS = {
+    'payment_intent.succeeded': 5,
+    'payment_intent.payment_failed': 5,
+    'customer.subscription.created': 5,
+    'customer.subscription.updated': 5,
+    'customer.subscription.deleted': 5,
+    'invoice.payment_succeeded': 5,
+    'invoice.payment_failed': 8,
+    'customer.subscription.trial_will_end': 2,
+}
+
+EVENT_HANDLERS = {
+    'payment_intent.succeeded': handle_payment_succeeded,
+    'payment_intent.payment_failed': handle_payment_failed,
+    'customer.subscription.created': handle_subscription_created,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_cancelled,
+    'invoice.payment_succeeded': handle_invoice_paid,
+    'invoice.payment_failed': handle_invoice_failed,
+    'customer.subscription.trial_will_end': handle_trial_ending,
+}
+
 # Health check endpoint for webhook
 def webhook_health(request):
     """Simple health check for webhook endpoint"""
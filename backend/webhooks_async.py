@@ -0,0 +1,115 @@
+# webhooks_async.py - Native async Stripe webhook view for ASGI deployments
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+import json
+import logging
+import stripe
+
+from .idempotency import claim_event, recent_events
+from .webhook_logging import bind_event, unbind_event
+from .webhook_payload import WebhookEnvelope, decode_event
+from .webhooks import dispatch_event, queued_subscription_id
+
+logger = logging.getLogger(__name__)
+
+# Handlers lock rows and write rollups in one transaction, which the async ORM cannot do
+# in this Django version, so they run on a bounded pool. Its size caps the database
+# connections the handlers hold, however many deliveries are in flight.
+handler_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'STRIPE_WEBHOOK_ASYNC_HANDLER_THREADS', 8),
+    thread_name_prefix='webhook-handler',
+)
+
+def run_handlers(event):
+    """Dispatch on a pool thread, dropping its connection if it went stale or exceeded CONN_MAX_AGE"""
+    close_old_connections()
+    dispatch_event(event)
+
+dispatch_async = sync_to_async(run_handlers, thread_sensitive=False, executor=handler_pool)
+
+def run_claim(event_id, event_type, status, event, subscription_id):
+    """claim_event() on a pool thread; storing the payload and the claim needs one transaction"""
+    close_old_connections()
+    return claim_event(event_id, event_type, status=status, event=event, subscription_id=subscription_id)
+
+claim_async = sync_to_async(run_claim, thread_sensitive=False, executor=handler_pool)
+
+async def aclaim_event(event_id, event_type, status='processing', event=None, subscription_id=None):
+    """claim_event() for the async view; known duplicates are answered without leaving the event loop"""
+    if event_id in recent_events:
+        return False
+    return await claim_async(event_id, event_type, status, event, subscription_id)
+
+def verify_event(payload, sig_header, secret):
+    """Signature check and decode; plain CPU work, so safe to run on the event loop"""
+    if getattr(settings, 'STRIPE_WEBHOOK_FAST_DECODE', False):
+        event = decode_event(payload, sig_header, secret)
+        return event, event.payload
+    event = WebhookEnvelope.from_event(stripe.Webhook.construct_event(payload, sig_header, secret))
+    return event, json.loads(payload)
+
+async def stripe_webhook_async(request):
+    """
+    Async twin of webhooks.stripe_webhook for ASGI servers.
+
+    A delivery only occupies a thread while it is claimed and while its handler runs;
+    verification and early duplicate detection run on the event loop.
+    """
+    # require_POST/csrf_exempt wrap views in sync functions in this Django version
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    endpoint_secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', None)
+    if not endpoint_secret:
+        logger.error('❌ STRIPE_WEBHOOK_SECRET not configured')
+        return HttpResponseBadRequest('Webhook secret not configured')
+
+    log_context = None
+    try:
+        event, raw_event = verify_event(request.body, request.META.get('HTTP_STRIPE_SIGNATURE'), endpoint_secret)
+        # The handler thread runs in a copy of this context, so its lines are tagged too
+        log_context = bind_event(event.id, event.type)
+        logger.info("📡 Received Stripe webhook: %s - %s", event.type, event.id)
+
+        if getattr(settings, 'STRIPE_WEBHOOK_ASYNC_PROCESSING', False):
+            # Ack immediately; a webhook worker runs the handlers later
+            if await aclaim_event(event.id, event.type, status='pending', event=raw_event,
+                                  subscription_id=queued_subscription_id(event)):
+                logger.info("📥 Queued webhook %s for processing", event.id)
+            else:
+                logger.info("↩️ Webhook %s already queued", event.id)
+            return HttpResponse('Webhook queued', status=200)
+
+        if not getattr(settings, 'STRIPE_WEBHOOK_STORE_PAYLOADS', True):
+            raw_event = None
+
+        # Stripe redelivers events; skip any we have already claimed
+        if not await aclaim_event(event.id, event.type, event=raw_event):
+            logger.info("↩️ Duplicate webhook ignored: %s", event.id)
+            return HttpResponse('Duplicate webhook ignored', status=200)
+
+        await dispatch_async(event)
+
+        logger.info("✅ Successfully processed webhook: %s", event.id)
+        return HttpResponse('Webhook processed successfully', status=200)
+
+    except ValueError as e:
+        logger.error("❌ Invalid webhook payload: %s", e)
+        return HttpResponseBadRequest("Invalid payload")
+
+    except stripe.error.SignatureVerificationError as e:
+        logger.error("❌ Invalid webhook signature: %s", e)
+        return HttpResponseBadRequest("Invalid signature")
+
+    except Exception as e:
+        logger.error("❌ Webhook processing error: %s", e, exc_info=True)
+        return HttpResponseBadRequest(f"Webhook error: {str(e)}")
+
+    finally:
+        unbind_event(log_context)
+
+# csrf_exempt() would hide the coroutine the same way; Stripe cannot send a CSRF token
+stripe_webhook_async.csrf_exempt = True